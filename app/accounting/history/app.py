@@ -3,30 +3,16 @@ import json
 from flask import Flask
 import requests
 from opentelemetry import trace
-from opentelemetry.instrumentation.flask import FlaskInstrumentor
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.sdk.resources import Resource
+from common import client
+from common.service import init_service
 
 app = Flask(__name__)
 
 # Parameterized configuration
 SERVICE_NAME = "accounting-history"
-OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
 
-# Set up OpenTelemetry
-resource = Resource(attributes={"service.name": SERVICE_NAME, "team": "accounting"})
-trace.set_tracer_provider(TracerProvider(resource=resource))
-tracer = trace.get_tracer(__name__)
-otlp_exporter = OTLPSpanExporter(endpoint=OTLP_ENDPOINT)
-span_processor = BatchSpanProcessor(otlp_exporter)
-trace.get_tracer_provider().add_span_processor(span_processor)
-
-# Instrument Flask and requests
-FlaskInstrumentor().instrument_app(app)
-RequestsInstrumentor().instrument()
+# Set up OpenTelemetry, RED metrics and /metrics
+tracer = init_service(app, SERVICE_NAME, team="accounting")
 
 @app.route('/list-transactions', methods=['GET'])
 def list_transactions():
@@ -39,7 +25,7 @@ def list_transactions():
         # Intra-team call: accounting-ledger's /log-transaction-history (direct)
         with tracer.start_as_current_span("call-log-transaction-history"):
             try:
-                resp = requests.get('http://app-accounting-ledger:5000/log-transaction-history')
+                resp = client.get('http://app-accounting-ledger:5000/log-transaction-history')
                 response_text += f"Called log-transaction-history: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling log-transaction-history: {str(e)}\n"
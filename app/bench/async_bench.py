@@ -0,0 +1,213 @@
+"""
+Concurrent-request capacity of the threaded and the async runtime.
+
+A two-service topology is served over real sockets: `bench-edge` /wait calls
+`bench-backend` /sleep, which takes --latency-ms (a slow dependency, or a
+chaos delay). The backend always runs on the async runtime so it is never
+the bottleneck; the edge runs once under Gunicorn (gthread, one worker, 64
+threads, as in the Dockerfile) and once under uvicorn with common.asgi. For
+each --concurrency level, that many connections each send one request to
+/wait at the same moment, and the run reports how many finished within
+--timeout with a working downstream call, their p50/p99 latency, and the
+edge process's peak thread count and resident memory, per request in flight
+above its idle size.
+
+The edge listens on 127.0.0.1:5000 and the backend on 127.0.0.2:5000 (call
+URLs always use port 5000), so both ports must be free. Tracing is disabled
+(OTEL_SDK_DISABLED) as there is no collector, and so are the limiter and the
+threaded client's bulkhead, so that threads are the only limit.
+
+    python bench/async_bench.py [--concurrency 50,200,800] [--latency-ms 1000] [--timeout 10]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EDGE = ("bench-edge", "127.0.0.1")
+BACKEND = ("bench-backend", "127.0.0.2")
+RUNTIMES = {
+    "threads": ["gunicorn", "--worker-class", "gthread", "--workers", "1", "--threads", "64",
+                "--keep-alive", "75", "--bind", "{host}:5000", "generic.app:app"],
+    "async": ["uvicorn", "--factory", "common.asgi:create_app", "--host", "{host}", "--port", "5000",
+              "--timeout-keep-alive", "75", "--log-level", "warning"],
+}
+
+
+def write_topology(path, latency_ms):
+    topology = {"services": {
+        EDGE[0]: {"team": "bench", "host": EDGE[1], "routes": {"/wait": {
+            "methods": ["GET"],
+            "calls": [{"name": "call-sleep", "service": BACKEND[0], "route": "/sleep"}],
+        }}},
+        BACKEND[0]: {"team": "bench", "host": BACKEND[1], "routes": {"/sleep": {
+            "methods": ["GET"], "latency": {"dist": "fixed", "ms": latency_ms},
+        }}},
+    }}
+    with open(path, "w") as f:
+        yaml.safe_dump(topology, f)
+
+
+def start(runtime, service, topology_file):
+    name, host = service
+    env = {**os.environ, "SERVICE_NAME": name, "TOPOLOGY_FILE": topology_file,
+           "OTEL_SDK_DISABLED": "true", "LIMITER": "off", "BULKHEAD_MAX_CONCURRENT": "100000"}
+    command = [arg.format(host=host) for arg in RUNTIMES[runtime]]
+    proc = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, 5000), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{runtime} {name} did not start on {host}:5000")
+
+
+def stop(proc):
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def serving_pid(proc):
+    # Gunicorn serves from a worker process forked by the master
+    path = f"/proc/{proc.pid}/task/{proc.pid}/children"
+    children = open(path).read().split() if os.path.exists(path) else []
+    return int(children[0]) if children else proc.pid
+
+
+def process_status(pid):
+    # (resident KiB, threads) from /proc
+    rss = threads = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+            elif line.startswith("Threads:"):
+                threads = int(line.split()[1])
+    return rss, threads
+
+
+class Sampler(threading.Thread):
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = self.peak_threads = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            rss, threads = process_status(self.pid)
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_threads = max(self.peak_threads, threads)
+            time.sleep(self.interval)
+
+
+async def one_request(host, timeout):
+    # (ok, seconds): a 200 whose downstream call worked, within the timeout
+    start = time.perf_counter()
+    try:
+        async with asyncio.timeout(timeout):
+            reader, writer = await asyncio.open_connection(host, 5000)
+            writer.write(f"GET /wait HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+        # The handler answers 200 with "Error calling sleep" when the call failed
+        ok = response.startswith(b"HTTP/1.1 200") and b"Error calling" not in response
+        return ok, time.perf_counter() - start
+    except (OSError, TimeoutError):
+        return False, time.perf_counter() - start
+
+
+async def burst(host, concurrency, timeout):
+    return await asyncio.gather(*(one_request(host, timeout) for _ in range(concurrency)))
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else float("nan")
+
+
+def bench_runtime(runtime, topology_file, levels, timeout):
+    edge = start(runtime, EDGE, topology_file)
+    results = []
+    try:
+        pid = serving_pid(edge)
+        asyncio.run(burst(EDGE[1], 4, timeout))  # warm up imports and pools
+        for concurrency in levels:
+            idle_rss, _ = process_status(pid)
+            sampler = Sampler(pid)
+            sampler.start()
+            start_time = time.perf_counter()
+            outcomes = asyncio.run(burst(EDGE[1], concurrency, timeout))
+            elapsed = time.perf_counter() - start_time
+            sampler.running = False
+            sampler.join()
+            ok = sorted(seconds for succeeded, seconds in outcomes if succeeded)
+            results.append({
+                "runtime": runtime,
+                "concurrency": concurrency,
+                "ok": len(ok),
+                "failed": concurrency - len(ok),
+                "p50_ms": percentile(ok, 0.5) * 1000,
+                "p99_ms": percentile(ok, 0.99) * 1000,
+                "rps": len(ok) / elapsed,
+                "threads": sampler.peak_threads,
+                "peak_rss_mib": sampler.peak_rss / 1024,
+                "kib_per_request": max(0, sampler.peak_rss - idle_rss) / concurrency,
+            })
+            # Let timed-out requests drain before the next level
+            time.sleep(timeout / 2)
+    finally:
+        stop(edge)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", default="50,200,800", help="comma-separated connection counts")
+    parser.add_argument("--latency-ms", type=float, default=1000, help="backend /sleep latency")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds a request may take")
+    parser.add_argument("--runtime", choices=sorted(RUNTIMES), action="append", help="default: both")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        topology_file = os.path.join(tmp, "topology.yaml")
+        write_topology(topology_file, args.latency_ms)
+        backend = start("async", BACKEND, topology_file)
+        try:
+            print(f"{'runtime':<8} {'conns':>6} {'ok':>6} {'failed':>6} {'p50 ms':>8} {'p99 ms':>8} "
+                  f"{'req/s':>7} {'threads':>7} {'RSS MiB':>8} {'KiB/req':>8}")
+            for runtime in args.runtime or ("threads", "async"):
+                for r in bench_runtime(runtime, topology_file, levels, args.timeout):
+                    results.append(r)
+                    print(f"{r['runtime']:<8} {r['concurrency']:>6} {r['ok']:>6} {r['failed']:>6} "
+                          f"{r['p50_ms']:>8.0f} {r['p99_ms']:>8.0f} {r['rps']:>7.1f} {r['threads']:>7} "
+                          f"{r['peak_rss_mib']:>8.1f} {r['kib_per_request']:>8.1f}")
+        finally:
+            stop(backend)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Bytes on the wire against CPU time for each response encoding.
+
+Drives every public route of the in-process topology (see
+topology_bench.py) once per encoding, with the shared client asking
+downstream services for the same encoding. For each route it reports the
+bytes of the response returned to NGINX, the bytes sent over all hops
+between services, and the CPU time per request. --inflate adds that many
+bytes to every service response (a fault profile), to see how the trade-off
+moves with payload size; the chaos payload is --inflate 45000000.
+
+    python bench/compression_bench.py [-n 50] [--inflate 20000] [--json out.json]
+"""
+import argparse
+import json
+import statistics
+import time
+
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from topology_bench import build_topology, route_method
+
+from common import client, compression
+
+
+def hop_bytes():
+    # Body bytes written by all services so far: encoded size when
+    # compressed, raw size otherwise
+    with compression.response_bytes.lock:
+        return sum(
+            value for (_, route, encoding, stage), value in compression.response_bytes.values.items()
+            if route != "/metrics" and (stage == "encoded" or encoding == "identity")
+        )
+
+
+def bench_route(transport, exporter, target, encoding, iterations):
+    url, netloc, path = target
+    method = route_method(transport, netloc, path)
+    headers = {"X-Forwarded-For": "8.8.8.8", "Accept-Encoding": encoding}
+    client.session.headers["Accept-Encoding"] = encoding
+    transport.call(netloc, method, path, headers)
+
+    wire, cpu = [], []
+    before = hop_bytes()
+    for _ in range(iterations):
+        c0 = time.process_time()
+        _, _, _, content = transport.call(netloc, method, path, headers)
+        cpu.append(time.process_time() - c0)
+        wire.append(len(content))
+        exporter.clear()
+    return {
+        "endpoint": url,
+        "encoding": encoding,
+        "response_bytes": statistics.mean(wire),
+        "hop_bytes": (hop_bytes() - before) / iterations,
+        "cpu_ms": statistics.mean(cpu) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--iterations", type=int, default=50)
+    parser.add_argument("--inflate", type=int, default=0, help="bytes added to every service response")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    exporter = InMemorySpanExporter()
+    transport, targets = build_topology(exporter)
+    if args.inflate:
+        for app in transport.apps.values():
+            app.extensions["faults"].configure(
+                {"routes": {"*": {"inflate": {"rate": 1.0, "bytes": args.inflate}}}}
+            )
+
+    encodings = ("identity",) + compression.ENCODINGS
+    results = []
+    print(f"{'endpoint':<52} {'encoding':<9} {'response B':>11} {'all hops B':>11} {'cpu ms':>8}")
+    with transport.installed():
+        for target in targets:
+            for encoding in encodings:
+                r = bench_route(transport, exporter, target, encoding, args.iterations)
+                results.append(r)
+                print(f"{r['endpoint']:<52} {encoding:<9} {r['response_bytes']:>11.0f} "
+                      f"{r['hop_bytes']:>11.0f} {r['cpu_ms']:>8.3f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
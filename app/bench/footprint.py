@@ -0,0 +1,124 @@
+"""
+Memory and startup cost of one process per service versus host.py.
+
+Starts the 13 services once as 13 Python processes (as docker-compose.yaml
+runs them, minus the containers) and once as a single host.py process, and
+reports for each layout:
+
+  * time from spawn until every service answers GET /metrics
+  * total RSS, and PSS where /proc/<pid>/smaps_rollup is readable
+
+Spans are exported to an unreachable collector; that only adds log noise.
+
+    python bench/footprint.py [--port-offset 30000] [--json out.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from common.services import SERVICES
+
+# Serve one service the way its container does, on a chosen port
+SINGLE = (
+    "import sys; sys.path.insert(0, {app_dir!r});"
+    "from common.services import load_service;"
+    "load_service({path!r}).app.run(host='127.0.0.1', port={port}, threaded=True)"
+)
+
+
+def memory_kib(pid):
+    # (RSS, PSS) of one process in KiB; PSS is None if smaps_rollup is missing
+    rss = pss = None
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    pss = int(line.split()[1])
+    except OSError:
+        pass
+    return rss, pss
+
+
+def wait_ready(ports, timeout):
+    deadline = time.perf_counter() + timeout
+    pending = set(ports)
+    while pending:
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"ports {sorted(pending)} not ready after {timeout}s")
+        for port in list(pending):
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1) as resp:
+                    if resp.status == 200:
+                        pending.discard(port)
+            except OSError:
+                pass
+        time.sleep(0.05)
+
+
+def measure(commands, ports, settle, timeout):
+    env = dict(os.environ, OTEL_EXPORTER_OTLP_ENDPOINT="http://127.0.0.1:9/v1/traces")
+    start = time.perf_counter()
+    procs = [
+        subprocess.Popen(cmd, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for cmd in commands
+    ]
+    try:
+        wait_ready(ports, timeout)
+        ready = time.perf_counter() - start
+        time.sleep(settle)
+        rss, pss = zip(*(memory_kib(p.pid) for p in procs))
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+    return {
+        "processes": len(procs),
+        "ready_s": ready,
+        "rss_mib": sum(rss) / 1024,
+        "pss_mib": sum(pss) / 1024 if None not in pss else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port-offset", type=int, default=30000)
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds to wait before reading memory")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    ports = [port + args.port_offset for _, _, port, _ in SERVICES]
+    per_service = [
+        [sys.executable, "-c", SINGLE.format(app_dir=APP_DIR, path=path, port=port)]
+        for (path, _, _, _), port in zip(SERVICES, ports)
+    ]
+    host = [[sys.executable, os.path.join(APP_DIR, "host.py"), "--bind", "127.0.0.1",
+             "--port-offset", str(args.port_offset)]]
+
+    results = {
+        "per-service": measure(per_service, ports, args.settle, args.timeout),
+        "host": measure(host, ports, args.settle, args.timeout),
+    }
+    print(f"{'layout':<12} {'procs':>5} {'ready':>8} {'RSS':>10} {'PSS':>10}")
+    for layout, r in results.items():
+        pss = f"{r['pss_mib']:8.1f}MB" if r["pss_mib"] is not None else f"{'n/a':>10}"
+        print(f"{layout:<12} {r['processes']:>5} {r['ready_s']:7.2f}s {r['rss_mib']:8.1f}MB {pss}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Tail latency with and without hedged requests.
+
+Two in-process replicas of payments-currency serve /convert-currency. Each
+has a seeded fault profile that stalls a small fraction of requests (a GC
+pause or a noisy neighbour), with different seeds so the replicas stall on
+different requests. The same sequence of calls is made once as
+plain client calls and once with hedging to the second replica, and the
+latency percentiles are reported against the extra requests hedging cost.
+
+Callers and both replicas share one GIL here, so with --concurrency above 1
+every hand-off to the hedging thread pool waits for the GIL and the median
+suffers in a way it would not with real network calls.
+
+    python bench/hedging_bench.py [-n 3000] [--stall-rate 0.02] [--budget 0.1]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+from common import client, hedging, telemetry
+from common.services import load_service
+from common.transport import LocalTransport
+
+PRIMARY = "app-payment-currency:5000"
+REPLICA = "app-payment-currency-2:5000"
+URL = f"http://{PRIMARY}/convert-currency"
+
+
+class DiscardExporter(SpanExporter):
+    # Keeping every span in memory would slow later runs down through GC
+    def export(self, spans):
+        return SpanExportResult.SUCCESS
+
+
+def build(args):
+    telemetry.span_exporter = DiscardExporter()
+    transport = LocalTransport()
+    for seed, netloc in enumerate((PRIMARY, REPLICA)):
+        app = load_service("payment/currency").app
+        app.extensions["faults"].configure({"seed": seed, "routes": {"/convert-currency": {
+            "latency": {"rate": args.stall_rate, "dist": "fixed", "ms": args.stall_ms},
+        }}})
+        transport.apps[netloc] = app
+    return transport
+
+
+def run(call, total, concurrency):
+    latencies = []
+    lock = threading.Lock()
+    per_worker = total // concurrency
+
+    def worker():
+        own = []
+        for _ in range(per_worker):
+            start = time.perf_counter()
+            call()
+            own.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return latencies
+
+
+def pct(latencies, p):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--stall-rate", type=float, default=0.02, help="fraction of requests that stall")
+    parser.add_argument("--stall-ms", type=float, default=100.0)
+    parser.add_argument("--budget", type=float, default=0.1, help="hedges per request")
+    parser.add_argument("--percentile", type=float, default=95.0, help="hedge after this latency percentile")
+    args = parser.parse_args()
+
+    transport = build(args)
+    sent = [0]
+    count_lock = threading.Lock()
+
+    def counted_send(method, url, **kwargs):
+        with count_lock:
+            sent[0] += 1
+        return client.send(method, url, **kwargs)
+
+    hedger = hedging.Hedger(percentile=args.percentile, budget=args.budget, replicas={PRIMARY: [REPLICA]})
+    modes = {
+        "plain": lambda: counted_send("GET", URL),
+        "hedged": lambda: hedger.run(counted_send, "bench", "GET", URL),
+    }
+    print(f"{'mode':<8} {'p50 ms':>8} {'p99 ms':>8} {'p99.9 ms':>9} {'max ms':>8} {'requests/call':>14}")
+    with transport.installed():
+        for mode, call in modes.items():
+            sent[0] = 0
+            latencies = run(call, args.requests, args.concurrency)
+            print(f"{mode:<8} {pct(latencies, 50):>8.2f} {pct(latencies, 99):>8.2f} "
+                  f"{pct(latencies, 99.9):>9.2f} {latencies[-1] * 1000:>8.2f} "
+                  f"{sent[0] / len(latencies):>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Backend work done for a retry storm with and without Idempotency-Key.
+
+Each POST route in the Locust ENDPOINTS table is driven the way a client in
+a retry storm would: every logical operation is sent --copies times, the
+first --concurrent of them at once and the rest one after another once
+those returned (late retries). Every downstream service gets --latency-ms of
+injected latency so the concurrent copies overlap. The run is done once
+without a key and once with a fresh key per operation, and the spans
+produced per operation (every handler and call span in every service the
+request reaches) are reported for both, with the wall time of the batch.
+
+    python bench/idempotency_bench.py [-n 20] [--copies 4] [--concurrent 3] [--latency-ms 50]
+"""
+import argparse
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from topology_bench import build_topology, route_method
+
+from common import idempotency
+
+
+def storm(transport, netloc, method, path, copies, concurrent, key):
+    headers = {"X-Forwarded-For": "8.8.8.8"}
+    if key:
+        headers[idempotency.HEADER] = key
+    with ThreadPoolExecutor(max_workers=concurrent) as pool:
+        statuses = list(pool.map(
+            lambda _: transport.call(netloc, method, path, headers)[0], range(concurrent)
+        ))
+    for _ in range(copies - concurrent):
+        statuses.append(transport.call(netloc, method, path, headers)[0])
+    return statuses
+
+
+def bench_route(transport, exporter, target, args):
+    label, netloc, path = target
+    method = route_method(transport, netloc, path)
+    result = {"endpoint": label}
+    for mode in ("none", "key"):
+        exporter.clear()
+        start = time.perf_counter()
+        failed = 0
+        for _ in range(args.iterations):
+            key = uuid.uuid4().hex if mode == "key" else None
+            statuses = storm(transport, netloc, method, path, args.copies, args.concurrent, key)
+            failed += sum(status >= 500 for status in statuses)
+        result[f"{mode}_spans"] = len(exporter.get_finished_spans()) / args.iterations
+        result[f"{mode}_ms"] = (time.perf_counter() - start) * 1000 / args.iterations
+        result[f"{mode}_failed"] = failed
+    exporter.clear()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--iterations", type=int, default=20, help="logical operations per route")
+    parser.add_argument("--copies", type=int, default=4, help="requests sent per operation")
+    parser.add_argument("--concurrent", type=int, default=3, help="copies sent at the same time")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+    args.concurrent = max(1, min(args.concurrent, args.copies))
+
+    exporter = InMemorySpanExporter()
+    transport, targets = build_topology(exporter)
+    for app in transport.apps.values():
+        app.extensions["faults"].configure({"routes": {"*": {
+            "latency": {"rate": 1.0, "dist": "fixed", "ms": args.latency_ms},
+        }}})
+    targets = [t for t in targets if route_method(transport, t[1], t[2]) == "POST"]
+
+    results = []
+    print(f"{'endpoint':<52} {'spans':>6} {'ms':>7} {'keyed':>6} {'ms':>7} {'saved':>6}")
+    with transport.installed():
+        for target in targets:
+            r = bench_route(transport, exporter, target, args)
+            results.append(r)
+            saved = 1 - r["key_spans"] / r["none_spans"] if r["none_spans"] else 0
+            print(f"{r['endpoint']:<52} {r['none_spans']:>6.1f} {r['none_ms']:>7.0f} "
+                  f"{r['key_spans']:>6.1f} {r['key_ms']:>7.0f} {saved:>6.1%}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
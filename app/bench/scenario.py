@@ -0,0 +1,73 @@
+"""
+Generate synthetic topologies for scaling experiments.
+
+Builds a chain of --depth services. Every service except the last calls the
+next one --fanout times per request, sequentially or with --parallel, so a
+request to the root touches sum(fanout**i for i < depth) service handlers.
+--repeat makes each of those calls that many times in a row, the way a
+handler looping over items would (multiply fanout by it in the sum above):
+
+    python bench/scenario.py --depth 10 --fanout 1 -o deep.yaml        # 10-hop chain
+    python bench/scenario.py --depth 2 --fanout 20 --parallel -o wide.yaml
+    python bench/topology_bench.py --topology wide.yaml
+    python bench/scenario.py --depth 2 --repeat 50 -o loop.yaml
+"""
+import argparse
+import sys
+
+import yaml
+
+
+def scenario(depth, fanout, parallel, cpu_ms, latency_ms, payload_bytes, response_bytes, repeat=1):
+    services = {}
+    for level in range(depth):
+        spec = {
+            "methods": ["GET", "POST"],
+            "cpu_ms": cpu_ms,
+            "latency": {"dist": "lognormal", "median_ms": latency_ms, "sigma": 0.5} if latency_ms else None,
+            "response_bytes": response_bytes,
+            "parallel": parallel,
+            "calls": [
+                {
+                    "name": f"call-level-{level + 1}-{i}",
+                    "service": f"level-{level + 1}",
+                    "route": "/work",
+                    "method": "POST" if payload_bytes else "GET",
+                    "payload_bytes": payload_bytes,
+                    **({"repeat": repeat} if repeat > 1 else {}),
+                }
+                for i in range(fanout)
+            ] if level + 1 < depth else [],
+        }
+        services[f"level-{level}"] = {
+            "team": "scenario",
+            "routes": {"/work": {k: v for k, v in spec.items() if v not in (None, [], 0)}},
+        }
+    return {"services": services}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=1)
+    parser.add_argument("--parallel", action="store_true", help="issue each level's calls concurrently")
+    parser.add_argument("--cpu-ms", type=float, default=0.0, help="CPU burned per handler")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="median extra latency per handler")
+    parser.add_argument("--payload-bytes", type=int, default=0, help="request body size of each call")
+    parser.add_argument("--response-bytes", type=int, default=0, help="response size of each handler")
+    parser.add_argument("--repeat", type=int, default=1, help="times each call is made in a row")
+    parser.add_argument("-o", "--output", help="write here instead of stdout")
+    args = parser.parse_args()
+
+    if args.depth < 1 or args.fanout < 1:
+        parser.error("--depth and --fanout must be at least 1")
+    topology = scenario(args.depth, args.fanout, args.parallel, args.cpu_ms, args.latency_ms,
+                        args.payload_bytes, args.response_bytes, args.repeat)
+    out = open(args.output, "w") if args.output else sys.stdout
+    yaml.safe_dump(topology, out, sort_keys=False)
+    if args.output:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Throughput of bulk settlement jobs as worker processes are added.
+
+Writes --payments synthetic payments (mixed currencies, a few malformed or
+out of range) as NDJSON and settles them with common/settlement.py once per
+--workers count: 0 runs the convert and gateway stages in their threads,
+N in a pool of N processes. Each run reports payments per second and the
+speedup over one worker. Spans go nowhere (no tracer provider), so this
+measures the pipeline alone.
+
+With --resume-check, a job is then started in a child process that is
+killed (SIGKILL) once it has committed a few batches. The job is resumed
+here from its checkpoint, and every payment must appear in the results
+exactly once.
+
+    python bench/settlement_bench.py [--payments 200000] [--workers 0,1,2,4] [--batch-size 1000] [--resume-check]
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from opentelemetry import trace
+
+from common import settlement
+
+SERVICE_NAME = "payments-processor"
+CURRENCIES = list(settlement.RATES) + ["XXX"]
+
+
+def write_payments(path, count, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for i in range(count):
+            if rng.random() < 0.001:
+                f.write("{not json\n")
+                continue
+            amount = f"{rng.lognormvariate(4, 1.5):.2f}" if rng.random() > 0.001 else "-1"
+            f.write(json.dumps({"id": f"pay-{i}", "amount": amount, "currency": rng.choice(CURRENCIES),
+                                "merchant": f"m-{rng.randrange(1000)}"}) + "\n")
+
+
+def settle(directory, input_path, workers, batch_size):
+    # The finished job's state
+    settlements = settlement.Settlements(SERVICE_NAME, trace.get_tracer(__name__), directory, workers, batch_size)
+    with open(input_path, "rb") as f:
+        job = settlements.submit(f)
+    job.finished.wait()
+    return job.status()
+
+
+def resume_check(tmp, input_path, payments, batch_size):
+    directory = os.path.join(tmp, "resume")
+    child = subprocess.Popen([sys.executable, __file__, "--child", directory, input_path,
+                              "--batch-size", str(batch_size)])
+    try:
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline:
+            states = [os.path.join(directory, name, "state.json") for name in os.listdir(directory)] \
+                if os.path.isdir(directory) else []
+            try:
+                with open(states[0]) as f:
+                    if json.load(f)["batches"] >= 3:
+                        break
+            except (IndexError, OSError, ValueError):
+                pass
+            time.sleep(0.01)
+        else:
+            raise RuntimeError("the child did not commit any batches")
+        os.kill(child.pid, signal.SIGKILL)
+    finally:
+        child.wait()
+    settlements = settlement.Settlements(SERVICE_NAME, trace.get_tracer(__name__), directory, 1, batch_size)
+    (job,) = settlements.jobs.values()
+    interrupted_at = job.state["batches"]
+    settlements.resume_interrupted()
+    job.finished.wait()
+    ids = []
+    with open(job.path("results.ndjson")) as f:
+        for line in f:
+            ids.append(json.loads(line)["id"])
+    named = [payment_id for payment_id in ids if payment_id is not None]
+    ok = job.state["state"] == "done" and len(ids) == payments and len(named) == len(set(named))
+    print(f"resume: killed after {interrupted_at} batches, {len(ids)} results for {payments} payments, "
+          f"{len(named) - len(set(named))} duplicates: {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--payments", type=int, default=200000)
+    parser.add_argument("--workers", default=",".join(str(n) for n in [0, 1, 2, 4, 8, 16]
+                                                      if n <= (os.cpu_count() or 1) or n <= 2))
+    parser.add_argument("--batch-size", type=int, default=settlement.BATCH_SIZE)
+    parser.add_argument("--resume-check", action="store_true")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--child", nargs=2, metavar=("DIRECTORY", "INPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        settle(*args.child, 1, args.batch_size)
+        return 0
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "payments.ndjson")
+        write_payments(input_path, args.payments)
+        print(f"{args.payments} payments, {os.path.getsize(input_path) / 2**20:.1f} MiB, "
+              f"batches of {args.batch_size}, {os.cpu_count()} CPUs")
+        print(f"{'workers':>7} {'seconds':>8} {'payments/s':>11} {'speedup':>8}")
+        single = None
+        for workers in [int(n) for n in args.workers.split(",")]:
+            state = settle(os.path.join(tmp, f"workers-{workers}"), input_path, workers, args.batch_size)
+            if state["state"] != "done":
+                raise RuntimeError(f"job {state['state']}: {state['error']}")
+            rate = (state["settled"] + state["rejected"]) / state["seconds"]
+            if workers == 1:
+                single = rate
+            results.append({"workers": workers, "seconds": state["seconds"], "payments_per_second": rate})
+            speedup = f"{rate / single:.2f}x" if single else "-"
+            print(f"{workers:>7} {state['seconds']:>8.2f} {rate:>11,.0f} {speedup:>8}", flush=True)
+        ok = resume_check(tmp, input_path, args.payments, args.batch_size) if args.resume_check else True
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+OTLP export volume with and without the span filter.
+
+Every span of the in-process topology (see topology_bench.py) goes to two
+exporters: one receives it as the SDK produced it, the other after
+common.span_filter. Each batch is encoded the way the OTLP exporter sends
+it, and the bytes and span counts of both are reported per route. The
+payments processor runs app.chaos.py, and every other service gets a fault
+profile that fails --error-rate of requests with a 500 or a reset, so
+exception events and stack traces pile up the way they do in a chaos storm.
+With --topology the services come from a topology YAML file instead; a
+per-item loop (bench/scenario.py --depth 2 --repeat 50) shows child span aggregation.
+
+    python bench/span_volume_bench.py [-n 50] [--error-rate 0.5] [--topology wide.yaml]
+"""
+import argparse
+import json
+
+from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from topology_bench import build_from_file, build_topology, route_method
+
+from common import span_filter, telemetry
+from common.services import load_service
+
+PROCESSOR = "app-payment-processor:5000"
+
+
+def encoded_bytes(spans):
+    return len(encode_spans(spans).SerializeToString()) if spans else 0
+
+
+def build(args, raw, filtered):
+    # Both exporters see the same spans: the filtered one through SpanFilter
+    span_filter.ENABLED = False
+    if args.topology:
+        transport, targets = build_from_file(raw, args.topology)
+    else:
+        transport, targets = build_topology(raw)
+        transport.apps[PROCESSOR] = load_service("payment/processor", "app.chaos.py").app
+    for provider in telemetry.providers.values():
+        provider.add_span_processor(span_filter.SpanFilter(SimpleSpanProcessor(filtered)))
+    for netloc, app in transport.apps.items():
+        if netloc == PROCESSOR and not args.topology:
+            continue
+        app.extensions["faults"].configure({"seed": args.seed, "routes": {"*": {
+            "error": {"rate": args.error_rate / 2, "status": 500},
+            "reset": {"rate": args.error_rate / 2},
+        }}})
+    return transport, targets
+
+
+def bench_route(transport, raw, filtered, target, iterations):
+    label, netloc, path = target
+    method = route_method(transport, netloc, path)
+    totals = {"raw_spans": 0, "raw_bytes": 0, "filtered_spans": 0, "filtered_bytes": 0}
+    for _ in range(iterations):
+        try:
+            transport.call(netloc, method, path, {"X-Forwarded-For": "8.8.8.8"})
+        except ConnectionError:
+            pass  # the entry service itself was told to reset
+        for name, exporter in (("raw", raw), ("filtered", filtered)):
+            spans = exporter.get_finished_spans()
+            totals[f"{name}_spans"] += len(spans)
+            totals[f"{name}_bytes"] += encoded_bytes(spans)
+            exporter.clear()
+    return {"endpoint": label, **{k: v / iterations for k, v in totals.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--iterations", type=int, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.5, help="fraction of requests each service fails")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--topology", help="build the services from this topology file")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    raw, filtered = InMemorySpanExporter(), InMemorySpanExporter()
+    transport, targets = build(args, raw, filtered)
+    # Drop the services' startup spans
+    raw.clear()
+    filtered.clear()
+    results = []
+    print(f"{'endpoint':<52} {'spans':>6} {'bytes':>8} {'filtered':>9} {'bytes':>8} {'saved':>6}")
+    with transport.installed():
+        for target in targets:
+            r = bench_route(transport, raw, filtered, target, args.iterations)
+            results.append(r)
+            saved = 1 - r["filtered_bytes"] / r["raw_bytes"] if r["raw_bytes"] else 0
+            print(f"{r['endpoint']:<52} {r['raw_spans']:>6.1f} {r['raw_bytes']:>8.0f} "
+                  f"{r['filtered_spans']:>9.1f} {r['filtered_bytes']:>8.0f} {saved:>6.1%}")
+    raw_total = sum(r["raw_bytes"] for r in results)
+    filtered_total = sum(r["filtered_bytes"] for r in results)
+    print(f"{'total':<52} {'':>6} {raw_total:>8.0f} {'':>9} {filtered_total:>8.0f} "
+          f"{1 - filtered_total / raw_total if raw_total else 0:>6.1%}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Time to first request for all 13 services.
+
+Each hand-written service is started the way its container starts it:
+Gunicorn (gthread, one worker) with app.py from the service directory and
+common/ on the path. The clock runs from spawning Gunicorn until the service
+first answers GET /health. The worker's import and init phases come from its
+own service_startup_seconds metric, and its resident memory from /proc.
+Services run one at a time on 127.0.0.1:5000. Spans go to an OTLP endpoint
+nobody listens on, so the exporter is set up as usual and its exports fail
+quietly. The warm-up (common/readiness.py) is off, so it does not compete
+for the CPU.
+
+    python bench/startup_bench.py [--runs 3] [--target-ms 1000] [--json startup.json]
+
+Exits 1 if the median time to first request of any service is above
+--target-ms.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from async_bench import process_status, serving_pid, stop
+from common.services import SERVICES
+
+GUNICORN = ["gunicorn", "--config", os.path.join(APP_DIR, "gunicorn.conf.py"), "--worker-class", "gthread",
+            "--workers", "1", "--threads", "64", "--bind", "127.0.0.1:5000", "app:app"]
+
+
+def startup_phases(text):
+    # {phase: seconds} from the service_startup_seconds samples on /metrics
+    phases = {}
+    for line in text.splitlines():
+        if line.startswith("service_startup_seconds{"):
+            labels, value = line.rsplit(" ", 1)
+            phase = labels.split('phase="', 1)[1].split('"', 1)[0]
+            phases[phase] = float(value)
+    return phases
+
+
+def start_service(path, timeout=30):
+    # (seconds to first /health, phases, worker RSS in KiB)
+    env = {**os.environ, "PYTHONPATH": APP_DIR, "WARMUP": "off",
+           "OTEL_EXPORTER_OTLP_ENDPOINT": "http://127.0.0.1:4318/v1/traces"}
+    start = time.perf_counter()
+    proc = subprocess.Popen(GUNICORN, cwd=os.path.join(APP_DIR, path), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                with urllib.request.urlopen("http://127.0.0.1:5000/health", timeout=1) as resp:
+                    if resp.status == 200:
+                        break
+            except OSError:
+                pass
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"{path} did not answer /health within {timeout}s")
+            time.sleep(0.005)
+        first_request = time.perf_counter() - start
+        with urllib.request.urlopen("http://127.0.0.1:5000/metrics", timeout=5) as resp:
+            phases = startup_phases(resp.read().decode())
+        rss, _ = process_status(serving_pid(proc))
+        return first_request, phases, rss
+    finally:
+        stop(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=3, help="starts per service")
+    parser.add_argument("--target-ms", type=float, default=1000, help="time to first request to stay under")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'service':<26} {'first req ms':>12} {'imports ms':>10} {'init ms':>8} {'RSS MiB':>8}")
+    for path, _, _, _ in SERVICES:
+        runs = [start_service(path) for _ in range(args.runs)]
+        result = {
+            "service": path,
+            "first_request_ms": statistics.median(r[0] for r in runs) * 1000,
+            "imports_ms": statistics.median(r[1].get("imports", 0) for r in runs) * 1000,
+            "init_ms": statistics.median(r[1].get("init", 0) for r in runs) * 1000,
+            "rss_mib": statistics.median(r[2] for r in runs) / 1024,
+        }
+        results.append(result)
+        print(f"{path:<26} {result['first_request_ms']:>12.0f} {result['imports_ms']:>10.0f} "
+              f"{result['init_ms']:>8.1f} {result['rss_mib']:>8.1f}")
+    slowest = max(results, key=lambda r: r["first_request_ms"])
+    print(f"slowest: {slowest['service']} {slowest['first_request_ms']:.0f} ms (target {args.target_ms:.0f} ms)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if slowest["first_request_ms"] > args.target_ms else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
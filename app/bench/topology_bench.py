@@ -0,0 +1,192 @@
+"""
+In-process benchmark of the full service topology.
+
+All 13 app.py services are imported into one interpreter. Their requests
+calls to each other go through an in-memory transport and spans go to an
+in-memory exporter, so no containers, collector or network are needed. Every
+public route in the Locust ENDPOINTS table is driven the way NGINX would
+route it. Each route reports wall-clock latency, CPU time, peak Python
+allocations and the number of spans per request.
+
+With --topology the services are built from a topology YAML file instead
+(see common/topology.py and bench/scenario.py) and every route that no other
+route calls is driven directly.
+
+    python bench/topology_bench.py [-n 200] [--json out.json] [--baseline old.json]
+    python bench/topology_bench.py --topology wide.yaml
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from common import telemetry
+from common.services import SERVICES, gateway_route, load_service
+from common.topology import build_app, entry_routes, load_topology
+from common.transport import LocalTransport
+
+LOCUSTFILE = os.path.join(APP_DIR, "..", "otel", "locust", "locustfile.py")
+
+
+def load_endpoints(path=LOCUSTFILE):
+    # Read ENDPOINTS without importing the locustfile (and Locust with it)
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+            getattr(t, "id", None) == "ENDPOINTS" for t in node.targets
+        ):
+            endpoints = ast.literal_eval(node.value)
+            return [url for team in endpoints.values() for url in team.values()]
+    raise ValueError(f"ENDPOINTS not found in {path}")
+
+
+def build_topology(exporter):
+    # (transport, [(label, netloc, path)]) for the hand-written services
+    telemetry.span_exporter = exporter
+    transport = LocalTransport()
+    for path, host, _, _ in SERVICES:
+        transport.apps[f"{host}:5000"] = load_service(path).app
+    targets = []
+    for url in load_endpoints():
+        host, path = gateway_route(url)
+        targets.append((url, f"{host}:5000", path))
+    return transport, targets
+
+
+def build_from_file(exporter, topology_file):
+    telemetry.span_exporter = exporter
+    topology = load_topology(topology_file)
+    transport = LocalTransport()
+    for name, service in topology["services"].items():
+        transport.apps[f"{service['host']}:5000"] = build_app(topology, name, seed=0)
+    targets = [
+        (f"{name} {route}", f"{topology['services'][name]['host']}:5000", route)
+        for name, route in entry_routes(topology)
+    ]
+    return transport, targets
+
+
+def route_method(transport, netloc, path):
+    # GET where the route allows it, otherwise POST (as the locustfile does)
+    adapter = transport.apps[netloc].url_map.bind("localhost")
+    for method in ("GET", "POST"):
+        try:
+            adapter.match(path, method=method)
+            return method
+        except Exception:
+            continue
+    raise ValueError(f"no GET/POST route for {path}")
+
+
+def bench_endpoint(transport, exporter, target, iterations, warmup):
+    url, netloc, path = target
+    method = route_method(transport, netloc, path)
+    headers = {"X-Forwarded-For": "8.8.8.8"}
+
+    def call():
+        status = transport.call(netloc, method, path, headers)[0]
+        if status >= 500:
+            raise RuntimeError(f"{method} {url} returned {status}")
+
+    for _ in range(warmup):
+        call()
+    exporter.clear()
+
+    wall, cpu = [], []
+    for _ in range(iterations):
+        w0, c0 = time.perf_counter(), time.process_time()
+        call()
+        cpu.append(time.process_time() - c0)
+        wall.append(time.perf_counter() - w0)
+    spans = len(exporter.get_finished_spans()) / iterations
+    exporter.clear()
+
+    # Separate pass: tracemalloc slows everything down, so it must not
+    # overlap the timed loop
+    alloc_runs = max(1, iterations // 10)
+    tracemalloc.start()
+    peaks = []
+    for _ in range(alloc_runs):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        call()
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    exporter.clear()
+
+    wall.sort()
+    return {
+        "endpoint": url,
+        "method": method,
+        "p50_ms": statistics.median(wall) * 1000,
+        "p99_ms": wall[min(len(wall) - 1, int(len(wall) * 0.99))] * 1000,
+        "cpu_ms": statistics.mean(cpu) * 1000,
+        "alloc_kib": statistics.mean(peaks) / 1024,
+        "spans": spans,
+    }
+
+
+def compare(results, baseline, tolerance):
+    previous = {r["endpoint"]: r for r in baseline}
+    regressions = []
+    for r in results:
+        base = previous.get(r["endpoint"])
+        if not base:
+            continue
+        for field in ("p50_ms", "cpu_ms"):
+            if r[field] > base[field] * tolerance:
+                regressions.append(f"{r['endpoint']}: {field} {base[field]:.3f} -> {r[field]:.3f}")
+        if r["spans"] != base["spans"]:
+            regressions.append(f"{r['endpoint']}: spans {base['spans']:g} -> {r['spans']:g}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="fail if results regress against this file")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="allowed latency/CPU ratio against the baseline")
+    parser.add_argument("--topology", help="build the services from this topology file")
+    args = parser.parse_args()
+
+    exporter = InMemorySpanExporter()
+    if args.topology:
+        transport, targets = build_from_file(exporter, args.topology)
+    else:
+        transport, targets = build_topology(exporter)
+
+    results = []
+    print(f"{'endpoint':<52} {'method':<6} {'p50 ms':>8} {'p99 ms':>8} {'cpu ms':>8} {'alloc KiB':>10} {'spans':>6}")
+    with transport.installed():
+        for target in targets:
+            r = bench_endpoint(transport, exporter, target, args.iterations, args.warmup)
+            results.append(r)
+            print(f"{r['endpoint']:<52} {r['method']:<6} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f} "
+                  f"{r['cpu_ms']:>8.3f} {r['alloc_kib']:>10.1f} {r['spans']:>6g}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
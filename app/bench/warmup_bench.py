@@ -0,0 +1,109 @@
+"""
+Latency of the first requests a freshly started service serves.
+
+Uses the two-service topology of bench/async_bench.py: `bench-edge` /wait
+calls `bench-backend` /sleep (--latency-ms, on the async runtime). The edge
+is started under Gunicorn --restarts times with WARMUP=off and with the
+warm-up on. Each time, it gets traffic as soon as NGINX would send it some:
+once the port accepts connections without a warm-up, once /ready answers 200
+with one. --requests requests then go to /wait one after the other, and the
+run reports the first request, the worst of the rest and the median of the
+rest, against the edge's latency once it has served 200 requests.
+
+    python bench/warmup_bench.py [--restarts 5] [--requests 20] [--latency-ms 5]
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from async_bench import BACKEND, EDGE, start, stop, write_topology
+
+
+def get(path, host=EDGE[1]):
+    # (status, seconds) on a new connection, as NGINX's first requests to a new server are
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection(host, 5000, timeout=30)
+    try:
+        conn.request("GET", path)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status, time.perf_counter() - start
+    finally:
+        conn.close()
+
+
+def wait_ready(timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if get("/ready")[0] == 200:
+            return
+        time.sleep(0.05)
+    raise RuntimeError("edge did not become ready")
+
+
+def first_requests(topology_file, warmup, count):
+    os.environ["WARMUP"] = "on" if warmup else "off"
+    start_time = time.perf_counter()
+    edge = start("threads", EDGE, topology_file)
+    try:
+        if warmup:
+            wait_ready()
+        routable = time.perf_counter() - start_time
+        return routable, [get("/wait")[1] for _ in range(count)]
+    finally:
+        stop(edge)
+
+
+def steady_state(topology_file, count=200):
+    os.environ["WARMUP"] = "off"
+    edge = start("threads", EDGE, topology_file)
+    try:
+        return statistics.median([get("/wait")[1] for _ in range(count)][count // 2:])
+    finally:
+        stop(edge)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--restarts", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=20, help="requests timed after each start")
+    parser.add_argument("--latency-ms", type=float, default=5, help="backend /sleep latency")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        topology_file = os.path.join(tmp, "topology.yaml")
+        write_topology(topology_file, args.latency_ms)
+        backend = start("async", BACKEND, topology_file)
+        try:
+            steady = steady_state(topology_file)
+            print(f"steady state: {steady * 1000:.1f} ms")
+            print(f"{'warmup':<7} {'routable s':>10} {'first ms':>9} {'worst ms':>9} {'median ms':>10}")
+            for warmup in (False, True):
+                runs = [first_requests(topology_file, warmup, args.requests) for _ in range(args.restarts)]
+                result = {
+                    "warmup": warmup,
+                    "routable_s": statistics.median(routable for routable, _ in runs),
+                    "first_ms": statistics.median(latencies[0] for _, latencies in runs) * 1000,
+                    "worst_ms": statistics.median(max(latencies[1:]) for _, latencies in runs) * 1000,
+                    "median_ms": statistics.median(statistics.median(latencies[1:]) for _, latencies in runs) * 1000,
+                    "steady_ms": steady * 1000,
+                }
+                results.append(result)
+                print(f"{'on' if warmup else 'off':<7} {result['routable_s']:>10.2f} {result['first_ms']:>9.1f} "
+                      f"{result['worst_ms']:>9.1f} {result['median_ms']:>10.1f}")
+        finally:
+            stop(backend)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,14 @@
+from functools import wraps
+
+from flask import request
+
+
+def admin_only(view):
+    # Admin endpoints answer direct calls only: anything that came through
+    # the NGINX gateway carries the X-Real-IP header it sets
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if "X-Real-IP" in request.headers:
+            return "Admin endpoints are not available through the gateway\n", 403
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,374 @@
+"""
+Asynchronous (ASGI) runtime for the services in a topology file.
+
+build_app() builds the same service as common.topology.build_app: the same
+routes, span names, downstream calls, /metrics and /admin/faults, as a
+Starlette app. Serve it with uvicorn on the same port instead of Gunicorn:
+
+    SERVICE_NAME=payments-processor uvicorn --factory common.asgi:create_app --host 0.0.0.0 --port 5000
+
+A request that waits on a downstream call, a route latency or an injected
+delay is a suspended coroutine instead of a blocked thread, so a 3-9 s chaos
+delay costs a few KiB rather than one of Gunicorn's 64 threads. Downstream
+calls share one pooled aiohttp session per service (at most
+ASYNC_MAX_CONNECTIONS open) with the shared client's per-target metrics.
+Server spans come from the OTel ASGI middleware and call spans from the
+aiohttp instrumentation; the trace context lives in contextvars, so it
+follows each await and every task of a parallel fan-out.
+
+RED metrics, the adaptive limiter, fault profiles, the span filter and
+/health and /ready are shared with the threaded runtime; the warm-up opens
+the pooled connections to downstream hosts and flushes the exporter, but
+sends no synthetic requests. Requests a caller's warm-up sent (X-Warmup)
+are neither fault-injected nor counted, and pass the header on. Injected
+latency is an asyncio sleep and ignores FAULTS_MAX_DELAYED, since it holds
+no thread; a reset is answered with an empty 500 that closes the
+connection, as ASGI has no socket to drop. Route and injected CPU cost runs
+in the loop's default executor, so it does not stall the requests waiting
+on the loop. Compression, hedging, bulkheads, idempotency keys and the
+profiler are only in the threaded runtime.
+
+Only what topology.yaml describes is served: routes a service's app.py adds
+in code are missing, notably payments-processor's bulk settlement jobs
+(/settlements, common.settlement) and /admin/profile. Run a service that
+needs them under Gunicorn; docker-compose.async.yaml does so for
+payments-processor.
+"""
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+from opentelemetry.instrumentation.asgi import OpenTelemetryMiddleware
+from opentelemetry.instrumentation.aiohttp_client import create_trace_config
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from common import bootstrap, faults, limiter, metrics, readiness, telemetry
+from common.distributions import burn_cpu, sample_ms
+from common.topology import call_url, load_topology
+
+MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", "512"))
+CLIENT_TIMEOUT = float(os.getenv("ASYNC_CLIENT_TIMEOUT", "30"))
+# What a failed call raises, like requests.RequestException for the shared client
+ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+# Matches Flask's default for string responses
+TEXT = "text/html; charset=utf-8"
+# The priority of the request being handled, passed on to its calls (common.limiter)
+request_priority = contextvars.ContextVar("request_priority", default=None)
+# Whether it was sent by a caller's warm-up, passed on likewise (common.readiness)
+request_warmup = contextvars.ContextVar("request_warmup", default=False)
+
+
+class AsyncClient:
+    """Pooled async HTTP client for calls between services."""
+
+    def __init__(self, service_name, provider):
+        self.service_name = service_name
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=CLIENT_TIMEOUT),
+            trace_configs=[create_trace_config(tracer_provider=provider)],
+        )
+
+    async def request(self, method, url, **kwargs):
+        # The response with its body read, so the connection is back in the pool
+        target = urlsplit(url).netloc
+        metrics.client_active.inc(self.service_name, target)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            async with self.session.request(method, url, **kwargs) as resp:
+                await resp.read()
+            status = str(resp.status)
+            if resp.status >= 500:
+                metrics.client_errors.inc(self.service_name, target, status)
+            return resp
+        except ERRORS as e:
+            metrics.client_errors.inc(self.service_name, target, type(e).__name__)
+            raise
+        finally:
+            metrics.client_active.dec(self.service_name, target)
+            metrics.client_duration.observe(
+                time.perf_counter() - start, self.service_name, target, method, status,
+                trace_id=metrics.current_trace_id(),
+            )
+
+    async def close(self):
+        await self.session.close()
+
+
+async def wait_unless(event, seconds):
+    # event.wait(seconds) for a threading.Event, without holding a thread
+    deadline = time.monotonic() + seconds
+    while not event.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, 0.1))
+
+
+async def inject_faults(injector, route):
+    # FaultInjector.before for coroutines: (early response or None, bytes to inflate by)
+    state, chosen = injector.decide(route)
+    if not chosen:
+        return None, 0
+    rng, changed = state
+    if "reset" in chosen:
+        injector.record(route, "reset")
+        return Response(status_code=500, headers={"Connection": "close"}), 0
+    if "error" in chosen:
+        status = chosen["error"].get("status", 500)
+        injector.record(route, "error", status=status)
+        return Response(f"Injected fault: HTTP {status}\n", status, media_type=TEXT), 0
+    if "cpu" in chosen:
+        injector.record(route, "cpu", ms=chosen["cpu"]["ms"])
+        await asyncio.get_running_loop().run_in_executor(None, burn_cpu, chosen["cpu"]["ms"])
+    if "latency" in chosen:
+        delay_ms = sample_ms(rng, chosen["latency"])
+        injector.record(route, "latency", delay_ms=delay_ms)
+        await wait_unless(changed, delay_ms / 1000)
+    if "inflate" in chosen:
+        injector.record(route, "inflate", bytes=chosen["inflate"]["bytes"])
+        return None, chosen["inflate"]["bytes"]
+    return None, 0
+
+
+async def inflated(body, size, chunk=64 * 1024):
+    yield body.encode()
+    for block in faults._filler(size, chunk):
+        yield block
+
+
+def build_app(topology, service_name, seed=None):
+    init_start = time.time_ns()
+    service = topology["services"][service_name]
+    provider = telemetry.make_provider(service_name, service["team"])
+    tracer = provider.get_tracer(service_name)
+    injector = faults.FaultInjector(service_name, faults.load_profile(service_name))
+    concurrency = None
+    if limiter.MODE != "off":
+        concurrency = limiter.ConcurrencyLimiter(
+            service_name,
+            limiter.ALGORITHMS[limiter.MODE](limiter.INITIAL_LIMIT, limiter.MIN_LIMIT, limiter.MAX_LIMIT),
+        )
+    priorities = limiter.parse_priorities(os.getenv("LIMITER_PRIORITIES", ""))
+    rng = random.Random(seed)
+    state = {}
+    warmup = readiness.Readiness(service_name)
+    targets = sorted({
+        urlsplit(call_url(topology, call)).netloc
+        for spec in (service.get("routes") or {}).values()
+        for call in spec.get("calls") or ()
+        if call.get("via") != "nginx"
+    })
+
+    def http_client():
+        # Made on first use, on the event loop that serves the requests
+        if "client" not in state:
+            state["client"] = AsyncClient(service_name, provider)
+        return state["client"]
+
+    async def downstream(call):
+        with tracer.start_as_current_span(call.get("name") or f"call-{call['route'].strip('/')}"):
+            method = call.get("method", "GET")
+            body = b"x" * call["payload_bytes"] if call.get("payload_bytes") else None
+            priority = request_priority.get()
+            headers = {limiter.HEADER: priority} if priority else {}
+            if request_warmup.get():
+                headers[readiness.HEADER] = "1"
+            try:
+                resp = await http_client().request(method, call_url(topology, call), data=body, headers=headers or None)
+                return f"Called {call['route'].strip('/')}: {await resp.text()}\n"
+            except ERRORS as e:
+                return f"Error calling {call['route'].strip('/')}: {str(e)}\n"
+
+    def make_handler(route, spec):
+        endpoint = route.strip("/")
+        latency = spec.get("latency")
+        calls = [call for call in spec.get("calls") or () for _ in range(call.get("repeat", 1))]
+
+        async def handler():
+            with tracer.start_as_current_span(
+                f"{service_name}:{endpoint}",
+                attributes={"endpoint.name": endpoint}
+            ):
+                response_text = f"Response from {service_name} at {route}\n"
+                if spec.get("cpu_ms"):
+                    # Off the loop, which would otherwise serve nothing else meanwhile
+                    await asyncio.get_running_loop().run_in_executor(None, burn_cpu, spec["cpu_ms"])
+                if latency:
+                    await asyncio.sleep(sample_ms(rng, latency) / 1000)
+                if spec.get("parallel") and len(calls) > 1:
+                    # Each task runs in a copy of this context, so it keeps the current span
+                    response_text += "".join(await asyncio.gather(*(downstream(call) for call in calls)))
+                else:
+                    for call in calls:
+                        response_text += await downstream(call)
+                padding = spec.get("response_bytes", 0) - len(response_text)
+                return response_text + ("." * padding if padding > 0 else "")
+
+        return handler
+
+    def instrument(route, spec, handler):
+        # RED metrics, admission control and faults around one route, in
+        # the order init_service installs them for Flask
+        async def endpoint(request):
+            startup.request_started()
+            method = request.method
+            # A caller's warm-up request is neither fault-injected nor counted
+            warm = readiness.propagated_warmup(request.headers)
+            request_warmup.set(warm)
+            if not warm:
+                metrics.server_active.inc(service_name, route)
+            start = time.perf_counter()
+            status = "500"
+            admitted = False
+            try:
+                priority = (limiter.propagated_priority(request.headers) or priorities.get(route)
+                            or spec.get("priority") or ("sheddable" if method in ("GET", "HEAD") else "critical"))
+                if concurrency is not None:
+                    request_priority.set(priority)
+                    if not concurrency.try_acquire(priority):
+                        limiter.rejected.inc(service_name, route, priority)
+                        status = "503"
+                        return Response(f"{service_name} is overloaded, retry later\n", 503, media_type=TEXT,
+                                        headers={"Retry-After": str(concurrency.retry_after())})
+                    admitted = True
+                early, inflate = (None, 0) if warm else await inject_faults(injector, route)
+                if early is not None:
+                    status = str(early.status_code)
+                    return early
+                body = await handler()
+                status = "200"
+                if inflate:
+                    return StreamingResponse(inflated(body, inflate), media_type=TEXT)
+                return Response(body, media_type=TEXT)
+            finally:
+                elapsed = time.perf_counter() - start
+                if admitted:
+                    concurrency.release(elapsed, status.startswith("5"))
+                if not warm:
+                    metrics.server_active.dec(service_name, route)
+                    metrics.server_duration.observe(
+                        elapsed, service_name, method, route, status, trace_id=metrics.current_trace_id(),
+                    )
+                    if status.startswith("5"):
+                        metrics.server_errors.inc(service_name, method, route, status)
+
+        return endpoint
+
+    async def open_connections(deadline):
+        # As WarmUp.open_connections, with the aiohttp session's pool
+        async def open_one(target):
+            give_up = min(deadline, time.monotonic() + readiness.CONNECT_TIMEOUT)
+            attempt = aiohttp.ClientTimeout(total=min(2, readiness.CONNECT_TIMEOUT))
+            while True:
+                try:
+                    async with http_client().session.get(f"http://{target}/health", timeout=attempt) as resp:
+                        await resp.read()
+                    return None
+                except ERRORS as e:
+                    remaining = give_up - time.monotonic()
+                    if remaining <= 0:
+                        return f"{target}: {type(e).__name__}"
+                    await asyncio.sleep(min(0.5, remaining))
+
+        jobs = [target for target in targets for _ in range(readiness.CONNECTIONS)]
+        errors = sorted({e for e in await asyncio.gather(*(open_one(target) for target in jobs)) if e})
+        if errors:
+            raise ConnectionError("; ".join(errors))
+
+    async def warm_up():
+        deadline = time.monotonic() + readiness.TIMEOUT
+        steps = [("connections", lambda: open_connections(deadline)),
+                 ("telemetry", lambda: asyncio.to_thread(provider.force_flush, int(readiness.TIMEOUT * 1000)))]
+        with tracer.start_as_current_span(f"{service_name}:warmup"):
+            for name, fn in steps:
+                start = time.perf_counter()
+                with tracer.start_as_current_span(f"warmup-{name}"):
+                    try:
+                        await fn()
+                        warmup.record(name, time.perf_counter() - start)
+                    except Exception as e:
+                        warmup.record(name, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+        warmup.finish()
+
+    def start_warm_up():
+        if warmup.started:
+            return
+        warmup.started = True
+        if readiness.ENABLED:
+            state["warmup"] = asyncio.get_running_loop().create_task(warm_up())
+        else:
+            warmup.finish()
+
+    async def health_endpoint(request):
+        return Response(json.dumps({"service": service_name, "status": "alive"}), media_type="application/json")
+
+    async def ready_endpoint(request):
+        start_warm_up()
+        status, body = warmup.status()
+        return Response(body, status, headers={} if status == 200 else {"Retry-After": "1"},
+                        media_type="application/json")
+
+    async def metrics_endpoint(request):
+        openmetrics = "application/openmetrics-text" in request.headers.get("Accept", "")
+        return Response(metrics.registry.render(openmetrics, service_name),
+                        headers={"Content-Type": metrics.OPENMETRICS if openmetrics else metrics.PROMETHEUS})
+
+    async def faults_endpoint(request):
+        if "X-Real-IP" in request.headers:
+            return Response("Admin endpoints are not available through the gateway\n", 403, media_type=TEXT)
+        if request.method == "PUT":
+            try:
+                injector.configure(json.loads(await request.body()))
+            except (ValueError, AttributeError) as e:
+                return Response(f"Invalid fault profile: {e}\n", 400, media_type=TEXT)
+        elif request.method == "DELETE":
+            injector.configure({})
+        with injector.lock:
+            body = {"profile": injector.profile, "requests": injector.counts}
+        return Response(json.dumps(body), media_type="application/json")
+
+    routes = [
+        Route(route, instrument(route, spec, make_handler(route, spec)), methods=spec.get("methods", ["GET"]))
+        for route, spec in (service.get("routes") or {}).items()
+    ]
+    routes.append(Route("/metrics", metrics_endpoint, methods=["GET"]))
+    routes.append(Route("/health", health_endpoint, methods=["GET"]))
+    routes.append(Route("/ready", ready_endpoint, methods=["GET"]))
+    routes.append(Route("/admin/faults", faults_endpoint, methods=["GET", "PUT", "DELETE"]))
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        start_warm_up()
+        yield
+        if "client" in state:
+            await state.pop("client").close()
+
+    app = Starlette(routes=routes, lifespan=lifespan)
+    known = set(service.get("routes") or {})
+
+    def span_details(scope):
+        # "GET /route" like the Flask instrumentation, rather than "GET"
+        method, path = scope.get("method", "HTTP"), scope.get("path", "")
+        return (f"{method} {path}" if path in known else method), {}
+
+    startup = bootstrap.startup(service_name)
+    startup.report(tracer, init_start, time.time_ns())
+    # Without the per-message "http send" and "http receive" spans
+    return OpenTelemetryMiddleware(app, tracer_provider=provider, default_span_details=span_details,
+                                   exclude_spans=["receive", "send"])
+
+
+def create_app():
+    # uvicorn --factory entry point, configured like generic/app.py
+    topology = load_topology(os.getenv("TOPOLOGY_FILE", "topology.yaml"))
+    return build_app(topology, os.environ["SERVICE_NAME"], seed=os.getenv("TOPOLOGY_SEED"))
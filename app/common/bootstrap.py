@@ -0,0 +1,130 @@
+"""
+Startup timing and deferred imports for the service processes.
+
+A service process spends most of its start importing: Flask, requests and
+the OTel SDK it needs before it can serve, but also things it may never use
+or only needs later. lazy_import() defers a module until one of its
+attributes is first used (importlib's LazyLoader); the YAML parser is only
+loaded when there is a fault file to read. The OTLP exporter, with protobuf
+and its HTTP transport, is built by common.telemetry on the first export,
+which runs in the span processor's background thread, instead of at import.
+
+The start of each process is recorded per service in the
+service_startup_seconds gauge and as a `<service>:startup` trace whose child
+spans cover the phases, measured from when the process started (from /proc):
+
+  * imports: until init_service, i.e. loading the interpreter, Gunicorn's
+    worker, app.py and everything it imports
+  * init: init_service itself (tracing, instrumentation, hooks)
+  * exporter: building the span exporter, on the first export
+  * first_request: until the first request reached the app
+
+The startup span ends with init; the exporter and first_request spans are
+added under it when those happen, later. It carries the number of modules
+loaded so far (startup.modules).
+"""
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+from opentelemetry import trace
+
+from common import metrics
+
+startup_seconds = metrics.registry.register(metrics.Gauge(
+    "service_startup_seconds", "Process start phases, in seconds", ("service", "phase"),
+))
+
+
+def lazy_import(name):
+    # The module, imported when an attribute is first looked up
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def process_start_ns():
+    # Wall-clock time the process started, from its start time in /proc
+    # (clock ticks after boot); the import of this module without /proc
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name can contain spaces; fields resume after its ")"
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return IMPORTED_NS
+    age = uptime - started_ticks / os.sysconf("SC_CLK_TCK")
+    return time.time_ns() - int(max(0.0, age) * 1e9)
+
+
+IMPORTED_NS = time.time_ns()
+PROCESS_START_NS = process_start_ns()
+
+
+class Startup:
+    """Start phases of one service in this process."""
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+        # In host mode every service counts from the start of the one process
+        self.started_ns = PROCESS_START_NS
+        self.phases = {}
+        self.first_request = threading.Event()
+        # The tracer and startup span context, once reported
+        self.tracer = None
+        self.context = None
+
+    def record(self, phase, start_ns, end_ns):
+        self.phases[phase] = (start_ns, end_ns)
+        startup_seconds.set(self.service_name, phase, value=(end_ns - start_ns) / 1e9)
+        if self.context is not None:
+            self.span(phase)
+
+    def span(self, phase):
+        start_ns, end_ns = self.phases[phase]
+        self.tracer.start_span(f"startup-{phase}", context=self.context, start_time=start_ns).end(end_time=end_ns)
+
+    def report(self, tracer, init_start_ns, init_end_ns):
+        # The startup trace, once init_service is done; phases recorded
+        # after this are added to it as they happen
+        self.record("imports", self.started_ns, init_start_ns)
+        self.record("init", init_start_ns, init_end_ns)
+        root = tracer.start_span(f"{self.service_name}:startup", start_time=self.started_ns,
+                                 attributes={"startup.modules": len(sys.modules), "process.pid": os.getpid()})
+        recorded = list(self.phases)
+        self.tracer, self.context = tracer, trace.set_span_in_context(root)
+        for phase in recorded:
+            self.span(phase)
+        root.end(end_time=init_end_ns)
+
+    def request_started(self):
+        if not self.first_request.is_set():
+            self.first_request.set()
+            self.record("first_request", self.started_ns, time.time_ns())
+
+
+startups = {}
+
+
+def startup(service_name):
+    # This process's Startup for the service
+    if service_name not in startups:
+        startups[service_name] = Startup(service_name)
+    return startups[service_name]
+
+
+def instrument_app(app, service_name, tracer, init_start_ns):
+    record = startup(service_name)
+    record.report(tracer, init_start_ns, time.time_ns())
+    app.extensions["startup"] = record
+    app.before_request(record.request_started)
+    return record
@@ -0,0 +1,191 @@
+"""
+Shared HTTP client for calls between services.
+
+One pooled requests.Session per process keeps connections to downstream
+services open between requests, and every call is timed per target for the
+metrics in common.metrics. Errors are the usual requests exceptions.
+
+Calls from each service to each target also go through a bulkhead: at most
+`max_concurrent` calls in flight, up to `max_queue` more waiting at most
+`queue_timeout` seconds for a slot, and BulkheadFull (a RequestException)
+straight away for the rest. So a slow dependency only ties up its own share
+of the caller's threads. Defaults come from BULKHEAD_MAX_CONCURRENT,
+BULKHEAD_MAX_QUEUE and BULKHEAD_QUEUE_TIMEOUT; a service overrides them per
+target in app.config["BULKHEADS"], e.g.
+
+    app.config["BULKHEADS"] = {"app-payment-processor:5000": {"max_concurrent": 8, "max_queue": 4}}
+
+or BULKHEADS="app-payment-processor:5000=8/4,..." (concurrent/queue).
+
+Calls accept the encodings in common.compression (zstd, gzip); requests
+decodes the body transparently.
+
+Idempotent GETs can pass hedge=True to race a second copy against a slow
+first attempt; see common.hedging. Other methods called while handling a
+request with an Idempotency-Key get a key derived from it; see
+common.idempotency. Every call made while handling a request carries its
+priority for the callee's load shedding; see common.limiter. Calls made
+while handling a warm-up request are marked as such; see common.readiness.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from flask import current_app, has_app_context
+from requests.adapters import HTTPAdapter
+
+from common import compression, hedging, idempotency, limiter, metrics, readiness
+
+BULKHEAD_DEFAULTS = {
+    "max_concurrent": int(os.getenv("BULKHEAD_MAX_CONCURRENT", "32")),
+    "max_queue": int(os.getenv("BULKHEAD_MAX_QUEUE", "0")),
+    "queue_timeout": float(os.getenv("BULKHEAD_QUEUE_TIMEOUT", "0.1")),
+}
+
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=64))
+session.headers["Accept-Encoding"] = compression.accept_encoding()
+
+bulkhead_active = metrics.registry.register(metrics.Gauge(
+    "bulkhead_active", "Downstream calls holding a bulkhead slot", ("service", "target"),
+))
+bulkhead_queued = metrics.registry.register(metrics.Gauge(
+    "bulkhead_queued", "Downstream calls waiting for a bulkhead slot", ("service", "target"),
+))
+bulkhead_limit = metrics.registry.register(metrics.Gauge(
+    "bulkhead_max_concurrent", "Bulkhead size", ("service", "target"),
+))
+bulkhead_rejected = metrics.registry.register(metrics.Counter(
+    "bulkhead_rejected", "Downstream calls rejected by a full bulkhead", ("service", "target", "reason"),
+))
+
+
+class BulkheadFull(requests.RequestException):
+    pass
+
+
+def parse_bulkheads(value):
+    config = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        target, _, sizes = item.partition("=")
+        concurrent, _, queue = sizes.partition("/")
+        config[target] = {"max_concurrent": int(concurrent), "max_queue": int(queue or 0)}
+    return config
+
+
+ENV_BULKHEADS = parse_bulkheads(os.getenv("BULKHEADS", ""))
+
+
+class Bulkhead:
+    def __init__(self, service_name, target, max_concurrent, max_queue, queue_timeout):
+        self.labels = (service_name, target)
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.cond = threading.Condition()
+        self.active = 0
+        self.queued = 0
+        bulkhead_limit.set(*self.labels, value=max_concurrent)
+
+    def acquire(self):
+        with self.cond:
+            if self.active >= self.max_concurrent:
+                if self.queued >= self.max_queue:
+                    bulkhead_rejected.inc(*self.labels, "full")
+                    raise BulkheadFull(f"bulkhead {self.labels[1]} full ({self.active} in flight)")
+                self.queued += 1
+                bulkhead_queued.set(*self.labels, value=self.queued)
+                try:
+                    ready = self.cond.wait_for(lambda: self.active < self.max_concurrent, self.queue_timeout)
+                finally:
+                    self.queued -= 1
+                    bulkhead_queued.set(*self.labels, value=self.queued)
+                if not ready:
+                    bulkhead_rejected.inc(*self.labels, "timeout")
+                    raise BulkheadFull(f"bulkhead {self.labels[1]}: no slot within {self.queue_timeout}s")
+            self.active += 1
+            bulkhead_active.set(*self.labels, value=self.active)
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            bulkhead_active.set(*self.labels, value=self.active)
+            self.cond.notify()
+
+
+bulkheads = {}
+bulkheads_lock = threading.Lock()
+
+
+def bulkhead(service_name, target):
+    key = (service_name, target)
+    found = bulkheads.get(key)
+    if found is None:
+        with bulkheads_lock:
+            found = bulkheads.get(key)
+            if found is None:
+                configured = current_app.config.get("BULKHEADS", {}) if has_app_context() else {}
+                spec = {**BULKHEAD_DEFAULTS, **configured.get(target, {}), **ENV_BULKHEADS.get(target, {})}
+                found = bulkheads[key] = Bulkhead(service_name, target, **spec)
+    return found
+
+
+def calling_service():
+    if has_app_context():
+        return current_app.config.get("SERVICE_NAME", "unknown")
+    return "unknown"
+
+
+def request(method, url, hedge=False, **kwargs):
+    key = idempotency.downstream_key(method, url)
+    if key:
+        kwargs["headers"] = {idempotency.HEADER: key, **(kwargs.get("headers") or {})}
+    priority = limiter.downstream_priority()
+    if priority:
+        kwargs["headers"] = {limiter.HEADER: priority, **(kwargs.get("headers") or {})}
+    if readiness.in_warmup():
+        kwargs["headers"] = {readiness.HEADER: "1", **(kwargs.get("headers") or {})}
+    if hedge and method in ("GET", "HEAD"):
+        return hedging.hedger.run(send, calling_service(), method, url, **kwargs)
+    return send(method, url, **kwargs)
+
+
+def send(method, url, **kwargs):
+    # One attempt: bulkhead slot, metrics, then the call itself
+    service_name = calling_service()
+    target = urlsplit(url).netloc
+    slot = bulkhead(service_name, target)
+    try:
+        slot.acquire()
+    except BulkheadFull:
+        metrics.client_errors.inc(service_name, target, "BulkheadFull")
+        raise
+    metrics.client_active.inc(service_name, target)
+    start = time.perf_counter()
+    status = "error"
+    try:
+        resp = session.request(method, url, **kwargs)
+        status = str(resp.status_code)
+        if resp.status_code >= 500:
+            metrics.client_errors.inc(service_name, target, status)
+        return resp
+    except requests.RequestException as e:
+        metrics.client_errors.inc(service_name, target, type(e).__name__)
+        raise
+    finally:
+        slot.release()
+        metrics.client_active.dec(service_name, target)
+        metrics.client_duration.observe(
+            time.perf_counter() - start, service_name, target, method, status,
+            trace_id=metrics.current_trace_id(),
+        )
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
@@ -0,0 +1,148 @@
+"""
+Content-Encoding negotiation for service responses and client calls.
+
+Responses of at least COMPRESSION_MIN_BYTES with a text or JSON content type
+are compressed with the best encoding the caller accepts: zstd (Python 3.14
+compression.zstd or the backports.zstd package) or gzip. The body is
+compressed chunk by chunk as the server writes it, so a large or streamed
+response is never held twice in memory. The shared client advertises the
+same encodings, but zstd only if the installed urllib3 can decode it
+(urllib3.response.HAS_ZSTD), and bytes before and after compression are
+counted per route in /metrics.
+"""
+import os
+import sys
+import zlib
+
+from flask import request
+
+from common import metrics
+
+try:
+    if sys.version_info >= (3, 14):
+        from compression import zstd
+    else:
+        from backports import zstd
+except ImportError:
+    zstd = None
+
+try:
+    from urllib3.response import HAS_ZSTD
+except ImportError:
+    HAS_ZSTD = False
+
+MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "5"))
+ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+CHUNK = 64 * 1024
+COMPRESSIBLE = ("text/", "application/json")
+
+# In order of preference
+ENCODINGS = (("zstd",) if zstd else ()) + ("gzip",)
+# What requests can decode, through urllib3
+CLIENT_ENCODINGS = tuple(e for e in ENCODINGS if e != "zstd" or HAS_ZSTD)
+
+response_bytes = metrics.registry.register(metrics.Counter(
+    "http_server_response_bytes", "Response body bytes before (raw) and after (encoded) compression",
+    ("service", "route", "encoding", "stage"),
+))
+
+
+def accept_encoding():
+    # Header value for outgoing calls
+    return ", ".join(CLIENT_ENCODINGS)
+
+
+def negotiate(header):
+    # Pick from an Accept-Encoding header, honouring q=0; None for identity
+    accepted = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in ENCODINGS:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+
+def compressor(encoding):
+    # (compress(chunk), flush()) pair for one response
+    if encoding == "zstd":
+        obj = zstd.ZstdCompressor(level=ZSTD_LEVEL)
+        return obj.compress, lambda: obj.flush(zstd.ZstdCompressor.FLUSH_FRAME)
+    obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return obj.compress, obj.flush
+
+
+def decompress(body, encoding):
+    # Used where no HTTP library decodes for us (common.transport)
+    if encoding == "gzip":
+        return zlib.decompress(body, 47)
+    if encoding == "zstd" and zstd:
+        return zstd.decompress(body)
+    return body
+
+
+def _chunks(iterable):
+    for chunk in iterable:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        for i in range(0, len(chunk), CHUNK):
+            yield chunk[i:i + CHUNK]
+
+
+def _compressed(iterable, encoding, labels):
+    compress, flush = compressor(encoding)
+    raw = encoded = 0
+    try:
+        for chunk in _chunks(iterable):
+            raw += len(chunk)
+            out = compress(chunk)
+            if out:
+                encoded += len(out)
+                yield out
+        out = flush()
+        encoded += len(out)
+        yield out
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+        response_bytes.inc(*labels, encoding, "raw", amount=raw)
+        response_bytes.inc(*labels, encoding, "encoded", amount=encoded)
+
+
+def instrument_app(app, service_name):
+    def compress(response):
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        length = response.content_length
+        if (
+            response.status_code < 200 or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+            or not (response.mimetype or "").startswith(COMPRESSIBLE)
+            or (length is not None and length < MIN_BYTES)
+            or request.method == "HEAD"
+        ):
+            if length is not None:
+                response_bytes.inc(service_name, route, "identity", "raw", amount=length)
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate(request.headers.get("Accept-Encoding", ""))
+        if encoding is None:
+            if length is not None:
+                response_bytes.inc(service_name, route, "identity", "raw", amount=length)
+            return response
+        body = response.response
+        response.direct_passthrough = True
+        response.response = _compressed(body, encoding, (service_name, route))
+        response.headers["Content-Encoding"] = encoding
+        response.headers.pop("Content-Length", None)
+        return response
+
+    app.after_request(compress)
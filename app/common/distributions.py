@@ -0,0 +1,23 @@
+import math
+import time
+
+# Latency distributions shared by topology files and fault profiles:
+#   {dist: fixed, ms}  {dist: uniform, min_ms, max_ms}  {dist: normal, mean_ms, stddev_ms}
+#   {dist: lognormal, median_ms, sigma}  {dist: exponential, mean_ms}
+DISTRIBUTIONS = {
+    "fixed": lambda rng, d: d["ms"],
+    "uniform": lambda rng, d: rng.uniform(d["min_ms"], d["max_ms"]),
+    "normal": lambda rng, d: max(0.0, rng.gauss(d["mean_ms"], d["stddev_ms"])),
+    "lognormal": lambda rng, d: d["median_ms"] * math.exp(rng.gauss(0, d["sigma"])),
+    "exponential": lambda rng, d: rng.expovariate(1 / d["mean_ms"]) if d["mean_ms"] else 0.0,
+}
+
+
+def sample_ms(rng, spec):
+    return DISTRIBUTIONS[spec.get("dist", "fixed")](rng, spec)
+
+
+def burn_cpu(ms):
+    deadline = time.thread_time() + ms / 1000
+    while time.thread_time() < deadline:
+        pass
@@ -0,0 +1,253 @@
+"""
+Seeded fault injection for any service.
+
+A profile maps routes (the Flask rule, or "*" for every other route) to
+faults, each drawn independently for a `rate` fraction of requests. A reset
+or error ends the request, so the other faults only reach the rest:
+
+    {"seed": 42, "routes": {"/process-gateway": {
+        "latency": {"rate": 0.3, "dist": "uniform", "min_ms": 3000, "max_ms": 9000},
+        "error":   {"rate": 0.15, "status": 500},
+        "inflate": {"rate": 0.1, "bytes": 45000000},
+        "reset":   {"rate": 0.01},
+        "cpu":     {"rate": 0.1, "ms": 50}}}}
+
+Decisions come from (seed, service, route, n) for the n-th request to a
+route, so the same profile injects the same faults into the same requests on
+every run regardless of thread scheduling. Each injected fault is added to
+the request span as a "fault.injected" event and counted in /metrics.
+
+Profiles are read per service from FAULTS_FILE (YAML, `services: {name:
+profile}`) and can be read, replaced (PUT) or cleared (DELETE) at
+/admin/faults. A profile is checked in full when it is loaded, so a bad one
+is refused (400) rather than failing requests. Delays are cut short when the
+profile changes. FAULTS_MAX_DELAYED=N caps them at N concurrent requests, so
+a latency fault cannot take every worker thread; delays over the cap are
+skipped and counted as "latency_skipped". The cap is off by default, as it
+makes which requests are delayed depend on concurrency.
+"""
+import itertools
+import os
+import random
+import socket
+import struct
+import threading
+import zlib
+
+from flask import Response, jsonify, request
+from opentelemetry import trace
+
+from common import bootstrap, metrics
+from common.admin import admin_only
+from common.distributions import DISTRIBUTIONS, burn_cpu, sample_ms
+
+# Only needed to read FAULTS_FILE
+yaml = bootstrap.lazy_import("yaml")
+
+FAULTS_FILE = os.getenv("FAULTS_FILE")
+# 0: no cap
+MAX_DELAYED = int(os.getenv("FAULTS_MAX_DELAYED", "0"))
+FAULT_TYPES = ("reset", "error", "cpu", "latency", "inflate")
+# Parameters each fault and latency distribution needs, besides rate
+REQUIRED = {"cpu": ("ms",), "inflate": ("bytes",)}
+DIST_PARAMS = {
+    "fixed": ("ms",), "uniform": ("min_ms", "max_ms"), "normal": ("mean_ms", "stddev_ms"),
+    "lognormal": ("median_ms", "sigma"), "exponential": ("mean_ms",),
+}
+
+faults_injected = metrics.registry.register(metrics.Counter(
+    "faults_injected", "Faults injected by the fault engine",
+    ("service", "route", "type"),
+))
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate(profile):
+    if not isinstance(profile, dict):
+        raise ValueError("a fault profile is a JSON object")
+    if not isinstance(profile.get("seed", 0), int):
+        raise ValueError("seed must be an integer")
+    routes = profile.get("routes") or {}
+    if not isinstance(routes, dict):
+        raise ValueError("routes must map routes to faults")
+    for route, faults in routes.items():
+        if not isinstance(faults, dict):
+            raise ValueError(f"{route}: faults must be an object")
+        for kind, spec in faults.items():
+            if kind not in FAULT_TYPES:
+                raise ValueError(f"{route}: unknown fault {kind!r}")
+            if not isinstance(spec, dict):
+                raise ValueError(f"{route} {kind}: must be an object")
+            rate = spec.get("rate", 0)
+            if not _number(rate) or not 0 <= rate <= 1:
+                raise ValueError(f"{route} {kind}: rate must be a number between 0 and 1")
+            required = REQUIRED.get(kind, ())
+            if kind == "latency":
+                dist = spec.get("dist", "fixed")
+                if dist not in DISTRIBUTIONS:
+                    raise ValueError(f"{route}: unknown latency dist {dist!r}")
+                required = DIST_PARAMS[dist]
+            for key in required:
+                if not _number(spec.get(key)) or spec[key] < 0:
+                    raise ValueError(f"{route} {kind}: {key} must be a number of at least 0")
+            status = spec.get("status", 500)
+            if kind == "error" and not (isinstance(status, int) and 400 <= status <= 599):
+                raise ValueError(f"{route} error: status must be an HTTP error status")
+    return profile
+
+
+class FaultInjector:
+    def __init__(self, service_name, profile=None):
+        self.service_name = service_name
+        self.lock = threading.Lock()
+        self.delayed = threading.BoundedSemaphore(MAX_DELAYED) if MAX_DELAYED > 0 else None
+        self.changed = threading.Event()
+        self.configure(profile or {})
+
+    def configure(self, profile):
+        profile = validate(profile)
+        with self.lock:
+            # Wake requests still sleeping on the previous profile
+            self.changed.set()
+            self.changed = threading.Event()
+            self.profile = profile
+            self.counts = {}
+        return profile
+
+    def decide(self, route):
+        # ((rng, changed event), {fault type: spec}) for the next request to a route
+        with self.lock:
+            routes = self.profile.get("routes") or {}
+            faults = routes.get(route) or routes.get("*")
+            if not faults:
+                return None, {}
+            n = self.counts[route] = self.counts.get(route, 0) + 1
+            seed = self.profile.get("seed", 0)
+            changed = self.changed
+        rng = random.Random(zlib.crc32(f"{seed}:{self.service_name}:{route}:{n}".encode()))
+        chosen = {kind: spec for kind, spec in faults.items() if rng.random() < spec.get("rate", 0)}
+        return (rng, changed), chosen
+
+    def record(self, route, kind, **attributes):
+        faults_injected.inc(self.service_name, route, kind)
+        trace.get_current_span().add_event(
+            "fault.injected", {"fault.type": kind, **{f"fault.{k}": v for k, v in attributes.items()}}
+        )
+
+    def before(self):
+        route = request.url_rule.rule if request.url_rule else None
+        if route is None or route.startswith("/admin") or route in ("/metrics", "/health", "/ready"):
+            return None
+        # Warm-up requests (common.readiness) must not use up the seeded schedule
+        if request.environ.get("readiness.warmup"):
+            return None
+        state, chosen = self.decide(route)
+        if not chosen:
+            return None
+        rng, changed = state
+        if "reset" in chosen:
+            self.record(route, "reset")
+            request.environ["faults.reset"] = True
+            return Response(status=500)
+        if "error" in chosen:
+            status = chosen["error"].get("status", 500)
+            self.record(route, "error", status=status)
+            return f"Injected fault: HTTP {status}\n", status
+        if "cpu" in chosen:
+            self.record(route, "cpu", ms=chosen["cpu"]["ms"])
+            burn_cpu(chosen["cpu"]["ms"])
+        if "latency" in chosen:
+            delay_ms = sample_ms(rng, chosen["latency"])
+            if self.delayed is None:
+                self.record(route, "latency", delay_ms=delay_ms)
+                changed.wait(delay_ms / 1000)
+            elif self.delayed.acquire(blocking=False):
+                self.record(route, "latency", delay_ms=delay_ms)
+                try:
+                    changed.wait(delay_ms / 1000)
+                finally:
+                    self.delayed.release()
+            else:
+                self.record(route, "latency_skipped", delay_ms=delay_ms)
+        if "inflate" in chosen:
+            # In the WSGI environ rather than g, which a nested request to the
+            # same app in this thread (LocalTransport) would share
+            request.environ["faults.inflate"] = (route, chosen["inflate"]["bytes"])
+        return None
+
+    def after(self, response):
+        inflate = request.environ.pop("faults.inflate", None)
+        if inflate and not response.direct_passthrough:
+            route, size = inflate
+            self.record(route, "inflate", bytes=size)
+            # Streamed, so a 45 MB body is never built in memory
+            length = response.content_length
+            response.response = itertools.chain(response.iter_encoded(), _filler(size))
+            if length is not None:
+                response.content_length = length + size
+        return response
+
+
+def _filler(size, chunk=64 * 1024):
+    block = b"A" * chunk
+    for _ in range(size // chunk):
+        yield block
+    yield block[:size % chunk]
+
+
+class ResetMiddleware:
+    # A reset can only be done below Flask, which would turn an exception
+    # into a 500: drop the socket without a response. Werkzeug and Gunicorn
+    # treat the ConnectionError as a dropped connection, and LocalTransport
+    # turns it into a requests.ConnectionError for in-process callers.
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        result = self.wsgi_app(environ, start_response)
+        if not environ.get("faults.reset"):
+            return result
+        if hasattr(result, "close"):
+            result.close()
+        sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+        if sock is not None:
+            # SO_LINGER 0 makes the final close send a RST; shutdown() drops
+            # the connection now even while the server still holds its files
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            sock.shutdown(socket.SHUT_RDWR)
+        raise ConnectionResetError("Injected fault: connection reset")
+
+
+def load_profile(service_name, path=FAULTS_FILE):
+    if not path:
+        return {}
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    return (config.get("services") or {}).get(service_name, {})
+
+
+def instrument_app(app, service_name):
+    injector = FaultInjector(service_name, load_profile(service_name))
+    app.extensions["faults"] = injector
+    app.before_request(injector.before)
+    app.after_request(injector.after)
+    app.wsgi_app = ResetMiddleware(app.wsgi_app)
+
+    @app.route("/admin/faults", methods=["GET", "PUT", "DELETE"])
+    @admin_only
+    def faults():
+        if request.method == "PUT":
+            try:
+                injector.configure(request.get_json(force=True))
+            except (ValueError, AttributeError) as e:
+                return f"Invalid fault profile: {e}\n", 400
+        elif request.method == "DELETE":
+            injector.configure({})
+        with injector.lock:
+            return jsonify({"profile": injector.profile, "requests": injector.counts})
+
+    return injector
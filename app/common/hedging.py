@@ -0,0 +1,201 @@
+"""
+Hedged requests for idempotent downstream calls.
+
+client.get(url, hedge=True) sends the request, and if no response has come
+back within the HEDGE_PERCENTILE latency of recent calls to the same URL, a
+second copy goes to another instance of the target (HEDGE_REPLICAS, e.g.
+"app-risk-orchestrator:5000=app-risk-orchestrator-2:5000|...", otherwise the
+same address, which Docker DNS spreads over replicas). The first response
+wins. The loser cannot be interrupted mid-read, so it runs to completion in
+the background and its response is dropped.
+
+Hedges spend a token bucket refilled by HEDGE_BUDGET per request (default
+0.05, i.e. at most ~5% extra requests). Both attempts are "hedged-request"
+spans linked to each other, with hedge.attempt and hedge.outcome attributes.
+
+Attempts run in a pool of HEDGE_MAX_CONCURRENT (64) threads and never wait
+for one: a call that finds every thread busy is sent unhedged from the
+caller's thread, and a hedge is skipped (outcome "saturated"), since time
+spent queued would look like a slow response and trigger more hedges.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit, urlunsplit
+
+from opentelemetry import trace
+from opentelemetry.trace import Link
+
+from common import metrics
+
+PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY_MS", "5")) / 1000
+BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))
+MAX_CONCURRENT = int(os.getenv("HEDGE_MAX_CONCURRENT", "64"))
+WINDOW = 256
+MIN_SAMPLES = 20
+
+hedge_requests = metrics.registry.register(metrics.Counter(
+    "hedge_requests", "Hedge-eligible calls by outcome", ("service", "target", "outcome"),
+))
+tracer = trace.get_tracer(__name__)
+
+
+def parse_replicas(value):
+    replicas = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        netloc, _, alternates = item.partition("=")
+        replicas[netloc] = [alt for alt in alternates.split("|") if alt]
+    return replicas
+
+
+class LatencyWindow:
+    def __init__(self, size=WINDOW):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, pct):
+        if len(self.samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class HedgeBudget:
+    def __init__(self, ratio, burst=10):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class Hedger:
+    def __init__(self, percentile=PERCENTILE, min_delay=MIN_DELAY, budget=BUDGET, replicas=None,
+                 max_concurrent=MAX_CONCURRENT):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.budget = HedgeBudget(budget)
+        self.replicas = replicas if replicas is not None else parse_replicas(os.getenv("HEDGE_REPLICAS", ""))
+        self.windows = {}
+        self.next_replica = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="hedge")
+        # One per pool thread, taken before submitting so nothing queues
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+
+    def window(self, key):
+        with self.lock:
+            return self.windows.setdefault(key, LatencyWindow())
+
+    def delay(self, key):
+        observed = self.window(key).percentile(self.percentile)
+        return max(self.min_delay, observed) if observed is not None else None
+
+    def alternate(self, url):
+        parts = urlsplit(url)
+        alternates = self.replicas.get(parts.netloc)
+        if not alternates:
+            return url
+        with self.lock:
+            i = self.next_replica.get(parts.netloc, 0)
+            self.next_replica[parts.netloc] = i + 1
+        return urlunsplit(parts._replace(netloc=alternates[i % len(alternates)]))
+
+    def attempt(self, send, method, url, kwargs, number, links, spans, window):
+        with tracer.start_as_current_span(
+            "hedged-request", links=links,
+            attributes={"hedge.attempt": number, "http.url": url},
+        ) as span:
+            spans[number] = span
+            if number > 1 and spans.get(1) is not None and spans[1].is_recording():
+                spans[1].add_link(span.get_span_context())
+            start = time.perf_counter()
+            try:
+                resp = send(method, url, **kwargs)
+            except Exception:
+                span.set_attribute("hedge.outcome", "failed")
+                raise
+            finally:
+                window.add(time.perf_counter() - start)
+            # The first successful attempt wins
+            won = spans.setdefault("winner", number) == number
+            span.set_attribute("hedge.outcome", "won" if won else "lost")
+            return resp
+
+    def run(self, send, service_name, method, url, **kwargs):
+        parts = urlsplit(url)
+        window = self.window((parts.netloc, parts.path))
+        delay = self.delay((parts.netloc, parts.path))
+        self.budget.deposit()
+        spans = {}
+        if delay is None:
+            # Not enough history yet to know what slow means
+            hedge_requests.inc(service_name, parts.netloc, "no_history")
+            return self.attempt(send, method, url, kwargs, 1, [], spans, window)
+
+        if not self.slots.acquire(blocking=False):
+            hedge_requests.inc(service_name, parts.netloc, "saturated")
+            return self.attempt(send, method, url, kwargs, 1, [], spans, window)
+
+        def submit(number, target, links=()):
+            # Runs an attempt on the slot the caller took
+            context = contextvars.copy_context()
+
+            def run_attempt():
+                try:
+                    return context.run(self.attempt, send, method, target, kwargs, number, list(links), spans, window)
+                finally:
+                    self.slots.release()
+
+            return self.pool.submit(run_attempt)
+
+        futures = {submit(1, url): 1}
+        done, _ = wait(futures, timeout=delay)
+        if done:
+            outcome = "not_needed"
+        elif not self.slots.acquire(blocking=False):
+            outcome = "saturated"
+        elif not self.budget.withdraw():
+            self.slots.release()
+            outcome = "budget_exhausted"
+        else:
+            primary = spans.get(1)
+            links = [Link(primary.get_span_context())] if primary is not None else []
+            hedge = submit(2, self.alternate(url), links)
+            futures[hedge] = 2
+            outcome = "hedged"
+
+        pending = set(futures)
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            succeeded = [f for f in done if f.exception() is None]
+            # A failed attempt only loses if the other one can still answer
+            if succeeded or not pending:
+                finished = succeeded[0] if succeeded else next(iter(done))
+                break
+        if outcome == "hedged":
+            outcome = "hedge_won" if futures[finished] == 2 else "primary_won"
+            for loser in pending:
+                # Drop the slower response as soon as it arrives
+                loser.add_done_callback(lambda f: f.exception() or f.result().close())
+        hedge_requests.inc(service_name, parts.netloc, outcome)
+        return finished.result()
+
+
+hedger = Hedger()
@@ -0,0 +1,230 @@
+"""
+Idempotency-Key deduplication for unsafe requests.
+
+A POST, PUT, PATCH or DELETE carrying an Idempotency-Key header is executed
+once per (route, key). The first request claims the key; copies that arrive
+while it runs wait for it (up to IDEMPOTENCY_WAIT seconds, then 409 with
+Retry-After), and copies that arrive after it finished get the stored
+status, headers and body back with `Idempotent-Replayed: true`, without
+touching the handler or anything downstream of it. A copy whose body differs
+from the first one is refused with a 422. 5xx responses and exceptions are
+not stored: the key is released, so the next retry executes again. The body
+is hashed as it is read and kept for the handler in a temporary file that
+stays in memory up to IDEMPOTENCY_SPOOL_BYTES (1 MiB), so a keyed upload
+(e.g. a settlement file) is never held in memory whole.
+
+Keys live in a per-service store of at most IDEMPOTENCY_MAX_ENTRIES entries
+(least recently used evicted first); completed ones expire after
+IDEMPOTENCY_TTL seconds. Each keyed request is counted in /metrics by
+outcome (executed, replayed, waited, conflict, in_flight) and the request
+span gets idempotency.key and idempotency.outcome attributes.
+
+Calls the shared client makes with an unsafe method while handling a keyed
+request carry a key derived from the incoming one, the method, the URL and
+how many calls with that method and URL the request made before it. So a
+retried request replays its downstream writes instead of repeating them,
+while sibling writes to the same URL (a fan-out, a `repeat:`) each run.
+
+Set IDEMPOTENCY=off to disable.
+"""
+import hashlib
+import itertools
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, has_request_context, request
+from opentelemetry import trace
+
+from common import metrics
+
+ENABLED = os.getenv("IDEMPOTENCY", "on") != "off"
+MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+TTL = float(os.getenv("IDEMPOTENCY_TTL", "300"))
+WAIT = float(os.getenv("IDEMPOTENCY_WAIT", "30"))
+HEADER = "Idempotency-Key"
+REPLAYED = "Idempotent-Replayed"
+METHODS = ("POST", "PUT", "PATCH", "DELETE")
+MAX_KEY_LENGTH = 255
+SPOOL_BYTES = int(os.getenv("IDEMPOTENCY_SPOOL_BYTES", str(1024 * 1024)))
+CHUNK = 64 * 1024
+# Recomputed for the replayed body
+SKIPPED_HEADERS = ("content-length", "content-encoding")
+
+keyed_requests = metrics.registry.register(metrics.Counter(
+    "idempotency_requests", "Requests with an Idempotency-Key, by outcome",
+    ("service", "route", "outcome"),
+))
+stored_keys = metrics.registry.register(metrics.Gauge(
+    "idempotency_keys", "Keys held in the idempotency store", ("service",),
+))
+evicted_keys = metrics.registry.register(metrics.Counter(
+    "idempotency_evicted", "Keys evicted from a full idempotency store before they expired", ("service",),
+))
+
+
+class Entry:
+    __slots__ = ("fingerprint", "expires", "response", "done")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.expires = None
+        # (status, headers, body) once the first request completed
+        self.response = None
+        self.done = threading.Event()
+
+
+class IdempotencyStore:
+    def __init__(self, service_name, max_entries=MAX_ENTRIES, ttl=TTL):
+        self.service_name = service_name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def claim(self, key, fingerprint):
+        # (entry, True) if the caller now owns the key, else (existing entry, False)
+        now = time.monotonic()
+        with self.lock:
+            # Least recently used first, so expired entries mostly sit at the front
+            while self.entries:
+                oldest = next(iter(self.entries.values()))
+                if oldest.expires is None or oldest.expires > now:
+                    break
+                self.entries.popitem(last=False)
+            entry = self.entries.get(key)
+            if entry is not None and (entry.expires is None or entry.expires > now):
+                self.entries.move_to_end(key)
+                return entry, False
+            entry = self.entries[key] = Entry(fingerprint)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                # An evicted in-flight entry still completes for whoever waits on it
+                self.entries.popitem(last=False)
+                evicted_keys.inc(self.service_name)
+            stored_keys.set(self.service_name, value=len(self.entries))
+            return entry, True
+
+    def complete(self, entry, response):
+        with self.lock:
+            entry.response = response
+            entry.expires = time.monotonic() + self.ttl
+        entry.done.set()
+
+    def release(self, key, entry):
+        # Forget a failed execution; waiters wake up and one of them retries it
+        with self.lock:
+            if self.entries.get(key) is entry:
+                del self.entries[key]
+            stored_keys.set(self.service_name, value=len(self.entries))
+        entry.done.set()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+
+def fingerprint():
+    digest = hashlib.sha256(request.method.encode())
+    digest.update(request.full_path.encode())
+    body = tempfile.SpooledTemporaryFile(SPOOL_BYTES)
+    while chunk := request.stream.read(CHUNK):
+        digest.update(chunk)
+        body.write(chunk)
+    body.seek(0)
+    # The handler reads the copy (get_data, get_json and form read the stream too)
+    request.stream = body
+    return digest.hexdigest()
+
+
+def downstream_key(method, url):
+    # Key for a call made while handling a keyed request, None otherwise
+    if not ENABLED or method.upper() not in METHODS or not has_request_context():
+        return None
+    incoming = request.headers.get(HEADER)
+    if not incoming:
+        return None
+    # Per request in the WSGI environ, like the claim; next() on a count is
+    # atomic, so the calls of a parallel fan-out get distinct numbers
+    calls = request.environ.setdefault("idempotency.calls", {})
+    n = next(calls.setdefault((method.upper(), url), itertools.count(1)))
+    return hashlib.sha256(f"{incoming}\n{method.upper()}\n{url}\n{n}".encode()).hexdigest()[:32]
+
+
+def replay(entry):
+    status, headers, body = entry.response
+    response = Response(body, status=status, headers=headers)
+    response.headers[REPLAYED] = "true"
+    return response
+
+
+def instrument_app(app, service_name):
+    if not ENABLED:
+        return None
+    store = IdempotencyStore(service_name)
+    app.extensions["idempotency"] = store
+
+    def record(route, outcome):
+        keyed_requests.inc(service_name, route, outcome)
+        trace.get_current_span().set_attribute("idempotency.outcome", outcome)
+
+    def before():
+        if request.method not in METHODS:
+            return None
+        key = request.headers.get(HEADER)
+        route = request.url_rule.rule if request.url_rule else None
+        if not key or route is None or route.startswith("/admin"):
+            return None
+        if len(key) > MAX_KEY_LENGTH:
+            return f"{HEADER} is longer than {MAX_KEY_LENGTH} characters\n", 400
+        trace.get_current_span().set_attribute("idempotency.key", key)
+        digest = fingerprint()
+        deadline = time.monotonic() + WAIT
+        waited = False
+        while True:
+            entry, owner = store.claim((route, key), digest)
+            if owner:
+                # In the WSGI environ rather than g, which a nested request to the
+                # same app in this thread (LocalTransport) would share
+                request.environ["idempotency.claim"] = (route, key, entry)
+                record(route, "executed")
+                return None
+            if entry.fingerprint != digest:
+                record(route, "conflict")
+                return f"{HEADER} {key} was already used with a different request\n", 422
+            if not entry.done.is_set():
+                waited = True
+                if not entry.done.wait(max(0.0, deadline - time.monotonic())):
+                    record(route, "in_flight")
+                    return (f"A request with {HEADER} {key} is still in progress\n", 409,
+                            {"Retry-After": "1"})
+            if entry.response is not None:
+                record(route, "waited" if waited else "replayed")
+                return replay(entry)
+            # The first execution failed and released the key: claim it again
+
+    def after(response):
+        claimed = request.environ.pop("idempotency.claim", None)
+        if claimed is None:
+            return response
+        route, key, entry = claimed
+        if response.status_code >= 500 or response.is_streamed:
+            store.release((route, key), entry)
+        else:
+            headers = [(k, v) for k, v in response.headers.items() if k.lower() not in SKIPPED_HEADERS]
+            store.complete(entry, (response.status_code, headers, response.get_data()))
+        return response
+
+    def release_on_error(exc):
+        # The handler raised before after_request stored anything
+        claimed = request.environ.pop("idempotency.claim", None)
+        if claimed is not None:
+            route, key, entry = claimed
+            store.release((route, key), entry)
+
+    app.before_request(before)
+    app.after_request(after)
+    app.teardown_request(release_on_error)
+    return store
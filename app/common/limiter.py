@@ -0,0 +1,217 @@
+"""
+Adaptive concurrency limit and load shedding per service.
+
+Each service admits at most `limit` requests at once. The limit follows the
+measured handler latency:
+
+  gradient  (default) limit *= long-term RTT / short-term RTT, plus a small
+            queue allowance, so the limit shrinks as soon as latency rises
+            above its baseline and grows back while it stays flat
+  aimd      +1 while the service is busy and fast, x0.9 on a 5xx or a
+            response slower than LIMITER_AIMD_LATENCY_MS
+
+Requests are admitted by priority against a share of the limit: critical
+100%, normal 90%, sheddable 75%, so reads are shed before writes. GET
+requests are sheddable and everything else critical unless the route is
+listed in LIMITER_PRIORITIES ("/get-balance=normal,/settle-payment=critical")
+or app.config["LIMITER_PRIORITIES"]. Rejected requests get a 503 with
+Retry-After straight away.
+
+Calls a service makes while handling a request carry that request's
+priority in X-Request-Priority, and the callee admits them at it: the GET
+/process-gateway that a critical POST /settle-payment depends on is as
+critical as its caller, rather than shed as a read. The header is ignored
+on requests that came through the NGINX gateway, so clients cannot raise
+their own priority.
+
+Set LIMITER=off to disable.
+"""
+import math
+import os
+import threading
+import time
+
+from flask import has_request_context, request
+
+from common import metrics
+
+MODE = os.getenv("LIMITER", "gradient")
+INITIAL_LIMIT = int(os.getenv("LIMITER_INITIAL", "20"))
+MIN_LIMIT = int(os.getenv("LIMITER_MIN", "4"))
+MAX_LIMIT = int(os.getenv("LIMITER_MAX", "200"))
+AIMD_LATENCY = float(os.getenv("LIMITER_AIMD_LATENCY_MS", "500")) / 1000
+SHARES = {"critical": 1.0, "normal": 0.9, "sheddable": 0.75}
+HEADER = "X-Request-Priority"
+
+limit_gauge = metrics.registry.register(metrics.Gauge(
+    "limiter_limit", "Current adaptive concurrency limit", ("service",),
+))
+inflight_gauge = metrics.registry.register(metrics.Gauge(
+    "limiter_inflight", "Requests admitted and not yet finished", ("service",),
+))
+rtt_gauge = metrics.registry.register(metrics.Gauge(
+    "limiter_rtt_seconds", "Latency estimates the limit is derived from", ("service", "window"),
+))
+rejected = metrics.registry.register(metrics.Counter(
+    "limiter_rejected", "Requests shed with a 503", ("service", "route", "priority"),
+))
+
+
+def parse_priorities(value):
+    priorities = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        route, _, priority = item.partition("=")
+        if priority not in SHARES:
+            raise ValueError(f"LIMITER_PRIORITIES: unknown priority {priority!r} for {route}")
+        priorities[route] = priority
+    return priorities
+
+
+def propagated_priority(headers):
+    # The calling service's priority, None for a request from outside; NGINX
+    # sets X-Real-IP on everything it proxies, as common.admin relies on too
+    if "X-Real-IP" in headers:
+        return None
+    priority = headers.get(HEADER)
+    return priority if priority in SHARES else None
+
+
+def downstream_priority():
+    # Priority for a call made while handling a request, None otherwise
+    if not has_request_context():
+        return None
+    return request.environ.get("limiter.priority")
+
+
+class GradientLimit:
+    def __init__(self, initial, min_limit, max_limit, smoothing=0.2, tolerance=1.5):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.short_rtt = None
+        self.long_rtt = None
+
+    def update(self, rtt, inflight, dropped):
+        if self.short_rtt is None:
+            self.short_rtt = self.long_rtt = rtt
+        self.short_rtt += 0.1 * (rtt - self.short_rtt)
+        self.long_rtt += 0.01 * (rtt - self.long_rtt)
+        # Let the baseline follow a lasting improvement quickly
+        if self.long_rtt / self.short_rtt > 2:
+            self.long_rtt *= 0.95
+        # Only adjust while the limit is what holds requests back
+        if inflight < self.limit / 2:
+            return self.limit
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_rtt / self.short_rtt))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, self.limit))
+        return self.limit
+
+
+class AIMDLimit:
+    def __init__(self, initial, min_limit, max_limit, latency=AIMD_LATENCY, backoff=0.9):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency = latency
+        self.backoff = backoff
+        self.short_rtt = self.long_rtt = None
+
+    def update(self, rtt, inflight, dropped):
+        self.short_rtt = rtt
+        if dropped or rtt > self.latency:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif inflight * 2 >= self.limit:
+            self.limit = min(self.max_limit, self.limit + 1)
+        return self.limit
+
+
+ALGORITHMS = {"gradient": GradientLimit, "aimd": AIMDLimit}
+
+
+class ConcurrencyLimiter:
+    def __init__(self, service_name, algorithm):
+        self.service_name = service_name
+        self.algorithm = algorithm
+        self.lock = threading.Lock()
+        self.inflight = 0
+        limit_gauge.set(service_name, value=round(algorithm.limit, 1))
+
+    def try_acquire(self, priority):
+        with self.lock:
+            if self.inflight >= max(1, int(self.algorithm.limit * SHARES[priority])):
+                return False
+            self.inflight += 1
+            inflight_gauge.set(self.service_name, value=self.inflight)
+            return True
+
+    def release(self, rtt, dropped):
+        with self.lock:
+            limit = self.algorithm.update(rtt, self.inflight, dropped)
+            self.inflight -= 1
+            inflight_gauge.set(self.service_name, value=self.inflight)
+            limit_gauge.set(self.service_name, value=round(limit, 1))
+            if self.algorithm.short_rtt is not None:
+                rtt_gauge.set(self.service_name, "short", value=self.algorithm.short_rtt)
+            if self.algorithm.long_rtt is not None:
+                rtt_gauge.set(self.service_name, "long", value=self.algorithm.long_rtt)
+
+    def retry_after(self):
+        # Whole seconds, as Retry-After requires; roughly one drain of the queue
+        rtt = self.algorithm.short_rtt or 0
+        return max(1, math.ceil(rtt * self.inflight / max(1.0, self.algorithm.limit)))
+
+
+def instrument_app(app, service_name):
+    if MODE == "off":
+        return None
+    limiter = ConcurrencyLimiter(
+        service_name, ALGORITHMS[MODE](INITIAL_LIMIT, MIN_LIMIT, MAX_LIMIT)
+    )
+    app.extensions["limiter"] = limiter
+    priorities = parse_priorities(os.getenv("LIMITER_PRIORITIES", ""))
+
+    def priority_of(route):
+        propagated = propagated_priority(request.headers)
+        if propagated:
+            return propagated
+        configured = app.config.get("LIMITER_PRIORITIES", {})
+        priority = priorities.get(route) or configured.get(route)
+        if priority:
+            return priority
+        return "sheddable" if request.method in ("GET", "HEAD") else "critical"
+
+    def admit():
+        route = request.url_rule.rule if request.url_rule else None
+        # Shedding health checks would take the whole replica out of NGINX
+        if route is None or route.startswith("/admin") or route in ("/metrics", "/health", "/ready"):
+            return None
+        priority = priority_of(route)
+        if not limiter.try_acquire(priority):
+            rejected.inc(service_name, route, priority)
+            return (f"{service_name} is overloaded, retry later\n", 503,
+                    {"Retry-After": str(limiter.retry_after())})
+        # In the WSGI environ rather than g: a nested request to the same app
+        # in this thread (LocalTransport) shares g with this one
+        request.environ["limiter.priority"] = priority
+        request.environ["limiter.start"] = time.perf_counter()
+        return None
+
+    def record_status(response):
+        request.environ["limiter.status"] = response.status_code
+        return response
+
+    def finish(exc):
+        start = request.environ.pop("limiter.start", None)
+        if start is None:
+            return
+        dropped = exc is not None or request.environ.get("limiter.status", 500) >= 500
+        limiter.release(time.perf_counter() - start, dropped)
+
+    app.before_request(admit)
+    app.after_request(record_status)
+    app.teardown_request(finish)
+    return limiter
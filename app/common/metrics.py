@@ -0,0 +1,234 @@
+"""
+Minimal in-process metrics registry with Prometheus/OpenMetrics exposition.
+
+Histograms keep the trace ID of the last observation in each bucket as an
+exemplar, so a latency spike on a Grafana panel links straight to a trace in
+Tempo. Exemplars are only part of the OpenMetrics format, which Prometheus
+asks for in its Accept header.
+"""
+import bisect
+import threading
+import time
+import weakref
+
+from flask import Response, request
+from opentelemetry import trace
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+OPENMETRICS = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def current_trace_id():
+    ctx = trace.get_current_span().get_span_context()
+    return format(ctx.trace_id, "032x") if ctx.is_valid else None
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _exemplar(exemplar, openmetrics):
+    if not (openmetrics and exemplar):
+        return ""
+    trace_id, value, ts = exemplar
+    return f' # {{traceID="{trace_id}"}} {value} {ts:.3f}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def header(self, openmetrics):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def series(self, service):
+        # Called with the lock held; in host mode each service's /metrics
+        # only shows its own series so Prometheus does not count them 13 times
+        if service is None or self.label_names[:1] != ("service",):
+            return list(self.values.items())
+        return [(labels, v) for labels, v in self.values.items() if labels[0] == service]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self, openmetrics, service=None):
+        lines = self.header(openmetrics)
+        with self.lock:
+            for labels, value in self.series(service):
+                lines.append(f"{self.name}_total{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self.lock:
+            self.values[labels] = value
+
+    def render(self, openmetrics, service=None):
+        lines = self.header(openmetrics)
+        with self.lock:
+            for labels, value in self.series(service):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels, trace_id=None):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                # per-bucket counts (+Inf last), sum, per-bucket exemplars
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, {}]
+            series[0][index] += 1
+            series[1] += value
+            if trace_id:
+                series[2][index] = (trace_id, value, time.time())
+
+    def render(self, openmetrics, service=None):
+        lines = self.header(openmetrics)
+        with self.lock:
+            for labels, (counts, total, exemplars) in self.series(service):
+                cumulative = 0
+                for i, bound in enumerate(self.buckets + (float("inf"),)):
+                    cumulative += counts[i]
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_labels = _labels(self.label_names, labels, f'le="{le}"')
+                    lines.append(
+                        f"{self.name}_bucket{bucket_labels} {cumulative}"
+                        f"{_exemplar(exemplars.get(i), openmetrics)}"
+                    )
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, openmetrics=False, service=None):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(openmetrics, service))
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+server_duration = registry.register(Histogram(
+    "http_server_request_duration_seconds", "Handler latency by route",
+    ("service", "method", "route", "status"),
+))
+server_active = registry.register(Gauge(
+    "http_server_active_requests", "Requests currently being handled",
+    ("service", "route"),
+))
+server_errors = registry.register(Counter(
+    "http_server_errors", "Requests that failed with a 5xx or an exception",
+    ("service", "method", "route", "status"),
+))
+server_connection_requests = registry.register(Counter(
+    "http_server_connection_requests", "Requests by whether they opened a new connection or reused one",
+    ("service", "connection"),
+))
+client_duration = registry.register(Histogram(
+    "http_client_request_duration_seconds", "Downstream call latency by target",
+    ("service", "target", "method", "status"),
+))
+client_active = registry.register(Gauge(
+    "http_client_active_requests", "Downstream calls currently in flight",
+    ("service", "target"),
+))
+client_errors = registry.register(Counter(
+    "http_client_errors", "Downstream calls that failed with a 5xx or a connection error",
+    ("service", "target", "reason"),
+))
+
+
+def instrument_app(app, service_name):
+    connections = weakref.WeakSet()
+
+    def start_timer():
+        if request.path in ("/metrics", "/health", "/ready"):
+            return
+        # Warm-up requests (common.readiness) are not traffic
+        if request.environ.get("readiness.warmup"):
+            return
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        # In the WSGI environ rather than g: a nested request to the same app
+        # in this thread (LocalTransport) shares g with this one
+        request.environ["metrics.timer"] = (route, time.perf_counter())
+        server_active.inc(service_name, route)
+        # Every request on a kept-alive connection carries the same socket
+        # object (the Werkzeug development server closes after each one)
+        sock = request.environ.get("gunicorn.socket") or request.environ.get("werkzeug.socket")
+        if sock is not None:
+            reused = sock in connections
+            connections.add(sock)
+            server_connection_requests.inc(service_name, "reused" if reused else "new")
+
+    def record_status(response):
+        request.environ["metrics.status"] = response.status_code
+        return response
+
+    # Runs before the Flask instrumentation's teardown, so the request span
+    # is still current and its trace ID can be attached as an exemplar
+    def stop_timer(exc):
+        timer = request.environ.pop("metrics.timer", None)
+        if timer is None:
+            return
+        route, start = timer
+        status = "500" if exc is not None else str(request.environ.get("metrics.status", 500))
+        server_active.dec(service_name, route)
+        server_duration.observe(
+            time.perf_counter() - start, service_name, request.method, route, status,
+            trace_id=current_trace_id(),
+        )
+        if exc is not None or status.startswith("5"):
+            server_errors.inc(service_name, request.method, route, status)
+
+    app.before_request(start_timer)
+    app.after_request(record_status)
+    app.teardown_request(stop_timer)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        openmetrics = "application/openmetrics-text" in request.headers.get("Accept", "")
+        return Response(registry.render(openmetrics, service_name), content_type=OPENMETRICS if openmetrics else PROMETHEUS)
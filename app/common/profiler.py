@@ -0,0 +1,267 @@
+"""
+Sampling profiler tied to the active span of each thread.
+
+A background thread reads every thread's Python stack with
+sys._current_frames() and counts collapsed stacks (flamegraph.pl /
+speedscope format). Each stack is rooted at the span that was current on
+that thread, e.g. "payments-processor:settle-payment;...". The leaf is tagged
+with what the thread was doing:
+
+  [cpu]   the thread used CPU since the previous sample
+  [wait]  blocked in socket/lock/queue code (I/O or a lock), or off CPU
+          with no other thread running, e.g. in time.sleep
+  [gil]   inside Python code and off CPU while another thread was on CPU,
+          i.e. most likely waiting for the GIL
+
+GET /admin/profile?seconds=10&hz=100&format=collapsed|json profiles on demand.
+With PROFILER_HZ set (e.g. 2), a low-rate profile runs all the time and keeps
+the last PROFILER_WINDOWS minutes, served from /admin/profile/continuous.
+"""
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from flask import Response, jsonify, request
+from opentelemetry.sdk.trace import SpanProcessor
+
+from common.admin import admin_only
+
+MAX_STACKS = 5_000
+MAX_TRACES_PER_STACK = 5
+BLOCKING_MODULES = ("socket", "selectors", "ssl", "threading", "queue", "subprocess", "http/client")
+CONTINUOUS_HZ = float(os.getenv("PROFILER_HZ", "0"))
+CONTINUOUS_WINDOWS = int(os.getenv("PROFILER_WINDOWS", "15"))
+
+
+class ActiveSpanTracker(SpanProcessor):
+    # thread ident -> stack of (span name, trace id, span id) started on that thread
+
+    def __init__(self):
+        self.active = {}
+
+    def on_start(self, span, parent_context=None):
+        ctx = span.get_span_context()
+        entry = (span.name, format(ctx.trace_id, "032x"), ctx.span_id)
+        self.active.setdefault(threading.get_ident(), []).append(entry)
+
+    def on_end(self, span):
+        # on_end gets a read-only copy of the span, so match on its span ID.
+        # Spans nearly always end on the thread that started them
+        span_id = span.get_span_context().span_id
+        own = threading.get_ident()
+        idents = [own] + [i for i in list(self.active) if i != own]
+        for ident in idents:
+            stack = self.active.get(ident, ())
+            for i in range(len(stack) - 1, -1, -1):
+                if stack[i][2] == span_id:
+                    del stack[i]
+                    if not stack:
+                        self.active.pop(ident, None)
+                    return
+
+    def current(self, ident):
+        # Read from the sampler thread while request threads update it
+        try:
+            return self.active[ident][-1][:2]
+        except (KeyError, IndexError):
+            return None
+
+
+span_tracker = ActiveSpanTracker()
+
+
+class Profile:
+    """Bounded collapsed-stack counts plus a few trace IDs per stack."""
+
+    def __init__(self, max_stacks=MAX_STACKS):
+        self.max_stacks = max_stacks
+        self.stacks = Counter()
+        self.traces = {}
+        self.dropped = 0
+        self.samples = 0
+
+    def add(self, stack, trace_id):
+        self.samples += 1
+        if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+            self.dropped += 1
+            return
+        self.stacks[stack] += 1
+        if trace_id:
+            ids = self.traces.setdefault(stack, Counter())
+            if trace_id in ids or len(ids) < MAX_TRACES_PER_STACK:
+                ids[trace_id] += 1
+
+    def merge(self, other):
+        for stack, count in other.stacks.items():
+            self.stacks[stack] += count
+            for trace_id, n in other.traces.get(stack, {}).items():
+                self.traces.setdefault(stack, Counter())[trace_id] += n
+        self.dropped += other.dropped
+        self.samples += other.samples
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def to_json(self):
+        return {
+            "samples": self.samples,
+            "dropped": self.dropped,
+            "stacks": [
+                {"stack": stack, "count": count, "traces": dict(self.traces.get(stack, {}))}
+                for stack, count in self.stacks.most_common()
+            ],
+        }
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}"
+
+
+class Sampler:
+    def __init__(self, hz, all_threads=False):
+        self.interval = 1.0 / hz
+        self.all_threads = all_threads
+        self.cpu = {}
+
+    def busy(self, ident, wall):
+        # Whether the thread was on CPU for most of the time since the
+        # previous sample; None on its first sample
+        try:
+            cpu_now = time.clock_gettime(time.pthread_getcpuclockid(ident))
+        except (OSError, OverflowError, AttributeError):
+            return True
+        last = self.cpu.get(ident)
+        self.cpu[ident] = (cpu_now, wall)
+        if last is None:
+            return None
+        return (cpu_now - last[0]) > 0.5 * (wall - last[1])
+
+    @staticmethod
+    def state(busy, leaf_file, contended):
+        if busy:
+            return "cpu"
+        if any(f"{os.sep}{name}" in leaf_file for name in BLOCKING_MODULES):
+            return "wait"
+        if busy is None:
+            return "cpu"
+        # Off CPU in Python code is only GIL contention if some other
+        # thread could have been holding it; otherwise it is sleeping or
+        # blocked in a C call
+        return "gil" if contended else "wait"
+
+    def sample(self, profile):
+        own = threading.get_ident()
+        wall = time.perf_counter()
+        frames = sys._current_frames()
+        # Forget CPU readings of threads that have exited
+        self.cpu = {ident: v for ident, v in self.cpu.items() if ident in frames}
+        # Every thread counts as a possible GIL holder, with a span or not
+        busy = {ident: self.busy(ident, wall) for ident in frames if ident != own}
+        running = sum(1 for b in busy.values() if b)
+        for ident, frame in frames.items():
+            if ident == own:
+                continue
+            span = span_tracker.current(ident)
+            if span is None and not self.all_threads:
+                continue
+            names = []
+            leaf_file = frame.f_code.co_filename
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            names.reverse()
+            root = span[0] if span else "[no-span]"
+            state = self.state(busy[ident], leaf_file, running > 0)
+            profile.add(f"{root};{';'.join(names)};[{state}]", span[1] if span else None)
+
+    def run(self, seconds, profile):
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            self.sample(profile)
+            time.sleep(self.interval)
+        return profile
+
+
+class ContinuousProfiler:
+    # One Profile per minute, the last `windows` minutes kept
+
+    def __init__(self, hz, windows):
+        self.sampler = Sampler(hz)
+        self.windows = deque(maxlen=windows)
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.loop, name="continuous-profiler", daemon=True).start()
+
+    def loop(self):
+        while True:
+            window = Profile(MAX_STACKS // 4)
+            with self.lock:
+                self.windows.append(window)
+            end = time.perf_counter() + 60
+            while time.perf_counter() < end:
+                with self.lock:
+                    self.sampler.sample(window)
+                time.sleep(self.sampler.interval)
+
+    def snapshot(self, minutes):
+        merged = Profile()
+        with self.lock:
+            for window in list(self.windows)[-minutes:]:
+                merged.merge(window)
+        return merged
+
+
+continuous = None
+
+
+def _respond(profile, fmt):
+    if fmt == "json":
+        return jsonify(profile.to_json())
+    return Response(profile.collapsed(), content_type="text/plain; charset=utf-8")
+
+
+def positive_arg(name, default, limit):
+    # request.args[name] capped at limit; ValueError unless it is a positive number
+    try:
+        value = float(request.args.get(name, default))
+    except ValueError:
+        value = math.nan
+    if not 0 < value < math.inf:
+        raise ValueError(f"{name} must be a positive number")
+    return min(value, limit)
+
+
+def instrument_app(app):
+    global continuous
+    if CONTINUOUS_HZ > 0 and continuous is None:
+        continuous = ContinuousProfiler(CONTINUOUS_HZ, CONTINUOUS_WINDOWS)
+        continuous.start()
+
+    @app.route("/admin/profile", methods=["GET"])
+    @admin_only
+    def profile():
+        try:
+            seconds = positive_arg("seconds", 10, 60)
+            hz = positive_arg("hz", 100, 1000)
+        except ValueError as e:
+            return f"Invalid profile request: {e}\n", 400
+        all_threads = request.args.get("threads") == "all"
+        result = Sampler(hz, all_threads).run(seconds, Profile())
+        return _respond(result, request.args.get("format", "collapsed"))
+
+    @app.route("/admin/profile/continuous", methods=["GET"])
+    @admin_only
+    def profile_continuous():
+        if continuous is None:
+            return "Continuous profiling is off; set PROFILER_HZ\n", 404
+        try:
+            minutes = max(1, int(positive_arg("minutes", CONTINUOUS_WINDOWS, CONTINUOUS_WINDOWS)))
+        except ValueError as e:
+            return f"Invalid profile request: {e}\n", 400
+        return _respond(continuous.snapshot(minutes), request.args.get("format", "collapsed"))
@@ -0,0 +1,276 @@
+"""
+Liveness and readiness endpoints, with a warm-up before readiness.
+
+GET /health answers 200 as long as the process serves requests. GET /ready
+answers 503 (Retry-After: 1) until the service has warmed up, then 200; both
+return the warm-up steps as JSON. NGINX's active health check uses /ready,
+so a new or restarted replica only gets gateway traffic once its first
+requests no longer pay for setup.
+
+The warm-up runs once, in a background thread, when Gunicorn has loaded the
+worker (gunicorn.conf.py), when host.py starts serving, or on the first
+/ready otherwise. It is one `<service>:warmup` trace with a span per step:
+
+  * connections: opens WARMUP_CONNECTIONS (4) pooled connections to every
+    downstream host the service calls, by GET /health, retrying until the
+    host answers or WARMUP_CONNECT_TIMEOUT (5 s) runs out for that host, so a
+    dependency that is down delays readiness by seconds. The hosts come from the
+    service's entry in the topology file (TOPOLOGY_FILE), its HEDGE_REPLICAS
+    alternates and WARMUP_TARGETS=host:port,...
+  * requests: sends WARMUP_REQUESTS (2) synthetic requests to each GET route
+    without arguments through the app itself, which loads whatever the
+    handlers import lazily and seeds the limiter's and hedger's latency
+    estimates. They and the calls they make carry an X-Warmup header: fault
+    profiles skip them and RED metrics do not count them, here and in every
+    downstream service, so the seeded schedules still start at the first real
+    request. The header is ignored on requests that came through NGINX.
+  * any step a service adds with Readiness.add_step(name, fn), e.g. to fill
+    a cache.
+  * telemetry: flushes the tracer provider, so the span exporter has its
+    connection to the collector before the first real span.
+
+The hosts of the connections step can also be set per app in
+app.config["WARMUP_TARGETS"], as common.topology does for its services.
+
+A step that fails (a downstream that is down, say) is reported but does not
+hold readiness back: callers already handle failed calls, and a replica that
+waits on its dependencies could never become ready during an outage. Step
+durations and readiness are exported as service_warmup_seconds and
+service_ready. Set WARMUP=off to be ready at once.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from flask import Response, has_request_context, request
+from opentelemetry import trace
+from opentelemetry.trace import Status, StatusCode
+
+from common import hedging, metrics, telemetry
+
+ENABLED = os.getenv("WARMUP", "on") != "off"
+CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "4"))
+REQUESTS = int(os.getenv("WARMUP_REQUESTS", "2"))
+TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "30"))
+CONNECT_TIMEOUT = float(os.getenv("WARMUP_CONNECT_TIMEOUT", "5"))
+TARGETS = [t.strip() for t in os.getenv("WARMUP_TARGETS", "").split(",") if t.strip()]
+TOPOLOGY_FILE = os.getenv("TOPOLOGY_FILE", "topology.yaml")
+# Not warmed, limited, fault-injected or counted as traffic
+PATHS = ("/health", "/ready")
+# Set on synthetic requests' WSGI environ
+WARMUP_ENVIRON = "readiness.warmup"
+# Sent on the calls made while handling one
+HEADER = "X-Warmup"
+
+logger = logging.getLogger(__name__)
+
+service_ready = metrics.registry.register(metrics.Gauge(
+    "service_ready", "1 once the service has warmed up and /ready answers 200", ("service",),
+))
+warmup_seconds = metrics.registry.register(metrics.Gauge(
+    "service_warmup_seconds", "Time each warm-up step took", ("service", "step"),
+))
+
+
+def topology_targets(service_name, path=TOPOLOGY_FILE):
+    # host:port of every service this one calls directly, per the topology file
+    if not os.path.exists(path):
+        return []
+    # Imported here: common.topology imports common.service, which imports this
+    from common.topology import call_url, load_topology
+    topology = load_topology(path)
+    service = topology["services"].get(service_name) or {}
+    return sorted({
+        urlsplit(call_url(topology, call)).netloc
+        for spec in (service.get("routes") or {}).values()
+        for call in spec.get("calls") or ()
+        if call.get("via") != "nginx"
+    })
+
+
+def propagated_warmup(headers):
+    # Whether a calling service's warm-up sent this request; never for a
+    # request from outside, as in common.limiter
+    return HEADER in headers and "X-Real-IP" not in headers
+
+
+def in_warmup():
+    # Whether the request being handled is a synthetic one
+    return has_request_context() and bool(request.environ.get(WARMUP_ENVIRON))
+
+
+class WarmupMiddleware:
+    # Marks the requests a caller's warm-up sent before any Flask hook
+    # (metrics, faults) sees them
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if "HTTP_X_WARMUP" in environ and "HTTP_X_REAL_IP" not in environ:
+            environ[WARMUP_ENVIRON] = True
+        return self.wsgi_app(environ, start_response)
+
+
+def downstream_targets(service_name, configured=()):
+    targets = list(configured) or topology_targets(service_name)
+    alternates = [alt for target in targets for alt in hedging.hedger.replicas.get(target, ())]
+    return list(dict.fromkeys(targets + alternates + TARGETS))
+
+
+class Readiness:
+    """Warm-up state of one service."""
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+        self.steps = []
+        self.results = {}
+        self.started = False
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        service_ready.set(service_name, value=0)
+
+    def add_step(self, name, fn):
+        # Runs fn() during warm-up, after the built-in request step
+        self.steps.append((name, fn))
+
+    def record(self, step, seconds, error=None):
+        self.results[step] = {"seconds": round(seconds, 3), "ok": error is None}
+        if error is not None:
+            self.results[step]["error"] = error
+        warmup_seconds.set(self.service_name, step, value=seconds)
+
+    def finish(self):
+        self.ready.set()
+        service_ready.set(self.service_name, value=1)
+        failed = [step for step, result in self.results.items() if not result["ok"]]
+        logger.info("%s ready%s", self.service_name, f" (failed: {', '.join(failed)})" if failed else "")
+
+    def status(self):
+        # (status code, JSON body) for /ready
+        body = json.dumps({
+            "service": self.service_name,
+            "status": "ready" if self.ready.is_set() else "warming" if self.started else "starting",
+            "steps": self.results,
+        })
+        return (200 if self.ready.is_set() else 503), body
+
+
+class WarmUp(Readiness):
+    """Readiness of a Flask service, warmed up in a background thread."""
+
+    def __init__(self, app, service_name):
+        super().__init__(service_name)
+        self.app = app
+        self.targets = []
+        self.tracer = telemetry.providers[service_name].get_tracer(__name__)
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        if not ENABLED:
+            self.finish()
+            return
+        threading.Thread(target=self.run, name=f"{self.service_name}-warmup", daemon=True).start()
+
+    def run(self):
+        deadline = time.monotonic() + TIMEOUT
+        # Looked up now: topology.build_app sets WARMUP_TARGETS after init_service
+        self.targets = downstream_targets(self.service_name, self.app.config.get("WARMUP_TARGETS", ()))
+        steps = [("connections", lambda: self.open_connections(deadline)), ("requests", self.send_requests)]
+        with self.tracer.start_as_current_span(f"{self.service_name}:warmup"):
+            for name, fn in steps + self.steps + [("telemetry", lambda: self.flush(deadline))]:
+                self.run_step(name, fn)
+        self.finish()
+
+    def run_step(self, name, fn):
+        start = time.perf_counter()
+        with self.tracer.start_as_current_span(f"warmup-{name}") as span:
+            try:
+                fn()
+            except Exception as e:
+                span.set_status(Status(StatusCode.ERROR, str(e)))
+                self.record(name, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+                return
+        self.record(name, time.perf_counter() - start)
+
+    def open_connections(self, deadline):
+        # Imported here: common.client imports this
+        from common import client
+
+        # Concurrent calls, so each one leaves its own connection in the pool
+        def open_one(target):
+            give_up = min(deadline, time.monotonic() + CONNECT_TIMEOUT)
+            while True:
+                try:
+                    client.session.get(f"http://{target}/health", timeout=min(2, CONNECT_TIMEOUT)).close()
+                    return None
+                except requests.RequestException as e:
+                    remaining = give_up - time.monotonic()
+                    if remaining <= 0:
+                        return f"{target}: {type(e).__name__}"
+                    time.sleep(min(0.5, remaining))
+
+        if not self.targets:
+            return
+        jobs = [target for target in self.targets for _ in range(CONNECTIONS)]
+        with ThreadPoolExecutor(max_workers=min(len(jobs), 64), thread_name_prefix="warmup") as pool:
+            errors = sorted({e for e in pool.map(open_one, jobs) if e})
+        trace.get_current_span().set_attribute("warmup.targets", self.targets)
+        if errors:
+            raise ConnectionError("; ".join(errors))
+
+    def send_requests(self):
+        routes = sorted(
+            rule.rule for rule in self.app.url_map.iter_rules()
+            if "GET" in rule.methods and not rule.arguments and rule.rule not in PATHS
+            and rule.rule != "/metrics" and not rule.rule.startswith(("/admin", "/static"))
+        )
+        trace.get_current_span().set_attribute("warmup.routes", routes)
+        test_client = self.app.test_client()
+        failed = []
+        for route in routes:
+            for _ in range(REQUESTS):
+                status = test_client.get(route, environ_base={WARMUP_ENVIRON: True}).status_code
+                if status >= 500:
+                    failed.append(f"{route}: {status}")
+        if failed:
+            raise RuntimeError("; ".join(failed))
+
+    def flush(self, deadline):
+        timeout_ms = max(1000, int((deadline - time.monotonic()) * 1000))
+        if not telemetry.providers[self.service_name].force_flush(timeout_ms):
+            raise TimeoutError("span export did not finish")
+
+
+def instrument_app(app, service_name):
+    # /health and /ready; the warm-up starts with start(app) or the first /ready
+    readiness = WarmUp(app, service_name)
+    app.extensions["readiness"] = readiness
+    app.wsgi_app = WarmupMiddleware(app.wsgi_app)
+
+    @app.route("/health", methods=["GET"])
+    def health():
+        return {"service": service_name, "status": "alive"}
+
+    @app.route("/ready", methods=["GET"])
+    def ready():
+        readiness.start()
+        status, body = readiness.status()
+        headers = {} if status == 200 else {"Retry-After": "1"}
+        return Response(body, status=status, headers=headers, content_type="application/json")
+
+    return readiness
+
+
+def start(app):
+    readiness = app.extensions.get("readiness")
+    if readiness is not None:
+        readiness.start()
@@ -0,0 +1,28 @@
+import time
+
+from common import bootstrap, compression, faults, idempotency, limiter, metrics, profiler, readiness
+from common.telemetry import init_tracing
+
+
+def init_service(app, service_name, team):
+    # Tracing, RED metrics, /metrics, compression, the profiler, admission
+    # control, fault injection, idempotency keys and /health and /ready for
+    # one service app; returns its tracer. Its start phases are reported as
+    # a startup span once everything is set up
+    start = time.time_ns()
+    app.config["SERVICE_NAME"] = service_name
+    tracer = init_tracing(app, service_name, team, processors=[profiler.span_tracker])
+    metrics.instrument_app(app, service_name)
+    # after_request hooks run in reverse, so this compresses whatever the
+    # hooks registered below produce (e.g. an inflated fault response)
+    compression.instrument_app(app, service_name)
+    profiler.instrument_app(app)
+    # Before faults, so injected latency counts against the limit
+    limiter.instrument_app(app, service_name)
+    faults.instrument_app(app, service_name)
+    # Last, so the response it stores is the handler's own: not yet inflated
+    # by a fault or compressed
+    idempotency.instrument_app(app, service_name)
+    readiness.instrument_app(app, service_name)
+    bootstrap.instrument_app(app, service_name, tracer, start)
+    return tracer
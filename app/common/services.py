@@ -0,0 +1,40 @@
+import importlib.util
+import os
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (source directory, docker-compose host, published port, NGINX location prefix)
+SERVICES = [
+    ("payment/currency", "app-payment-currency", 5001, "/api/payments/currency/"),
+    ("payment/orchestrator", "app-payment-orchestrator", 5002, "/api/payments/orchestrator/"),
+    ("payment/history", "app-payment-history", 5003, "/api/payments/history/"),
+    ("payment/processor", "app-payment-processor", 5004, "/api/payments/processor/"),
+    ("accounting/orchestrator", "app-accounting-orchestrator", 5005, "/api/accounting/orchestrator/"),
+    ("accounting/ledger", "app-accounting-ledger", 5006, "/api/accounting/ledger/"),
+    ("accounting/history", "app-accounting-history", 5007, "/api/accounting/history/"),
+    ("risk/orchestrator", "app-risk-orchestrator", 5008, "/api/risk/orchestrator/"),
+    ("risk/analyzer", "app-risk-analyzer", 5009, "/api/risk/analyzer/"),
+    ("risk/manager", "app-risk-manager", 5010, "/api/risk/manager/"),
+    ("customer/orchestrator", "app-customer-orchestrator", 5011, "/api/customer/orchestrator/"),
+    ("customer/verifier", "app-customer-verifier", 5012, "/api/customer/verifier/"),
+    ("customer/profile-manager", "app-customer-profile-manager", 5013, "/api/customer/profile-manager/"),
+]
+
+
+def load_service(path, filename="app.py"):
+    # Import a service's app.py under a unique module name so all of them
+    # can live in one interpreter
+    module_name = "svc_" + path.replace("/", "_").replace("-", "_")
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(APP_DIR, path, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def gateway_route(url_path):
+    # Resolve an NGINX /api/... path the way location.conf does:
+    # (docker-compose host, path on the service)
+    for _, host, _, prefix in SERVICES:
+        if url_path.startswith(prefix):
+            return host, "/" + url_path[len(prefix):]
+    raise KeyError(f"no service behind {url_path}")
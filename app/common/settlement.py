@@ -0,0 +1,549 @@
+"""
+Bulk settlement jobs for payments-processor.
+
+POST /settle-payment settles one payment per request, through
+/process-gateway and its calls to payments-currency and payments-history.
+A settlement job takes a whole file of payments instead and runs the same
+three steps over it in batches, inside the service. The stages do not call
+those services: they have no batch endpoints, and a call per payment is
+the overhead a job is there to avoid. They are local stand-ins with the
+same roles instead: a fixed rate table for payments-currency, an HMAC
+signature for the gateway and the job's results file for payments-history.
+
+    POST /settlements?batch_size=1000     NDJSON body, one payment per line,
+                                          e.g. {"id": "p1", "amount": "12.30", "currency": "EUR"};
+                                          202 with the job and Location: /settlements/<id>
+    GET  /settlements                     all jobs
+    GET  /settlements/<id>                progress: batches, settled and rejected payments
+    GET  /settlements/<id>/results        the payments settled so far (NDJSON)
+    POST /settlements/<id>/resume         runs a failed or interrupted job on from its checkpoint
+
+Jobs live on the replica that took them; NGINX sends every /settlements
+request to the same one (`pinned` in nginx/inventory.yaml).
+
+The body is spooled to SETTLEMENT_DIR/<id>/ and read back in batches of
+SETTLEMENT_BATCH_SIZE (1000) lines. Batches flow through three stages joined
+by queues of at most SETTLEMENT_QUEUE_SIZE (4) batches, so a slow stage holds
+back the ones before it instead of letting batches pile up in memory:
+
+  * convert: parses each payment and converts its amount to
+    SETTLEMENT_CURRENCY (USD), to the cent
+  * gateway: authorizes each payment (positive, at most
+    SETTLEMENT_MAX_AMOUNT) and signs it
+  * history: appends the results to results.ndjson, then checkpoints
+
+convert and gateway are CPU-bound and run in a pool of SETTLEMENT_WORKERS
+processes (one per CPU by default; 0, the default on one CPU, runs them in
+the stage threads), each with up to one batch per process in flight. The pool only lives while jobs
+run. Jobs run one at a time, in the order they were submitted.
+
+After each batch, state.json records how far into the input the job has got
+and how long results.ndjson was at that point. A job resumes from there: the
+results written after the checkpoint are cut off and the input is read on
+from the checkpointed offset, so each payment is recorded once however often
+the job is interrupted. Jobs that were running when the process stopped are
+resumed by the service's warm-up (common/readiness.py).
+
+A job is one `<service>:settlement` span with a `settlement-batch` child per
+batch (its size, outcomes and the time it spent in each stage), rather than
+spans per payment. Payments are counted in settlement_payments_total by
+outcome, and jobs in the settlement_jobs gauge by state.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from decimal import ROUND_HALF_EVEN, Decimal, InvalidOperation
+from itertools import islice
+
+from flask import Response, request
+
+from common import metrics
+
+DIRECTORY = os.getenv("SETTLEMENT_DIR", os.path.join(tempfile.gettempdir(), "settlements"))
+BATCH_SIZE = int(os.getenv("SETTLEMENT_BATCH_SIZE", "1000"))
+QUEUE_SIZE = int(os.getenv("SETTLEMENT_QUEUE_SIZE", "4"))
+# On one CPU the pool only adds the cost of passing batches to it
+WORKERS = int(os.getenv("SETTLEMENT_WORKERS", str(os.cpu_count() if (os.cpu_count() or 1) > 1 else 0)))
+CURRENCY = os.getenv("SETTLEMENT_CURRENCY", "USD")
+MAX_CENTS = int(Decimal(os.getenv("SETTLEMENT_MAX_AMOUNT", "1000000")) * 100)
+KEY = os.getenv("SETTLEMENT_KEY", "settlement").encode()
+MAX_BATCH_SIZE = 100000
+CHUNK = 64 * 1024
+CENT = Decimal("0.01")
+# USD per unit of each currency; a fixed table, not payments-currency's quotes
+RATES = {
+    "USD": Decimal("1"), "EUR": Decimal("1.08"), "GBP": Decimal("1.27"), "CHF": Decimal("1.13"),
+    "CAD": Decimal("0.73"), "AUD": Decimal("0.66"), "JPY": Decimal("0.0067"), "INR": Decimal("0.012"),
+}
+# A job in these states is waiting for the runner or in it
+ACTIVE = ("queued", "running")
+
+logger = logging.getLogger(__name__)
+
+settled_payments = metrics.registry.register(metrics.Counter(
+    "settlement_payments", "Payments through settlement jobs, by outcome", ("service", "outcome"),
+))
+settlement_jobs = metrics.registry.register(metrics.Gauge(
+    "settlement_jobs", "Settlement jobs by state", ("service", "state"),
+))
+
+
+def convert(lines):
+    # [(payment id, amount in CURRENCY in cents, original currency, rejection)]
+    # for raw NDJSON lines; runs in the pool
+    target = RATES[CURRENCY]
+    records = []
+    for line in lines:
+        try:
+            payment = json.loads(line)
+            payment_id = str(payment["id"])
+            currency = payment.get("currency", CURRENCY)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            records.append((None, 0, None, "malformed"))
+            continue
+        rate = RATES.get(currency)
+        if rate is None:
+            records.append((payment_id, 0, currency, "unknown currency"))
+            continue
+        try:
+            amount = (Decimal(str(payment["amount"])) * rate / target).quantize(CENT, ROUND_HALF_EVEN)
+        except (KeyError, InvalidOperation):
+            records.append((payment_id, 0, currency, "invalid amount"))
+            continue
+        records.append((payment_id, int(amount * 100), currency, None))
+    return records
+
+
+def authorize(records):
+    # (NDJSON of the results, settled, rejected) for converted payments; runs in the pool
+    lines = []
+    settled = 0
+    for payment_id, cents, currency, reason in records:
+        if reason is None and not 0 < cents <= MAX_CENTS:
+            reason = "amount out of range"
+        if reason is not None:
+            lines.append(json.dumps({"id": payment_id, "status": "rejected", "reason": reason}))
+            continue
+        amount = f"{cents // 100}.{cents % 100:02d}"
+        signature = hmac.new(KEY, f"{payment_id}|{amount}|{CURRENCY}".encode(), hashlib.sha256).hexdigest()
+        lines.append(json.dumps({"id": payment_id, "status": "settled", "amount": amount, "currency": CURRENCY,
+                                 "original_currency": currency, "signature": signature}))
+        settled += 1
+    lines.append("")
+    return "\n".join(lines).encode(), settled, len(records) - settled
+
+
+# (stage, function) of the CPU-bound stages, in order
+STAGES = (("convert", convert), ("gateway", authorize))
+
+
+def watch_runner(pid):
+    # Pool initializer. A worker reads its tasks from a pipe it also holds the
+    # write end of, so it would wait forever once the service process is killed
+    def watch():
+        while True:
+            time.sleep(1)
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                os._exit(1)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+class Batch:
+    __slots__ = ("index", "end", "payload", "started_ns", "stage_seconds")
+
+    def __init__(self, index, end, payload):
+        self.index = index
+        # Input offset just past the batch
+        self.end = end
+        self.payload = payload
+        self.started_ns = time.time_ns()
+        self.stage_seconds = {}
+
+
+class Job:
+    """One settlement job and its checkpoint, kept in its own directory."""
+
+    def __init__(self, directory, state):
+        self.directory = directory
+        self.state = state
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    @property
+    def id(self):
+        return self.state["id"]
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def update(self, **changes):
+        with self.lock:
+            self.state.update(changes)
+            self.save()
+
+    def save(self):
+        # Called with the lock held; replaced whole, so a crash leaves the old checkpoint
+        tmp = self.path("state.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path("state.json"))
+
+    def commit(self, batch, results_bytes, settled, rejected):
+        # The batch's results are on disk up to results_bytes
+        with self.lock:
+            self.state["batches"] = batch.index + 1
+            self.state["offset"] = batch.end
+            self.state["results_bytes"] = results_bytes
+            self.state["settled"] += settled
+            self.state["rejected"] += rejected
+            self.save()
+
+    def status(self):
+        with self.lock:
+            state = dict(self.state)
+        state["progress"] = state["offset"] / state["input_bytes"] if state["input_bytes"] else 1.0
+        return state
+
+
+class Settlements:
+    """The settlement jobs of one service and the thread that runs them."""
+
+    def __init__(self, service_name, tracer, directory=DIRECTORY, workers=WORKERS, batch_size=BATCH_SIZE,
+                 queue_size=QUEUE_SIZE):
+        self.service_name = service_name
+        self.tracer = tracer
+        self.directory = directory
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.jobs = {}
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.runner = None
+        self.load()
+
+    def load(self):
+        # Jobs a previous process left in the directory; the active ones were interrupted
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            try:
+                with open(os.path.join(self.directory, name, "state.json")) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            job = Job(os.path.join(self.directory, name), state)
+            if state["state"] in ACTIVE:
+                job.update(state="interrupted")
+            if job.state["state"] != "interrupted":
+                job.finished.set()
+            self.jobs[job.id] = job
+        self.count_jobs()
+
+    def count_jobs(self):
+        counts = dict.fromkeys(("queued", "running", "interrupted", "failed", "done"), 0)
+        for job in list(self.jobs.values()):
+            counts[job.state["state"]] += 1
+        for state, count in counts.items():
+            settlement_jobs.set(self.service_name, state, value=count)
+
+    def submit(self, stream, batch_size=None):
+        # Spools the NDJSON stream to the job's directory and queues the job
+        job_id = uuid.uuid4().hex
+        directory = os.path.join(self.directory, job_id)
+        os.makedirs(directory)
+        size = 0
+        with open(os.path.join(directory, "input.ndjson"), "wb") as f:
+            while chunk := stream.read(CHUNK):
+                f.write(chunk)
+                size += len(chunk)
+        open(os.path.join(directory, "results.ndjson"), "wb").close()
+        job = Job(directory, {
+            "id": job_id, "state": "queued", "created": time.time(), "batch_size": batch_size or self.batch_size,
+            "input_bytes": size, "offset": 0, "results_bytes": 0, "batches": 0, "settled": 0, "rejected": 0,
+            "runs": 0, "seconds": 0.0, "error": None,
+        })
+        with job.lock:
+            job.save()
+        self.jobs[job_id] = job
+        self.enqueue(job)
+        return job
+
+    def resume(self, job):
+        # False unless the job had stopped before it was done
+        with job.lock:
+            if job.state["state"] not in ("interrupted", "failed"):
+                return False
+            job.state["state"] = "queued"
+            job.state["error"] = None
+            job.save()
+        job.finished.clear()
+        self.enqueue(job)
+        return True
+
+    def resume_interrupted(self):
+        # A warm-up step: queues what the last process did not finish
+        interrupted = [job for job in self.jobs.values() if job.state["state"] == "interrupted"]
+        for job in interrupted:
+            self.resume(job)
+        if interrupted:
+            logger.info("%s resuming %d settlement jobs", self.service_name, len(interrupted))
+
+    def enqueue(self, job):
+        self.pending.put(job)
+        self.count_jobs()
+        with self.lock:
+            if self.runner is None or not self.runner.is_alive():
+                self.runner = threading.Thread(target=self.run_jobs, name=f"{self.service_name}-settlement",
+                                               daemon=True)
+                self.runner.start()
+
+    def run_jobs(self):
+        # Until the queue is empty; the pool is shut down in between
+        pool = None
+        try:
+            while True:
+                try:
+                    job = self.pending.get(timeout=1)
+                except queue.Empty:
+                    with self.lock:
+                        if self.pending.empty():
+                            self.runner = None
+                            return
+                    continue
+                if pool is None and self.workers:
+                    # Not forked from this process, whose other threads may hold locks
+                    pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("forkserver"),
+                                               initializer=watch_runner, initargs=(os.getpid(),))
+                self.run(job, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def run(self, job, pool):
+        start = time.perf_counter()
+        job.update(state="running", runs=job.state["runs"] + 1)
+        self.count_jobs()
+        resumed_from = job.state["batches"]
+        with self.tracer.start_as_current_span(f"{self.service_name}:settlement", attributes={
+            "settlement.job": job.id, "settlement.batch_size": job.state["batch_size"],
+            "settlement.resumed_from": resumed_from, "settlement.workers": self.workers,
+        }) as span:
+            try:
+                Pipeline(self, job, pool).run()
+            except Exception as e:
+                logger.exception("settlement job %s failed", job.id)
+                span.record_exception(e)
+                job.update(state="failed", error=f"{type(e).__name__}: {e}",
+                           seconds=job.state["seconds"] + time.perf_counter() - start)
+            else:
+                job.update(state="done", seconds=job.state["seconds"] + time.perf_counter() - start)
+            span.set_attribute("settlement.batches", job.state["batches"] - resumed_from)
+        job.finished.set()
+        self.count_jobs()
+
+
+class Pipeline:
+    """One run of a job: a reader, the pool stages and the history stage, in threads."""
+
+    def __init__(self, settlements, job, pool):
+        self.settlements = settlements
+        self.job = job
+        self.pool = pool
+        self.in_flight = max(1, settlements.workers)
+        self.stopped = threading.Event()
+        self.error = None
+
+    def put(self, outbox, item):
+        while not self.stopped.is_set():
+            try:
+                outbox.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, inbox, block=True):
+        # The next item, None at the end, or queue.Empty if not blocking and there is none
+        while not self.stopped.is_set():
+            try:
+                return inbox.get(timeout=0.1) if block else inbox.get_nowait()
+            except queue.Empty:
+                if not block:
+                    raise
+        return None
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stopped.set()
+
+    def read(self, outbox):
+        state = self.job.status()
+        index, offset, batch_size = state["batches"], state["offset"], state["batch_size"]
+        try:
+            with open(self.job.path("input.ndjson"), "rb") as f:
+                f.seek(offset)
+                while lines := list(islice(f, batch_size)):
+                    offset += sum(map(len, lines))
+                    if not self.put(outbox, Batch(index, offset, [line for line in lines if line.strip()])):
+                        return
+                    index += 1
+        except Exception as e:
+            self.fail(e)
+        self.put(outbox, None)
+
+    def stage(self, name, fn, inbox, outbox):
+        # Up to in_flight batches in the pool at once, passed on in input order
+        running = deque()
+        end = False
+        try:
+            while running or not end:
+                while not end and len(running) < self.in_flight:
+                    try:
+                        batch = self.get(inbox, block=not running)
+                    except queue.Empty:
+                        break
+                    if batch is None:
+                        end = True
+                    elif self.pool is None:
+                        started = time.perf_counter()
+                        batch.payload = fn(batch.payload)
+                        batch.stage_seconds[name] = time.perf_counter() - started
+                        if not self.put(outbox, batch):
+                            return
+                    else:
+                        running.append((batch, time.perf_counter(), self.pool.submit(fn, batch.payload)))
+                if self.stopped.is_set():
+                    return
+                if running:
+                    batch, started, future = running.popleft()
+                    batch.payload = future.result()
+                    batch.stage_seconds[name] = time.perf_counter() - started
+                    if not self.put(outbox, batch):
+                        return
+        except Exception as e:
+            self.fail(e)
+        self.put(outbox, None)
+
+    def run(self):
+        settlements, job = self.settlements, self.job
+        queues = [queue.Queue(settlements.queue_size) for _ in range(len(STAGES) + 1)]
+        threads = [threading.Thread(target=self.read, args=(queues[0],), daemon=True)] + [
+            threading.Thread(target=self.stage, args=(name, fn, queues[i], queues[i + 1]), daemon=True)
+            for i, (name, fn) in enumerate(STAGES)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            with open(job.path("results.ndjson"), "r+b") as out:
+                # Anything past the checkpoint is from a run that stopped before committing it
+                out.truncate(job.state["results_bytes"])
+                out.seek(job.state["results_bytes"])
+                while (batch := self.get(queues[-1])) is not None:
+                    self.record(out, batch)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def record(self, out, batch):
+        # The history stage: append, sync, checkpoint
+        started = time.perf_counter()
+        blob, settled, rejected = batch.payload
+        out.write(blob)
+        out.flush()
+        os.fsync(out.fileno())
+        self.job.commit(batch, out.tell(), settled, rejected)
+        batch.stage_seconds["history"] = time.perf_counter() - started
+        service_name = self.settlements.service_name
+        settled_payments.inc(service_name, "settled", amount=settled)
+        settled_payments.inc(service_name, "rejected", amount=rejected)
+        attributes = {"settlement.batch": batch.index, "settlement.payments": settled + rejected,
+                      "settlement.settled": settled, "settlement.rejected": rejected}
+        for stage, seconds in batch.stage_seconds.items():
+            attributes[f"settlement.{stage}_ms"] = round(seconds * 1000, 3)
+        self.settlements.tracer.start_span("settlement-batch", start_time=batch.started_ns,
+                                           attributes=attributes).end()
+
+
+def instrument_app(app, service_name, tracer):
+    # /settlements; interrupted jobs resume in the warm-up, or with POST .../resume
+    settlements = Settlements(service_name, tracer)
+    app.extensions["settlements"] = settlements
+    readiness = app.extensions.get("readiness")
+    if readiness is not None:
+        readiness.add_step("settlements", settlements.resume_interrupted)
+
+    def job_response(job, status=200, headers=None):
+        return Response(json.dumps(job.status()), status=status, headers=headers, content_type="application/json")
+
+    @app.route("/settlements", methods=["POST"])
+    def submit_settlement():
+        try:
+            batch_size = int(request.args.get("batch_size", settlements.batch_size))
+        except ValueError:
+            batch_size = 0
+        if not 0 < batch_size <= MAX_BATCH_SIZE:
+            return f"batch_size must be between 1 and {MAX_BATCH_SIZE}\n", 400
+        # A keyed request's body is read from common.idempotency's spooled copy
+        job = settlements.submit(request.stream, batch_size)
+        return job_response(job, 202, {"Location": f"/settlements/{job.id}"})
+
+    @app.route("/settlements", methods=["GET"])
+    def list_settlements():
+        jobs = sorted((job.status() for job in list(settlements.jobs.values())), key=lambda s: s["created"])
+        return Response(json.dumps(jobs), content_type="application/json")
+
+    @app.route("/settlements/<job_id>", methods=["GET"])
+    def get_settlement(job_id):
+        job = settlements.jobs.get(job_id)
+        if job is None:
+            return f"no settlement job {job_id}\n", 404
+        return job_response(job)
+
+    @app.route("/settlements/<job_id>/results", methods=["GET"])
+    def settlement_results(job_id):
+        job = settlements.jobs.get(job_id)
+        if job is None:
+            return f"no settlement job {job_id}\n", 404
+        # Only what the last checkpoint covers
+        remaining = job.status()["results_bytes"]
+
+        def chunks(remaining=remaining):
+            with open(job.path("results.ndjson"), "rb") as f:
+                while remaining > 0 and (chunk := f.read(min(CHUNK, remaining))):
+                    remaining -= len(chunk)
+                    yield chunk
+
+        return Response(chunks(), content_type="application/x-ndjson")
+
+    @app.route("/settlements/<job_id>/resume", methods=["POST"])
+    def resume_settlement(job_id):
+        job = settlements.jobs.get(job_id)
+        if job is None:
+            return f"no settlement job {job_id}\n", 404
+        if not settlements.resume(job):
+            return f"settlement job {job_id} is {job.state['state']}\n", 409
+        return job_response(job, 202)
+
+    return settlements
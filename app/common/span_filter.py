@@ -0,0 +1,215 @@
+"""
+Shrink spans before they are exported.
+
+SpanFilter wraps the exporting span processor and rewrites each finished
+span on its way through:
+
+  * attributes matching SPAN_ATTR_DROP (comma-separated globs) are removed,
+    those matching SPAN_ATTR_REDACT are replaced with "[redacted]", and
+    string values are cut to SPAN_ATTR_MAX_LENGTH characters
+  * exception events with the same type and message are merged into the
+    first one, with an exception.count attribute
+  * exception.stacktrace keeps its last SPAN_STACKTRACE_MAX_LINES lines (the
+    frames nearest the raise), and at most SPAN_MAX_EVENTS events are kept
+  * after SPAN_AGGREGATE_AFTER children with the same name under one local
+    parent, further ones and everything under them are not exported; the
+    parent gets span.aggregated.<name>.count / .duration_ms / .errors
+    attributes instead. A subtree that makes an outgoing (client or
+    producer) call is exported whole after all, since the called service's
+    spans have its trace context and would otherwise lose their parent
+
+What was removed is counted in span_filter_dropped_total. Set SPAN_FILTER=off
+to export spans unchanged.
+"""
+import fnmatch
+import os
+import threading
+from collections import OrderedDict
+
+from opentelemetry.sdk.trace import Event, ReadableSpan, SpanProcessor
+from opentelemetry.trace import SpanKind, StatusCode
+
+from common import metrics
+
+ENABLED = os.getenv("SPAN_FILTER", "on") != "off"
+REDACTED = "[redacted]"
+MAX_OPEN_SPANS = 10_000
+OUTGOING = (SpanKind.CLIENT, SpanKind.PRODUCER)
+
+dropped = metrics.registry.register(metrics.Counter(
+    "span_filter_dropped", "Attributes, events and spans removed before export", ("service", "item"),
+))
+
+
+def _patterns(value):
+    return tuple(p.strip() for p in value.split(",") if p.strip())
+
+
+class FilterRules:
+    def __init__(self, drop=(), redact=(), max_length=256, max_events=16, stack_lines=20, aggregate_after=10):
+        self.drop = tuple(drop)
+        self.redact = tuple(redact)
+        self.max_length = max_length
+        self.max_events = max_events
+        self.stack_lines = stack_lines
+        self.aggregate_after = aggregate_after
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            drop=_patterns(os.getenv("SPAN_ATTR_DROP", "")),
+            redact=_patterns(os.getenv("SPAN_ATTR_REDACT", "*password*,*token*,*authorization*,*secret*")),
+            max_length=int(os.getenv("SPAN_ATTR_MAX_LENGTH", "256")),
+            max_events=int(os.getenv("SPAN_MAX_EVENTS", "16")),
+            stack_lines=int(os.getenv("SPAN_STACKTRACE_MAX_LINES", "20")),
+            aggregate_after=int(os.getenv("SPAN_AGGREGATE_AFTER", "10")),
+        )
+
+    def attributes(self, attributes):
+        out = {}
+        for key, value in (attributes or {}).items():
+            if any(fnmatch.fnmatchcase(key, p) for p in self.drop):
+                continue
+            if any(fnmatch.fnmatchcase(key, p) for p in self.redact):
+                value = REDACTED
+            elif isinstance(value, str) and len(value) > self.max_length:
+                value = value[:self.max_length] + "..."
+            out[key] = value
+        return out
+
+    def events(self, events):
+        kept = []
+        exceptions = {}
+        for event in events:
+            attrs = dict(event.attributes or {})
+            key = (attrs.get("exception.type"), attrs.get("exception.message"))
+            if event.name == "exception" and key in exceptions:
+                exceptions[key][1]["exception.count"] += 1
+                continue
+            if len(kept) >= self.max_events:
+                continue
+            if event.name == "exception":
+                stack = attrs.pop("exception.stacktrace", None)
+                attrs = self.attributes(attrs)
+                if isinstance(stack, str):
+                    lines = stack.rstrip("\n").split("\n")
+                    if len(lines) > self.stack_lines:
+                        lines = [f"... {len(lines) - self.stack_lines} lines dropped"] + lines[-self.stack_lines:]
+                    attrs["exception.stacktrace"] = "\n".join(lines)
+                attrs["exception.count"] = 1
+                exceptions[key] = (event, attrs)
+                kept.append((event, attrs))
+            else:
+                kept.append((event, self.attributes(attrs)))
+        return [Event(event.name, attrs, timestamp=event.timestamp) for event, attrs in kept]
+
+
+class SpanFilter(SpanProcessor):
+    def __init__(self, delegate, rules=None):
+        self.delegate = delegate
+        self.rules = rules or FilterRules.from_env()
+        # local parent span id -> {child name: [started, aggregated, duration ns, errors]}
+        self.children = OrderedDict()
+        # span id of every span held back from export -> the root of its
+        # held subtree (the span over the aggregation threshold)
+        self.suppressed = OrderedDict()
+        # root span id -> [parent it is counted on, ended descendants, made an outgoing call]
+        self.held = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _remember(table, key, value):
+        table[key] = value
+        if len(table) > MAX_OPEN_SPANS:
+            table.popitem(last=False)
+
+    def on_start(self, span, parent_context=None):
+        # Decided at start so that the whole subtree of an aggregated span
+        # is left out, not just the span itself
+        parent = span.parent
+        if parent is not None and not parent.is_remote:
+            span_id = span.context.span_id
+            with self.lock:
+                root = self.suppressed.get(parent.span_id)
+                if root is not None:
+                    self._remember(self.suppressed, span_id, root)
+                    if span.kind in OUTGOING and root in self.held:
+                        self.held[root][2] = True
+                    return
+                names = self.children.get(parent.span_id)
+                if names is None:
+                    names = {}
+                    self._remember(self.children, parent.span_id, names)
+                stats = names.setdefault(span.name, [0, 0, 0, 0])
+                stats[0] += 1
+                if stats[0] > self.rules.aggregate_after:
+                    self._remember(self.suppressed, span_id, span_id)
+                    self._remember(self.held, span_id, [parent.span_id, [], span.kind in OUTGOING])
+                    return
+        self.delegate.on_start(span, parent_context=parent_context)
+
+    def hold(self, span):
+        # The spans to export now: none while the span is part of a held
+        # subtree, the whole subtree when its root ends having made an
+        # outgoing call, and none if it is aggregated into the parent instead
+        span_id = span.context.span_id
+        with self.lock:
+            root = self.suppressed.pop(span_id, None)
+            entry = self.held.get(root)
+            if entry is None:
+                return [span]
+            if root != span_id:
+                entry[1].append(span)
+                return []
+            del self.held[root]
+            parent_id, descendants, outgoing = entry
+            if outgoing:
+                return descendants + [span]
+            names = self.children.get(parent_id)
+            if names is not None:
+                stats = names[span.name]
+                stats[1] += 1
+                stats[2] += span.end_time - span.start_time
+                stats[3] += span.status.status_code == StatusCode.ERROR
+        dropped.inc(span.resource.attributes.get("service.name", ""), "span", amount=1 + len(descendants))
+        return []
+
+    def on_end(self, span):
+        for ended in self.hold(span):
+            self.export(ended)
+
+    def export(self, span):
+        with self.lock:
+            names = self.children.pop(span.context.span_id, {})
+        attributes = self.rules.attributes(span.attributes)
+        events = self.rules.events(span.events)
+        service = span.resource.attributes.get("service.name", "")
+        if len(attributes) < len(span.attributes or {}):
+            dropped.inc(service, "attribute", amount=len(span.attributes) - len(attributes))
+        if len(events) < len(span.events):
+            dropped.inc(service, "event", amount=len(span.events) - len(events))
+        for name, (_, aggregated, duration, errors) in names.items():
+            if aggregated:
+                attributes[f"span.aggregated.{name}.count"] = aggregated
+                attributes[f"span.aggregated.{name}.duration_ms"] = round(duration / 1e6, 3)
+                attributes[f"span.aggregated.{name}.errors"] = errors
+        self.delegate.on_end(ReadableSpan(
+            name=span.name,
+            context=span.context,
+            parent=span.parent,
+            resource=span.resource,
+            attributes=attributes,
+            events=events,
+            links=span.links,
+            kind=span.kind,
+            status=span.status,
+            start_time=span.start_time,
+            end_time=span.end_time,
+            instrumentation_scope=span.instrumentation_scope,
+        ))
+
+    def shutdown(self):
+        self.delegate.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+        return self.delegate.force_flush(timeout_millis)
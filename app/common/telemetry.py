@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+import time
+
+from flask import current_app, has_app_context
+from opentelemetry import trace
+from opentelemetry.instrumentation.flask import FlaskInstrumentor
+from opentelemetry.instrumentation.requests import RequestsInstrumentor
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.sdk.resources import Resource
+
+from common import bootstrap, span_filter
+
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+
+# Harnesses that run services without a collector set this to an in-memory
+# exporter before importing any app.py
+span_exporter = None
+
+# service.name -> TracerProvider, for every service initialised in this process
+providers = {}
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeferredExporter(SpanExporter):
+    """
+    The OTLP exporter, built on the first export or flush rather than at
+    import. Both run in the BatchSpanProcessor's worker thread (or the
+    warm-up's), so requests never wait for protobuf to load. The first
+    failure to export is logged; later ones only return FAILURE.
+    """
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+        self.exporter = None
+        self.failed = False
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.exporter is None:
+            built = None
+            with self.lock:
+                if self.exporter is None:
+                    start = time.time_ns()
+                    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+                    self.exporter = OTLPSpanExporter(endpoint=OTLP_ENDPOINT)
+                    built = (start, time.time_ns())
+            # Outside the lock: recording it ends a span, which may export
+            if built:
+                bootstrap.startup(self.service_name).record("exporter", *built)
+        return self.exporter
+
+    def export(self, spans):
+        try:
+            return self.get().export(spans)
+        except Exception:
+            if not self.failed:
+                self.failed = True
+                logger.exception("%s: exporting spans failed", self.service_name)
+            return SpanExportResult.FAILURE
+
+    def force_flush(self, timeout_millis=30000):
+        return self.get().force_flush(timeout_millis)
+
+    def shutdown(self):
+        # Nothing to close if nothing was ever exported
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+
+class RoutingTracer(trace.Tracer):
+    # Starts each span on the provider of the service handling the current
+    # request, so shared instrumentation (requests) keeps per-service resources
+
+    def __init__(self, router, args):
+        self.router = router
+        self.args = args
+
+    def _tracer(self):
+        return self.router.provider().get_tracer(*self.args)
+
+    def start_span(self, *args, **kwargs):
+        return self._tracer().start_span(*args, **kwargs)
+
+    def start_as_current_span(self, *args, **kwargs):
+        return self._tracer().start_as_current_span(*args, **kwargs)
+
+
+class RoutingTracerProvider(trace.TracerProvider):
+    """Global provider for processes that host several services."""
+
+    def __init__(self, default):
+        self.default = default
+
+    def provider(self):
+        if has_app_context():
+            return providers.get(current_app.config.get("SERVICE_NAME"), self.default)
+        return self.default
+
+    def get_tracer(self, *args, **kwargs):
+        return RoutingTracer(self, args)
+
+
+def make_provider(service_name, team, processors=()):
+    # The service's TracerProvider, exporting through the span filter
+    resource = Resource(attributes={"service.name": service_name, "team": team})
+    provider = TracerProvider(resource=resource)
+    for processor in processors:
+        provider.add_span_processor(processor)
+    if span_exporter is not None:
+        export = SimpleSpanProcessor(span_exporter)
+    else:
+        export = BatchSpanProcessor(DeferredExporter(service_name))
+    provider.add_span_processor(span_filter.SpanFilter(export) if span_filter.ENABLED else export)
+
+    # Only the first service in a process sets the global provider; host
+    # mode installs a RoutingTracerProvider before loading any service
+    providers[service_name] = provider
+    if isinstance(trace.get_tracer_provider(), trace.ProxyTracerProvider):
+        trace.set_tracer_provider(provider)
+    return provider
+
+
+def init_tracing(app, service_name, team, processors=()):
+    provider = make_provider(service_name, team, processors)
+
+    # Instrument Flask and requests
+    FlaskInstrumentor().instrument_app(app, tracer_provider=provider)
+    if not RequestsInstrumentor().is_instrumented_by_opentelemetry:
+        RequestsInstrumentor().instrument()
+    return provider.get_tracer(service_name)
@@ -0,0 +1,166 @@
+"""
+Serve any service described in a topology YAML file.
+
+    services:
+      <service.name>:
+        team: payments
+        host: app-payment-processor          # docker-compose host, default app-<name>
+        bulkheads:                           # per callee, see common/client.py
+          payments-history: {max_concurrent: 8, max_queue: 4}
+        routes:
+          /process-gateway:
+            methods: [GET]
+            cpu_ms: 2                        # CPU burned in the handler
+            latency: {dist: lognormal, median_ms: 5, sigma: 0.6}
+            response_bytes: 512              # response padded to this size
+            parallel: false                  # run the calls below concurrently
+            priority: critical               # shedding order, see common/limiter.py
+            calls:
+              - {name: call-record-payment-history, service: payments-history,
+                 route: /record-payment-history, method: GET, payload_bytes: 0,
+                 hedge: false,                # race a second copy, see common/hedging.py
+                 repeat: 1}                   # made this many times in a row (a per-item loop)
+
+A call goes to http://<host>:5000<route>, or through NGINX with `via: nginx`
+using the callee's `prefix` (e.g. /api/payments/history/). Latency
+distributions: fixed (ms), uniform (min_ms, max_ms), normal (mean_ms,
+stddev_ms), lognormal (median_ms, sigma) and exponential (mean_ms).
+"""
+import contextvars
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import yaml
+from flask import Flask
+
+from common import client
+from common.distributions import DISTRIBUTIONS, burn_cpu, sample_ms
+from common.limiter import SHARES
+from common.service import init_service
+
+GATEWAY = "http://nginx-gateway:8080"
+
+
+def load_topology(path):
+    with open(path) as f:
+        topology = yaml.safe_load(f)
+    validate(topology)
+    return topology
+
+
+def validate(topology):
+    services = topology.get("services") or {}
+    if not services:
+        raise ValueError("topology has no services")
+    for name, service in services.items():
+        service.setdefault("host", f"app-{name}")
+        service.setdefault("team", name.split("-")[0])
+        for callee in service.get("bulkheads") or {}:
+            if callee not in services:
+                raise ValueError(f"{name}: bulkhead for unknown service {callee!r}")
+        for route, spec in (service.get("routes") or {}).items():
+            if not route.startswith("/"):
+                raise ValueError(f"{name}: route {route!r} must start with /")
+            if spec.get("priority", "critical") not in SHARES:
+                raise ValueError(f"{name} {route}: unknown priority {spec['priority']!r}")
+            latency = spec.get("latency")
+            if latency and latency.get("dist", "fixed") not in DISTRIBUTIONS:
+                raise ValueError(f"{name} {route}: unknown latency dist {latency['dist']!r}")
+            for call in spec.get("calls") or ():
+                callee = services.get(call.get("service"))
+                if callee is None:
+                    raise ValueError(f"{name} {route}: call to unknown service {call.get('service')!r}")
+                if call.get("route") not in (callee.get("routes") or {}):
+                    raise ValueError(f"{name} {route}: {call['service']} has no route {call.get('route')!r}")
+                if call.get("via") == "nginx" and not callee.get("prefix"):
+                    raise ValueError(f"{name} {route}: {call['service']} has no NGINX prefix")
+
+
+def entry_routes(topology):
+    # Routes no other route calls: what clients (or NGINX) hit directly
+    called = {
+        (call["service"], call["route"])
+        for service in topology["services"].values()
+        for spec in (service.get("routes") or {}).values()
+        for call in spec.get("calls") or ()
+    }
+    return [
+        (name, route)
+        for name, service in topology["services"].items()
+        for route in service.get("routes") or {}
+        if (name, route) not in called
+    ]
+
+
+def call_url(topology, call):
+    callee = topology["services"][call["service"]]
+    if call.get("via") == "nginx":
+        return GATEWAY + callee["prefix"].rstrip("/") + call["route"]
+    return f"http://{callee['host']}:5000{call['route']}"
+
+
+def build_app(topology, service_name, seed=None):
+    service = topology["services"][service_name]
+    app = Flask(service_name)
+    tracer = init_service(app, service_name, team=service["team"])
+    app.config["BULKHEADS"] = {
+        f"{topology['services'][callee]['host']}:5000": spec
+        for callee, spec in (service.get("bulkheads") or {}).items()
+    }
+    app.config["WARMUP_TARGETS"] = sorted({
+        f"{topology['services'][call['service']]['host']}:5000"
+        for spec in (service.get("routes") or {}).values()
+        for call in spec.get("calls") or ()
+        if call.get("via") != "nginx"
+    })
+    rng = random.Random(seed)
+    pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix=f"{service_name}-calls")
+
+    def downstream(call):
+        with tracer.start_as_current_span(call.get("name") or f"call-{call['route'].strip('/')}"):
+            method = call.get("method", "GET")
+            body = b"x" * call["payload_bytes"] if call.get("payload_bytes") else None
+            try:
+                resp = client.request(method, call_url(topology, call), data=body, hedge=call.get("hedge", False))
+                return f"Called {call['route'].strip('/')}: {resp.text}\n"
+            except requests.RequestException as e:
+                return f"Error calling {call['route'].strip('/')}: {str(e)}\n"
+
+    def make_handler(route, spec):
+        endpoint = route.strip("/")
+        latency = spec.get("latency")
+        calls = [call for call in spec.get("calls") or () for _ in range(call.get("repeat", 1))]
+
+        def handler():
+            with tracer.start_as_current_span(
+                f"{service_name}:{endpoint}",
+                attributes={"endpoint.name": endpoint}
+            ):
+                response_text = f"Response from {service_name} at {route}\n"
+                if spec.get("cpu_ms"):
+                    burn_cpu(spec["cpu_ms"])
+                if latency:
+                    time.sleep(sample_ms(rng, latency) / 1000)
+                if spec.get("parallel") and len(calls) > 1:
+                    # Each call runs in a copy of this context so it keeps
+                    # the current span and Flask app
+                    futures = [
+                        pool.submit(contextvars.copy_context().run, downstream, call)
+                        for call in calls
+                    ]
+                    response_text += "".join(f.result() for f in futures)
+                else:
+                    response_text += "".join(downstream(call) for call in calls)
+                padding = spec.get("response_bytes", 0) - len(response_text)
+                return response_text + ("." * padding if padding > 0 else "")
+
+        handler.__name__ = endpoint.replace("-", "_").replace("/", "_") or "index"
+        return handler
+
+    for route, spec in (service.get("routes") or {}).items():
+        if spec.get("priority"):
+            app.config.setdefault("LIMITER_PRIORITIES", {})[route] = spec["priority"]
+        app.add_url_rule(route, view_func=make_handler(route, spec), methods=spec.get("methods", ["GET"]))
+    return app
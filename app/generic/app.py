@@ -0,0 +1,11 @@
+import os
+from common.topology import build_app, load_topology
+
+# Parameterized configuration: which service of which topology to serve
+SERVICE_NAME = os.environ["SERVICE_NAME"]
+TOPOLOGY_FILE = os.getenv("TOPOLOGY_FILE", "topology.yaml")
+
+app = build_app(load_topology(TOPOLOGY_FILE), SERVICE_NAME, seed=os.getenv("TOPOLOGY_SEED"))
+
+if __name__ == "__main__":
+    app.run(host='0.0.0.0', port=5000)
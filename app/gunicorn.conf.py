@@ -0,0 +1,8 @@
+# Read by Gunicorn from its working directory (/app in the image); the
+# command line in the Dockerfile sets everything else
+
+def post_worker_init(worker):
+    # Warm the service up as soon as it is loaded rather than on NGINX's
+    # first /ready check
+    from common import readiness
+    readiness.start(worker.wsgi)
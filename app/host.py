@@ -0,0 +1,80 @@
+"""
+Run all 13 services in one process.
+
+Every app.py is imported into this interpreter, so Python, Flask, requests
+and the OTel SDK are loaded once instead of 13 times. Each service keeps its
+own TracerProvider with its own service.name, and is served on the port
+docker-compose.yaml publishes for it (5001-5013). Calls from one service to
+another (http://app-...:5000) are handed straight to the callee's Flask app
+without a socket; calls through nginx-gateway still go over the network.
+
+With --topology the services come from a topology YAML file instead (see
+common/topology.py) and are served from --base-port upwards.
+
+    python host.py [--port-offset 0] [--topology topology.yaml]
+"""
+import argparse
+import os
+import sys
+import threading
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, APP_DIR)
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from werkzeug.serving import make_server
+
+from common import readiness, telemetry
+from common.services import SERVICES, load_service
+from common.topology import build_app, load_topology
+from common.transport import LocalTransport
+
+
+def load_all(topology_file=None, base_port=5001):
+    # Installed before any service is loaded, so the shared requests
+    # instrumentation starts client spans on the calling service's provider
+    trace.set_tracer_provider(telemetry.RoutingTracerProvider(TracerProvider()))
+    transport = LocalTransport()
+    apps = []
+    if topology_file:
+        topology = load_topology(topology_file)
+        for port, (name, service) in enumerate(topology["services"].items(), base_port):
+            app = build_app(topology, name)
+            transport.apps[f"{service['host']}:5000"] = app
+            apps.append((app, port))
+        return transport, apps
+    for path, host, port, _ in SERVICES:
+        app = load_service(path).app
+        transport.apps[f"{host}:5000"] = app
+        apps.append((app, port))
+    return transport, apps
+
+
+def serve(apps, bind, port_offset):
+    servers = [make_server(bind, port + port_offset, app, threaded=True) for app, port in apps]
+    for app, _ in apps:
+        readiness.start(app)
+    for server in servers[1:]:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"serving {len(servers)} services on ports {apps[0][1] + port_offset}-{apps[-1][1] + port_offset}",
+          flush=True)
+    servers[0].serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--bind", default="0.0.0.0")
+    parser.add_argument("--port-offset", type=int, default=0,
+                        help="added to each service's port, e.g. to run next to the containers")
+    parser.add_argument("--topology", help="serve the services of this topology file instead of */*/app.py")
+    parser.add_argument("--base-port", type=int, default=5001, help="first port for --topology services")
+    args = parser.parse_args()
+
+    transport, apps = load_all(args.topology, args.base_port)
+    with transport.installed():
+        serve(apps, args.bind, args.port_offset)
+
+
+if __name__ == "__main__":
+    main()
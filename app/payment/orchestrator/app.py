@@ -3,30 +3,25 @@ import json
 from flask import Flask
 import requests
 from opentelemetry import trace
-from opentelemetry.instrumentation.flask import FlaskInstrumentor
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.sdk.resources import Resource
+from common import client
+from common.service import init_service
 
 app = Flask(__name__)
 
 # Parameterized configuration
 SERVICE_NAME = "payments-orchestrator"
-OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
 
-# Set up OpenTelemetry
-resource = Resource(attributes={"service.name": SERVICE_NAME, "team": "payments"})
-trace.set_tracer_provider(TracerProvider(resource=resource))
-tracer = trace.get_tracer(__name__)
-otlp_exporter = OTLPSpanExporter(endpoint=OTLP_ENDPOINT)
-span_processor = BatchSpanProcessor(otlp_exporter)
-trace.get_tracer_provider().add_span_processor(span_processor)
+# Set up OpenTelemetry, RED metrics and /metrics
+tracer = init_service(app, SERVICE_NAME, team="payments")
 
-# Instrument Flask and requests
-FlaskInstrumentor().instrument_app(app)
-RequestsInstrumentor().instrument()
+# Bulkheads per downstream service: a slow process-gateway can hold at most
+# 8 threads, while get-balance and validate-transaction keep their own slots
+app.config["BULKHEADS"] = {
+    "app-payment-processor:5000": {"max_concurrent": 8, "max_queue": 4, "queue_timeout": 0.05},
+    "app-accounting-ledger:5000": {"max_concurrent": 16},
+    "app-risk-orchestrator:5000": {"max_concurrent": 16},
+    "app-payment-history:5000": {"max_concurrent": 16},
+}
 
 @app.route('/initiate-transfer', methods=['GET', 'POST'])
 def initiate_transfer():
@@ -39,8 +34,8 @@ def initiate_transfer():
         # Inter-team call: Account Management's /get-balance (via NGINX)
         with tracer.start_as_current_span("call-account-get-balance"):
             try:
-                # resp = requests.get('http://nginx-gateway:8080/api/accounting/ledger/get-balance')
-                resp = requests.get('http://app-accounting-ledger:5000/get-balance') # To view graph
+                # resp = client.get('http://nginx-gateway:8080/api/accounting/ledger/get-balance')
+                resp = client.get('http://app-accounting-ledger:5000/get-balance') # To view graph
                 response_text += f"Called get-balance: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling get-balance: {str(e)}\n"
@@ -48,8 +43,8 @@ def initiate_transfer():
         # Inter-team call: Risk's /validate-transaction (via NGINX)
         with tracer.start_as_current_span("call-risk-validate-transaction"):
             try:
-                # resp = requests.get('http://nginx-gateway:8080/api/risk/orchestrator/validate-transaction')
-                resp = requests.get('http://app-risk-orchestrator:5000/validate-transaction') # To view graph
+                # resp = client.get('http://nginx-gateway:8080/api/risk/orchestrator/validate-transaction', hedge=True)
+                resp = client.get('http://app-risk-orchestrator:5000/validate-transaction', hedge=True) # To view graph
                 response_text += f"Called validate-transaction: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling validate-transaction: {str(e)}\n"
@@ -57,7 +52,7 @@ def initiate_transfer():
         # Intra-team call: payments-processor's /process-gateway (direct)
         with tracer.start_as_current_span("call-process-gateway"):
             try:
-                resp = requests.get('http://app-payment-processor:5000/process-gateway')
+                resp = client.get('http://app-payment-processor:5000/process-gateway')
                 response_text += f"Called process-gateway: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling process-gateway: {str(e)}\n"
@@ -75,7 +70,7 @@ def get_payment_status():
         # Intra-team call: payments-history's /record-payment-history (direct)
         with tracer.start_as_current_span("call-record-payment-history"):
             try:
-                resp = requests.get('http://app-payment-history:5000/record-payment-history')
+                resp = client.get('http://app-payment-history:5000/record-payment-history')
                 response_text += f"Called record-payment-history: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling record-payment-history: {str(e)}\n"
@@ -93,7 +88,7 @@ def cancel_transfer():
         # Intra-team call: payments-processor's /process-gateway (direct)
         with tracer.start_as_current_span("call-process-gateway"):
             try:
-                resp = requests.get('http://app-payment-processor:5000/process-gateway')
+                resp = client.get('http://app-payment-processor:5000/process-gateway')
                 response_text += f"Called process-gateway: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling process-gateway: {str(e)}\n"
@@ -1,48 +1,36 @@
 import os
 import json
-import random
 import time
 from flask import Flask, request
 import requests
 from opentelemetry import trace
-from opentelemetry.instrumentation.flask import FlaskInstrumentor
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.sdk.resources import Resource
+from common import client
+from common.service import init_service
 
 app = Flask(__name__)
 
 # Parameterized configuration
 SERVICE_NAME = "payments-processor"
-OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
-CHAOS_MODE = os.getenv("CHAOS_MODE", "off") # <-- Set to 'on' to activate chaos
-
-# Set up OpenTelemetry
-resource = Resource(attributes={"service.name": SERVICE_NAME, "team": "payments"})
-trace.set_tracer_provider(TracerProvider(resource=resource))
-tracer = trace.get_tracer(__name__)
-otlp_exporter = OTLPSpanExporter(endpoint=OTLP_ENDPOINT)
-span_processor = BatchSpanProcessor(otlp_exporter)
-trace.get_tracer_provider().add_span_processor(span_processor)
-
-# Instrument Flask and requests
-FlaskInstrumentor().instrument_app(app)
-RequestsInstrumentor().instrument()
-
-def chaos_injector():
-    if CHAOS_MODE != "on":
-        return
-
-    r = random.random()
-    if r < 0.15:       # 15% chance of total failure
-        raise Exception("Simulated processor crash!")
-    elif r < 0.45:     # 30% chance of high latency
-        delay = random.uniform(3.0, 9.0)
-        time.sleep(delay)
-    elif r < 0.55:     # 10% chance of huge payload
-        return "A" * 45_000_000  # ~45 MB response
+CHAOS_MODE = os.getenv("CHAOS_MODE", "off") # <-- Set to 'on' to start with the chaos profile below
+
+# Set up OpenTelemetry, RED metrics and /metrics
+tracer = init_service(app, SERVICE_NAME, team="payments")
+
+# The old chaos_injector odds as a fault profile: 15% crash, 30% 3-9 s
+# latency, 10% ~45 MB response. Faults are drawn independently and a crash
+# skips the rest, so latency is 30% of all requests at 0.30 / 0.85 of those
+# that do not crash, and inflate alone 10% at 0.10 / 0.55 of those that
+# neither crash nor wait. Unlike the old odds, another ~5% are both delayed
+# and inflated. Seeded, so every run fails the same requests;
+# change it at runtime with PUT /admin/faults
+CHAOS_FAULTS = {
+    "latency": {"rate": 0.30 / 0.85, "dist": "uniform", "min_ms": 3000, "max_ms": 9000},
+    "error": {"rate": 0.15, "status": 500},
+    "inflate": {"rate": 0.10 / 0.55, "bytes": 45_000_000},
+}
+CHAOS_PROFILE = {"seed": int(os.getenv("CHAOS_SEED", "0")), "routes": {"*": CHAOS_FAULTS}}
+if CHAOS_MODE == "on":
+    app.extensions["faults"].configure(CHAOS_PROFILE)
 
 """
 @app.route('/process-gateway', methods=['GET'])
@@ -56,7 +44,7 @@ def process_gateway():
         # Intra-team call: payments-history's /record-payment-history (direct)
         with tracer.start_as_current_span("call-record-payment-history"):
             try:
-                resp = requests.get('http://app-payment-history:5000/record-payment-history')
+                resp = client.get('http://app-payment-history:5000/record-payment-history')
                 response_text += f"Called record-payment-history: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling record-payment-history: {str(e)}\n"
@@ -64,7 +52,7 @@ def process_gateway():
         # Intra-team call: payments-currency's /convert-currency (direct)
         with tracer.start_as_current_span("call-convert-currency"):
             try:
-                resp = requests.get('http://app-payment-currency:5000/convert-currency')
+                resp = client.get('http://app-payment-currency:5000/convert-currency', hedge=True)
                 response_text += f"Called convert-currency: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling convert-currency: {str(e)}\n"
@@ -81,15 +69,13 @@ def process_gateway():
             "chaos.mode": CHAOS_MODE
         }
     ):
-        chaos_injector()
-
         response_text = "Response from payments-processor at /process-gateway\n"
 
         # Intra-team call: payments-history's /record-payment-history (direct)
         # Simulate downstream call with possible failure
         with tracer.start_as_current_span("call-record-payment-history"):
             try:
-                resp = requests.get('http://app-payment-history:5000/record-payment-history', timeout=5)
+                resp = client.get('http://app-payment-history:5000/record-payment-history', timeout=5)
                 response_text += f"Called record-payment-history: {resp.text[:200]}\n"
             except requests.RequestException as e:
                 trace.get_current_span().record_exception(e)
@@ -98,15 +84,12 @@ def process_gateway():
         # Intra-team call: payments-currency's /convert-currency (direct)
         with tracer.start_as_current_span("call-convert-currency"):
             try:
-                resp = requests.get('http://app-payment-currency:5000/convert-currency', timeout=5)
+                resp = client.get('http://app-payment-currency:5000/convert-currency', timeout=5, hedge=True)
                 response_text += f"Called convert-currency: {resp.text[:200]}\n"
             except requests.RequestException as e:
                 trace.get_current_span().record_exception(e)
                 response_text += f"Error calling convert-currency: {str(e)}\n"
 
-        huge = chaos_injector()
-        if huge:
-            return huge, 200
         return response_text
 
 """
@@ -121,7 +104,7 @@ def settle_payment():
         # Intra-team call: /process-gateway (direct, intra-team)
         with tracer.start_as_current_span("call-process-gateway"):
             try:
-                resp = requests.get('http://app-payment-processor:5000/process-gateway')
+                resp = client.get('http://app-payment-processor:5000/process-gateway')
                 response_text += f"Called process-gateway: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling process-gateway: {str(e)}\n"
@@ -138,14 +121,12 @@ def settle_payment():
             "chaos.mode": CHAOS_MODE
         }
     ):
-        chaos_injector()
-
         # Intra-team call: /process-gateway (direct, intra-team)
         # Retry loop for retry-storm
         for attempt in range(3):
             with tracer.start_as_current_span(f"call-process-gateway-attempt-{attempt+1}"):
                 try:
-                    resp = requests.get('http://app-payment-processor:5000/process-gateway', timeout=2)
+                    resp = client.get('http://app-payment-processor:5000/process-gateway', timeout=2)
                     return f"Success on attempt {attempt+1}: {resp.text[:200]}"
                 except:
                     if attempt == 2:
@@ -165,7 +146,7 @@ def refund_payment():
         # Intra-team call: payments-history's /record-payment-history (direct)
         with tracer.start_as_current_span("call-record-payment-history"):
             try:
-                resp = requests.get('http://app-payment-history:5000/record-payment-history')
+                resp = client.get('http://app-payment-history:5000/record-payment-history')
                 response_text += f"Called record-payment-history: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling record-payment-history: {str(e)}\n"
@@ -185,14 +166,12 @@ def refund_payment():
             "chaos.mode": CHAOS_MODE
         }
     ):
-
-        huge_payload = chaos_injector() # sleep 3–9s, crash, or return 45 MB
         response_text = "Response from payments-processor at /refund-payment\n"
 
         # Intra-team call: payments-history's /record-payment-history (direct)
         with tracer.start_as_current_span("call-record-payment-history"):
             try:
-                resp = requests.get(
+                resp = client.get(
                     'http://app-payment-history:5000/record-payment-history',
                     timeout=5
                 )
@@ -204,9 +183,6 @@ def refund_payment():
                 current_span.record_exception(e)
                 response_text += f"Error calling record-payment-history: {str(e)}\n"
 
-        if huge_payload:
-            return huge_payload, 200
-
         return response_text, 200
 
 if __name__ == "__main__":
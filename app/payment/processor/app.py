@@ -3,30 +3,19 @@ import json
 from flask import Flask
 import requests
 from opentelemetry import trace
-from opentelemetry.instrumentation.flask import FlaskInstrumentor
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.sdk.resources import Resource
+from common import client, settlement
+from common.service import init_service
 
 app = Flask(__name__)
 
 # Parameterized configuration
 SERVICE_NAME = "payments-processor"
-OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
 
-# Set up OpenTelemetry
-resource = Resource(attributes={"service.name": SERVICE_NAME, "team": "payments"})
-trace.set_tracer_provider(TracerProvider(resource=resource))
-tracer = trace.get_tracer(__name__)
-otlp_exporter = OTLPSpanExporter(endpoint=OTLP_ENDPOINT)
-span_processor = BatchSpanProcessor(otlp_exporter)
-trace.get_tracer_provider().add_span_processor(span_processor)
+# Set up OpenTelemetry, RED metrics and /metrics
+tracer = init_service(app, SERVICE_NAME, team="payments")
 
-# Instrument Flask and requests
-FlaskInstrumentor().instrument_app(app)
-RequestsInstrumentor().instrument()
+# Bulk settlement jobs: /settlements (see common/settlement.py)
+settlement.instrument_app(app, SERVICE_NAME, tracer)
 
 @app.route('/process-gateway', methods=['GET'])
 def process_gateway():
@@ -39,7 +28,7 @@ def process_gateway():
         # Intra-team call: payments-history's /record-payment-history (direct)
         with tracer.start_as_current_span("call-record-payment-history"):
             try:
-                resp = requests.get('http://app-payment-history:5000/record-payment-history')
+                resp = client.get('http://app-payment-history:5000/record-payment-history')
                 response_text += f"Called record-payment-history: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling record-payment-history: {str(e)}\n"
@@ -47,7 +36,7 @@ def process_gateway():
         # Intra-team call: payments-currency's /convert-currency (direct)
         with tracer.start_as_current_span("call-convert-currency"):
             try:
-                resp = requests.get('http://app-payment-currency:5000/convert-currency')
+                resp = client.get('http://app-payment-currency:5000/convert-currency', hedge=True)
                 response_text += f"Called convert-currency: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling convert-currency: {str(e)}\n"
@@ -65,7 +54,7 @@ def settle_payment():
         # Intra-team call: /process-gateway (direct, intra-team)
         with tracer.start_as_current_span("call-process-gateway"):
             try:
-                resp = requests.get('http://app-payment-processor:5000/process-gateway')
+                resp = client.get('http://app-payment-processor:5000/process-gateway')
                 response_text += f"Called process-gateway: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling process-gateway: {str(e)}\n"
@@ -83,7 +72,7 @@ def refund_payment():
         # Intra-team call: payments-history's /record-payment-history (direct)
         with tracer.start_as_current_span("call-record-payment-history"):
             try:
-                resp = requests.get('http://app-payment-history:5000/record-payment-history')
+                resp = client.get('http://app-payment-history:5000/record-payment-history')
                 response_text += f"Called record-payment-history: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling record-payment-history: {str(e)}\n"
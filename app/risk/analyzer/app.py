@@ -3,30 +3,16 @@ import json
 from flask import Flask
 import requests
 from opentelemetry import trace
-from opentelemetry.instrumentation.flask import FlaskInstrumentor
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.sdk.resources import Resource
+from common import client
+from common.service import init_service
 
 app = Flask(__name__)
 
 # Parameterized configuration
 SERVICE_NAME = "risk-analyzer"
-OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
 
-# Set up OpenTelemetry
-resource = Resource(attributes={"service.name": SERVICE_NAME, "team": "risk"})
-trace.set_tracer_provider(TracerProvider(resource=resource))
-tracer = trace.get_tracer(__name__)
-otlp_exporter = OTLPSpanExporter(endpoint=OTLP_ENDPOINT)
-span_processor = BatchSpanProcessor(otlp_exporter)
-trace.get_tracer_provider().add_span_processor(span_processor)
-
-# Instrument Flask and requests
-FlaskInstrumentor().instrument_app(app)
-RequestsInstrumentor().instrument()
+# Set up OpenTelemetry, RED metrics and /metrics
+tracer = init_service(app, SERVICE_NAME, team="risk")
 
 @app.route('/check-fraud', methods=['GET', 'POST'])
 def check_fraud():
@@ -39,7 +25,7 @@ def check_fraud():
         # Intra-team call: /screen-aml (direct)
         with tracer.start_as_current_span("call-screen-aml"):
             try:
-                resp = requests.get('http://app-risk-analyzer:5000/screen-aml')
+                resp = client.get('http://app-risk-analyzer:5000/screen-aml')
                 response_text += f"Called screen-aml: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling screen-aml: {str(e)}\n"
@@ -65,7 +51,7 @@ def score_risk():
         # Intra-team call: /check-fraud (direct)
         with tracer.start_as_current_span("call-check-fraud"):
             try:
-                resp = requests.get('http://app-risk-analyzer:5000/check-fraud')
+                resp = client.get('http://app-risk-analyzer:5000/check-fraud')
                 response_text += f"Called check-fraud: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling check-fraud: {str(e)}\n"
@@ -73,7 +59,7 @@ def score_risk():
         # Intra-team call: /screen-aml (direct)
         with tracer.start_as_current_span("call-screen-aml"):
             try:
-                resp = requests.get('http://app-risk-analyzer:5000/screen-aml')
+                resp = client.get('http://app-risk-analyzer:5000/screen-aml')
                 response_text += f"Called screen-aml: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling screen-aml: {str(e)}\n"
@@ -3,30 +3,16 @@ import json
 from flask import Flask
 import requests
 from opentelemetry import trace
-from opentelemetry.instrumentation.flask import FlaskInstrumentor
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.sdk.resources import Resource
+from common import client
+from common.service import init_service
 
 app = Flask(__name__)
 
 # Parameterized configuration
 SERVICE_NAME = "risk-orchestrator"
-OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
 
-# Set up OpenTelemetry
-resource = Resource(attributes={"service.name": SERVICE_NAME, "team": "risk"})
-trace.set_tracer_provider(TracerProvider(resource=resource))
-tracer = trace.get_tracer(__name__)
-otlp_exporter = OTLPSpanExporter(endpoint=OTLP_ENDPOINT)
-span_processor = BatchSpanProcessor(otlp_exporter)
-trace.get_tracer_provider().add_span_processor(span_processor)
-
-# Instrument Flask and requests
-FlaskInstrumentor().instrument_app(app)
-RequestsInstrumentor().instrument()
+# Set up OpenTelemetry, RED metrics and /metrics
+tracer = init_service(app, SERVICE_NAME, team="risk")
 
 @app.route('/validate-transaction', methods=['GET', 'POST'])
 def validate_transaction():
@@ -39,7 +25,7 @@ def validate_transaction():
         # Intra-team call: risk-analyzer's /check-fraud (direct)
         with tracer.start_as_current_span("call-check-fraud"):
             try:
-                resp = requests.get('http://app-risk-analyzer:5000/check-fraud')
+                resp = client.get('http://app-risk-analyzer:5000/check-fraud')
                 response_text += f"Called check-fraud: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling check-fraud: {str(e)}\n"
@@ -57,7 +43,7 @@ def generate_report():
         # Intra-team call: risk-manager's /flag-anomaly (direct)
         with tracer.start_as_current_span("call-flag-anomaly"):
             try:
-                resp = requests.get('http://app-risk-manager:5000/flag-anomaly')
+                resp = client.get('http://app-risk-manager:5000/flag-anomaly')
                 response_text += f"Called flag-anomaly: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling flag-anomaly: {str(e)}\n"
@@ -75,7 +61,7 @@ def block_transaction():
         # Intra-team call: risk-analyzer's /check-fraud (direct)
         with tracer.start_as_current_span("call-check-fraud"):
             try:
-                resp = requests.get('http://app-risk-analyzer:5000/check-fraud')
+                resp = client.get('http://app-risk-analyzer:5000/check-fraud')
                 response_text += f"Called check-fraud: {resp.text}\n"
             except requests.RequestException as e:
                 response_text += f"Error calling check-fraud: {str(e)}\n"
@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+import httpx
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from common import asgi, telemetry
+
+TOPOLOGY = {"services": {"test-asgi-cpu": {"team": "test", "routes": {"/work": {"cpu_ms": 300}}}}}
+
+
+def test_route_cpu_does_not_block_the_event_loop(monkeypatch):
+    monkeypatch.setattr(telemetry, "span_exporter", InMemorySpanExporter())
+    app = asgi.build_app(TOPOLOGY, "test-asgi-cpu")
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://test") as client:
+            start = time.perf_counter()
+            work = asyncio.create_task(client.get("/work"))
+            await asyncio.sleep(0.05)
+            health = await client.get("/health")
+            waited = time.perf_counter() - start
+            assert (await work).status_code == 200
+            return health.status_code, waited
+
+    status, waited = asyncio.run(main())
+    assert status == 200
+    # /health answers while /work burns its 300 ms
+    assert waited < 0.2
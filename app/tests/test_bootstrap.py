@@ -0,0 +1,42 @@
+import logging
+import time
+
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor, SpanExportResult
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from common import bootstrap, telemetry
+
+
+def test_later_phases_join_the_startup_trace():
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    record = bootstrap.Startup("test-startup-trace")
+    now = time.time_ns()
+    record.report(provider.get_tracer("test"), now - 2_000_000, now)
+    record.record("exporter", now + 1_000_000, now + 3_000_000)
+    record.request_started()
+    record.request_started()
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    assert sorted(spans) == ["startup-exporter", "startup-first_request", "startup-imports", "startup-init",
+                             "test-startup-trace:startup"]
+    root = spans.pop("test-startup-trace:startup")
+    for span in spans.values():
+        assert span.parent.span_id == root.context.span_id
+        assert span.context.trace_id == root.context.trace_id
+    assert spans["startup-exporter"].end_time - spans["startup-exporter"].start_time == 2_000_000
+
+
+def test_deferred_exporter_logs_the_first_failure(caplog):
+    exporter = telemetry.DeferredExporter("test-deferred-export")
+
+    def broken():
+        raise ConnectionError("collector unreachable")
+    exporter.get = broken
+    with caplog.at_level(logging.ERROR, logger="common.telemetry"):
+        assert exporter.export([]) == SpanExportResult.FAILURE
+        assert exporter.export([]) == SpanExportResult.FAILURE
+    assert len(caplog.records) == 1
+    assert "test-deferred-export" in caplog.records[0].getMessage()
@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+from flask import Flask
+
+from common import faults
+
+PROFILE = {"seed": 7, "routes": {"/pay": {
+    "error": {"rate": 0.2, "status": 503},
+    "latency": {"rate": 0.3, "dist": "uniform", "min_ms": 1, "max_ms": 5},
+}}}
+
+
+def app_with_faults(service_name, profile=None):
+    app = Flask(service_name)
+    injector = faults.instrument_app(app, service_name)
+    if profile is not None:
+        injector.configure(profile)
+
+    @app.route("/pay", methods=["GET"])
+    def pay():
+        return "paid"
+
+    return app, injector
+
+
+def injected(service_name):
+    return {kind: faults.faults_injected.values.get((service_name, "/pay", kind), 0)
+            for kind in ("error", "latency", "latency_skipped")}
+
+
+def run(service_name, requests, threads):
+    # Status of each request, and the faults injected, with `threads` clients
+    app, _ = app_with_faults(service_name, PROFILE)
+    before = injected(service_name)
+    statuses = []
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            status = client.get("/pay").status_code
+            with lock:
+                statuses.append(status)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    after = injected(service_name)
+    return sorted(statuses), {kind: after[kind] - before[kind] for kind in after}
+
+
+def test_schedule_is_the_same_for_every_run():
+    injector = faults.FaultInjector("test-faults-seeded", PROFILE)
+    again = faults.FaultInjector("test-faults-seeded", PROFILE)
+    chosen = [sorted(injector.decide("/pay")[1]) for _ in range(200)]
+    assert chosen == [sorted(again.decide("/pay")[1]) for _ in range(200)]
+    assert ["error"] in chosen and ["latency"] in chosen
+
+
+def test_schedule_does_not_depend_on_concurrency():
+    sequential = run("test-faults-concurrency", 300, 1)
+    concurrent = run("test-faults-concurrency", 300, 16)
+    assert sequential == concurrent
+    statuses, counts = sequential
+    assert counts["error"] == statuses.count(503) > 0
+    assert counts["latency"] > 0
+    assert counts["latency_skipped"] == 0
+
+
+def test_delays_are_not_skipped_under_load():
+    app, _ = app_with_faults("test-faults-delays", {"routes": {"/pay": {
+        "latency": {"rate": 1, "dist": "fixed", "ms": 100},
+    }}})
+    pool = [threading.Thread(target=lambda: app.test_client().get("/pay")) for _ in range(20)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    assert faults.faults_injected.values[("test-faults-delays", "/pay", "latency")] == 20
+    assert ("test-faults-delays", "/pay", "latency_skipped") not in faults.faults_injected.values
+
+
+@pytest.mark.parametrize("profile", [
+    {"routes": {"/pay": {"cpu": {"rate": 0.5}}}},
+    {"routes": {"/pay": {"latency": {"rate": 0.5, "dist": "uniform", "min_ms": 1}}}},
+    {"routes": {"/pay": {"latency": {"rate": 0.5}}}},
+    {"routes": {"/pay": {"error": {"rate": "often"}}}},
+    {"routes": {"/pay": {"error": {"rate": 0.5, "status": "500"}}}},
+    {"routes": {"/pay": {"inflate": {"rate": 0.5, "bytes": "lots"}}}},
+    {"routes": {"/pay": {"crash": {"rate": 0.5}}}},
+    {"routes": {"/pay": ["latency"]}},
+    {"seed": "42", "routes": {}},
+])
+def test_invalid_profile_is_refused(profile):
+    app, injector = app_with_faults("test-faults-invalid")
+    client = app.test_client()
+    response = client.put("/admin/faults", json=profile)
+    assert response.status_code == 400
+    assert injector.profile == {}
+    assert client.get("/pay").status_code == 200
+
+
+def test_valid_profile_is_applied():
+    app, injector = app_with_faults("test-faults-valid")
+    response = app.test_client().put("/admin/faults", json=PROFILE)
+    assert response.status_code == 200
+    assert injector.profile == PROFILE
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from common import hedging
+
+URL = "http://target:5000/quote"
+
+
+class Response:
+    def close(self):
+        pass
+
+
+def outcomes(service_name):
+    return {labels[2]: count for labels, count in hedging.hedge_requests.values.items() if labels[0] == service_name}
+
+
+def warmed_hedger(max_concurrent, seconds=0.005):
+    # A hedger that has seen enough calls to URL to hedge after ~seconds
+    hedger = hedging.Hedger(min_delay=seconds, replicas={}, max_concurrent=max_concurrent)
+    window = hedger.window(("target:5000", "/quote"))
+    for _ in range(hedging.MIN_SAMPLES):
+        window.add(seconds)
+    return hedger
+
+
+def test_slow_primary_is_hedged():
+    hedger = warmed_hedger(4)
+    calls = []
+
+    def send(method, url, **kwargs):
+        calls.append(url)
+        if len(calls) == 1:
+            time.sleep(0.3)
+        return Response()
+
+    start = time.perf_counter()
+    hedger.run(send, "test-hedge-slow", "GET", URL)
+    assert time.perf_counter() - start < 0.2
+    assert outcomes("test-hedge-slow") == {"hedge_won": 1}
+
+
+def test_saturated_pool_sends_on_the_callers_thread():
+    hedger = warmed_hedger(2)
+    release = threading.Event()
+    threads = []
+
+    def send(method, url, **kwargs):
+        threads.append(threading.current_thread())
+        if threading.current_thread().name.startswith("hedge"):
+            release.wait(1)
+        return Response()
+
+    # Two slow calls take both pool threads, and their hedges find none
+    busy = [threading.Thread(target=hedger.run, args=(send, "test-hedge-busy", "GET", URL)) for _ in range(2)]
+    for thread in busy:
+        thread.start()
+    while len(threads) < 2:
+        time.sleep(0.001)
+    hedger.run(send, "test-hedge-busy", "GET", URL)
+    assert threads[-1] is threading.current_thread()
+    # Past the hedge delay of the slow calls
+    time.sleep(0.05)
+    release.set()
+    for thread in busy:
+        thread.join()
+    assert outcomes("test-hedge-busy") == {"saturated": 3}
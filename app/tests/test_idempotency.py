@@ -0,0 +1,198 @@
+import threading
+import time
+
+from flask import Flask, request
+
+from common import client, idempotency
+from common.transport import LocalTransport
+
+
+def keyed_app(service_name):
+    # POST /upload answers with the size of the body it read
+    app = Flask(service_name)
+    idempotency.instrument_app(app, service_name)
+    seen = []
+
+    @app.route("/upload", methods=["POST"])
+    def upload():
+        seen.append(request.stream)
+        size = 0
+        while chunk := request.stream.read(1024):
+            size += len(chunk)
+        return str(size)
+
+    return app, seen
+
+
+def test_keyed_upload_is_spooled_to_disk(monkeypatch):
+    monkeypatch.setattr(idempotency, "SPOOL_BYTES", 1000)
+    app, seen = keyed_app("test-idempotency-spool")
+    headers = {idempotency.HEADER: "k1"}
+    response = app.test_client().post("/upload", data=b"x" * 5000, headers=headers)
+    assert response.text == "5000"
+    # Past SPOOL_BYTES the copy is a file rather than a buffer
+    assert seen[0]._rolled
+
+
+def test_keyed_request_body_is_still_fingerprinted():
+    app, _ = keyed_app("test-idempotency-body")
+    test_client = app.test_client()
+    headers = {idempotency.HEADER: "k1"}
+    assert test_client.post("/upload", data=b"abc", headers=headers).text == "3"
+    replayed = test_client.post("/upload", data=b"abc", headers=headers)
+    assert replayed.headers[idempotency.REPLAYED] == "true"
+    assert test_client.post("/upload", data=b"abcd", headers=headers).status_code == 422
+
+
+def test_json_handlers_read_the_copy():
+    app = Flask("test-idempotency-json")
+    idempotency.instrument_app(app, "test-idempotency-json")
+
+    @app.route("/pay", methods=["POST"])
+    def pay():
+        return request.get_json()["amount"]
+
+    response = app.test_client().post("/pay", json={"amount": "12.30"}, headers={idempotency.HEADER: "k1"})
+    assert response.text == "12.30"
+
+
+def counting_app(service_name, handler):
+    # POST /pay runs handler(n) for its n-th execution
+    app = Flask(service_name)
+    store = idempotency.instrument_app(app, service_name)
+    runs = []
+
+    @app.route("/pay", methods=["POST"])
+    def pay():
+        runs.append(request.get_data())
+        return handler(len(runs))
+
+    return app, store, runs
+
+
+def outcomes(service_name):
+    return {labels[2]: n for labels, n in idempotency.keyed_requests.values.items() if labels[0] == service_name}
+
+
+def test_completed_request_is_replayed():
+    app, _, runs = counting_app("test-idempotency-replay", lambda n: (f"paid {n}", 201))
+    test_client = app.test_client()
+    first = test_client.post("/pay", data=b"p1", headers={idempotency.HEADER: "k1"})
+    again = test_client.post("/pay", data=b"p1", headers={idempotency.HEADER: "k1"})
+    assert (again.status_code, again.text) == (201, "paid 1")
+    assert idempotency.REPLAYED not in first.headers
+    assert again.headers[idempotency.REPLAYED] == "true"
+    assert test_client.post("/pay", data=b"p1", headers={idempotency.HEADER: "k2"}).text == "paid 2"
+    assert len(runs) == 2
+    assert outcomes("test-idempotency-replay") == {"executed": 2, "replayed": 1}
+
+
+def test_different_body_is_refused():
+    app, _, runs = counting_app("test-idempotency-conflict", lambda n: "paid")
+    test_client = app.test_client()
+    test_client.post("/pay", data=b"p1", headers={idempotency.HEADER: "k1"})
+    assert test_client.post("/pay", data=b"p2", headers={idempotency.HEADER: "k1"}).status_code == 422
+    assert len(runs) == 1
+
+
+def test_concurrent_copies_wait_for_the_first():
+    started, finish = threading.Event(), threading.Event()
+
+    def slow(n):
+        started.set()
+        finish.wait(2)
+        return f"paid {n}"
+
+    app, _, runs = counting_app("test-idempotency-wait", slow)
+    responses = []
+
+    def post():
+        responses.append(app.test_client().post("/pay", data=b"p1", headers={idempotency.HEADER: "k1"}))
+
+    first = threading.Thread(target=post)
+    first.start()
+    assert started.wait(2)
+    copies = [threading.Thread(target=post) for _ in range(3)]
+    for thread in copies:
+        thread.start()
+    time.sleep(0.05)
+    finish.set()
+    for thread in [first] + copies:
+        thread.join()
+    assert [r.text for r in responses] == ["paid 1"] * 4
+    assert len(runs) == 1
+    assert outcomes("test-idempotency-wait") == {"executed": 1, "waited": 3}
+
+
+def test_5xx_releases_the_key():
+    app, store, runs = counting_app("test-idempotency-5xx", lambda n: ("down", 503) if n == 1 else "paid")
+    test_client = app.test_client()
+    assert test_client.post("/pay", data=b"p1", headers={idempotency.HEADER: "k1"}).status_code == 503
+    assert len(store) == 0
+    assert test_client.post("/pay", data=b"p1", headers={idempotency.HEADER: "k1"}).text == "paid"
+    assert len(runs) == 2
+
+
+def test_exception_releases_the_key():
+    def fail_once(n):
+        if n == 1:
+            raise RuntimeError("boom")
+        return "paid"
+
+    app, store, runs = counting_app("test-idempotency-raise", fail_once)
+    app.testing = False
+    test_client = app.test_client()
+    assert test_client.post("/pay", data=b"p1", headers={idempotency.HEADER: "k1"}).status_code == 500
+    assert len(store) == 0
+    assert test_client.post("/pay", data=b"p1", headers={idempotency.HEADER: "k1"}).text == "paid"
+    assert len(runs) == 2
+
+
+def test_completed_keys_expire():
+    store = idempotency.IdempotencyStore("test-idempotency-ttl", ttl=0.05)
+    entry, owner = store.claim("k1", "digest")
+    store.complete(entry, (200, [], b"paid"))
+    assert store.claim("k1", "digest") == (entry, False)
+    time.sleep(0.06)
+    again, owner = store.claim("k1", "digest")
+    assert owner and again is not entry
+
+
+def test_least_recently_used_key_is_evicted():
+    store = idempotency.IdempotencyStore("test-idempotency-lru", max_entries=2)
+    for key in ("a", "b"):
+        entry, _ = store.claim(key, key)
+        store.complete(entry, (200, [], b""))
+    # Using a makes b the least recently used
+    store.claim("a", "a")
+    store.claim("c", "c")
+    assert list(store.entries) == ["a", "c"]
+    assert idempotency.evicted_keys.values[("test-idempotency-lru",)] == 1
+
+
+def test_sibling_calls_to_one_url_get_their_own_keys():
+    # POST /outer makes three POSTs to /inner on the same app, as a fan-out
+    # or `repeat: 3` in a topology does
+    service_name = "test-idempotency-siblings"
+    app = Flask(service_name)
+    app.config["SERVICE_NAME"] = service_name
+    idempotency.instrument_app(app, service_name)
+    transport = LocalTransport({"self:5000": app})
+    inner_runs = []
+
+    @app.route("/outer", methods=["POST"])
+    def outer():
+        with transport.installed():
+            return ",".join(client.post("http://self:5000/inner").text for _ in range(3))
+
+    @app.route("/inner", methods=["POST"])
+    def inner():
+        inner_runs.append(request.headers[idempotency.HEADER])
+        return str(len(inner_runs))
+
+    test_client = app.test_client()
+    assert test_client.post("/outer", headers={idempotency.HEADER: "k1"}).text == "1,2,3"
+    assert len(set(inner_runs)) == 3
+    # A retry replays the outer request without repeating the inner ones
+    assert test_client.post("/outer", headers={idempotency.HEADER: "k1"}).text == "1,2,3"
+    assert len(inner_runs) == 3
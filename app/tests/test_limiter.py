@@ -0,0 +1,75 @@
+from flask import Flask
+
+from common import client, limiter
+from common.transport import LocalTransport
+
+
+def nested_app(service_name):
+    # POST /outer calls GET /inner on the same app through the shared client,
+    # in the same thread, as host mode and the topology bench do
+    app = Flask(service_name)
+    app.config["SERVICE_NAME"] = service_name
+    concurrency = limiter.instrument_app(app, service_name)
+    transport = LocalTransport({"self:5000": app})
+
+    @app.route("/outer", methods=["POST"])
+    def outer():
+        with transport.installed():
+            resp = client.get("http://self:5000/inner")
+        return resp.text, resp.status_code
+
+    @app.route("/inner", methods=["GET"])
+    def inner():
+        return "inner"
+
+    return app, concurrency
+
+
+def test_nested_requests_release_their_slots():
+    app, concurrency = nested_app("test-limiter-nested")
+    test_client = app.test_client()
+    for _ in range(50):
+        assert test_client.post("/outer").status_code == 200
+    assert concurrency.inflight == 0
+
+
+def test_failed_nested_request_releases_its_slot():
+    app, concurrency = nested_app("test-limiter-failed")
+
+    @app.route("/boom", methods=["GET"])
+    def boom():
+        raise RuntimeError("boom")
+
+    app.testing = False
+    assert app.test_client().get("/boom").status_code == 500
+    assert concurrency.inflight == 0
+
+
+def test_child_call_gets_the_callers_priority():
+    app, concurrency = nested_app("test-limiter-priority")
+    # critical may use 5 slots, sheddable GETs only 3, and 3 are taken
+    concurrency.algorithm.limit = 5
+    concurrency.inflight = 3
+    response = app.test_client().post("/outer")
+    assert response.status_code == 200
+    assert response.text == "inner"
+    assert concurrency.inflight == 3
+
+
+def test_get_without_a_caller_is_sheddable():
+    app, concurrency = nested_app("test-limiter-sheddable")
+    concurrency.algorithm.limit = 5
+    concurrency.inflight = 3
+    response = app.test_client().get("/inner")
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+
+def test_priority_header_from_the_gateway_is_ignored():
+    app, concurrency = nested_app("test-limiter-gateway")
+    concurrency.algorithm.limit = 5
+    concurrency.inflight = 3
+    test_client = app.test_client()
+    headers = {limiter.HEADER: "critical"}
+    assert test_client.get("/inner", headers={**headers, "X-Real-IP": "203.0.113.7"}).status_code == 503
+    assert test_client.get("/inner", headers=headers).status_code == 200
@@ -0,0 +1,69 @@
+from flask import Flask
+
+from common import metrics
+from common.transport import LocalTransport
+
+
+def nested_app(service_name):
+    # /outer calls /inner on the same app, in the same thread, as host mode does
+    app = Flask(service_name)
+    metrics.instrument_app(app, service_name)
+    transport = LocalTransport({"self:5000": app})
+
+    @app.route("/outer", methods=["POST"])
+    def outer():
+        code, _, _, body = transport.call("self:5000", "GET", "/inner")
+        return body, code
+
+    @app.route("/inner", methods=["GET"])
+    def inner():
+        return "inner"
+
+    return app
+
+
+def test_active_requests_balance_under_nested_requests():
+    app = nested_app("test-metrics-nested")
+    client = app.test_client()
+    for _ in range(10):
+        assert client.post("/outer").status_code == 200
+    active = metrics.server_active.values
+    assert active[("test-metrics-nested", "/outer")] == 0
+    assert active[("test-metrics-nested", "/inner")] == 0
+
+
+def test_durations_recorded_for_outer_and_inner_routes():
+    app = nested_app("test-metrics-durations")
+    client = app.test_client()
+    for _ in range(3):
+        client.post("/outer")
+    durations = metrics.server_duration.values
+    counts, _, _ = durations[("test-metrics-durations", "POST", "/outer", "200")]
+    assert sum(counts) == 3
+    counts, _, _ = durations[("test-metrics-durations", "GET", "/inner", "200")]
+    assert sum(counts) == 3
+
+
+def test_error_status_counted():
+    app = Flask("test-metrics-errors")
+    metrics.instrument_app(app, "test-metrics-errors")
+
+    @app.route("/fail", methods=["GET"])
+    def fail():
+        return "no", 503
+
+    app.test_client().get("/fail")
+    assert metrics.server_errors.values[("test-metrics-errors", "GET", "/fail", "503")] == 1
+    assert metrics.server_active.values[("test-metrics-errors", "/fail")] == 0
+
+
+def test_histogram_bucket_bounds_are_inclusive():
+    histogram = metrics.Histogram("test_seconds", "test", ("service",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 1.0, 2.0):
+        histogram.observe(value, "svc")
+    counts, total, _ = histogram.values[("svc",)]
+    assert counts == [2, 2, 1]
+    assert total == sum((0.05, 0.1, 0.5, 1.0, 2.0))
+    rendered = histogram.render(False)
+    assert 'test_seconds_bucket{service="svc",le="1.0"} 4' in rendered
+    assert 'test_seconds_bucket{service="svc",le="+Inf"} 5' in rendered
@@ -0,0 +1,51 @@
+import threading
+import time
+
+from common import profiler
+
+
+def nap(stop):
+    while not stop.is_set():
+        time.sleep(0.005)
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def states(frame_name, seconds=0.5):
+    # Leaf tags of the sampled stacks that pass through frame_name
+    profile = profiler.Profile()
+    profiler.Sampler(hz=200, all_threads=True).run(seconds, profile)
+    return {stack.rsplit(";", 1)[1] for stack in profile.stacks if f":{frame_name};" in stack}
+
+
+def run_threads(*targets):
+    stop = threading.Event()
+    threads = [threading.Thread(target=target, args=(stop,), daemon=True) for target in targets]
+    for thread in threads:
+        thread.start()
+    return stop, threads
+
+
+def test_sleeping_thread_is_not_gil_contention():
+    stop, threads = run_threads(nap)
+    try:
+        found = states("nap")
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert found and "[gil]" not in found
+
+
+def test_busy_thread_is_on_cpu():
+    stop, threads = run_threads(spin)
+    try:
+        found = states("spin")
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert "[cpu]" in found
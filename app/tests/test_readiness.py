@@ -0,0 +1,74 @@
+import time
+
+import pytest
+from flask import Flask
+from opentelemetry.sdk.trace import TracerProvider
+
+from common import client, faults, metrics, readiness, telemetry
+from common.transport import LocalTransport
+
+FAILING = {"routes": {"/data": {"error": {"rate": 1, "status": 503}}}}
+
+
+def service_app(service_name):
+    app = Flask(service_name)
+    app.config["SERVICE_NAME"] = service_name
+    telemetry.providers[service_name] = TracerProvider()
+    metrics.instrument_app(app, service_name)
+    injector = faults.instrument_app(app, service_name)
+    warmup = readiness.instrument_app(app, service_name)
+    return app, injector, warmup
+
+
+def counted(service_name):
+    return [labels for labels in metrics.server_duration.values if labels[0] == service_name]
+
+
+def caller_and_callee(name):
+    # GET /fetch on the caller calls GET /data on the callee, whose every
+    # request gets a fault
+    callee, injector, _ = service_app(f"{name}-callee")
+    injector.configure(FAILING)
+
+    @callee.route("/data", methods=["GET"])
+    def data():
+        return "data"
+
+    caller, _, warmup = service_app(f"{name}-caller")
+    transport = LocalTransport({"callee:5000": callee})
+
+    @caller.route("/fetch", methods=["GET"])
+    def fetch():
+        resp = client.get("http://callee:5000/data")
+        return resp.text, resp.status_code
+
+    return transport, warmup, injector
+
+
+def test_warmup_requests_are_not_traffic_downstream():
+    transport, warmup, injector = caller_and_callee("test-warmup")
+    with transport.installed():
+        warmup.send_requests()
+    assert injector.counts == {}
+    assert counted("test-warmup-callee") == []
+    assert counted("test-warmup-caller") == []
+
+
+def test_warmup_header_from_the_gateway_is_ignored():
+    transport, _, injector = caller_and_callee("test-warmup-gateway")
+    with transport.installed():
+        resp = client.get("http://callee:5000/data", headers={readiness.HEADER: "1", "X-Real-IP": "203.0.113.7"})
+    assert resp.status_code == 503
+    assert injector.counts == {"/data": 1}
+    assert counted("test-warmup-gateway-callee") != []
+
+
+def test_a_down_host_only_delays_readiness_briefly(monkeypatch):
+    monkeypatch.setattr(readiness, "CONNECT_TIMEOUT", 0.3)
+    _, _, warmup = service_app("test-warmup-down")
+    # Nothing listens on the discard port
+    warmup.targets = ["127.0.0.1:9"]
+    start = time.monotonic()
+    with pytest.raises(ConnectionError):
+        warmup.open_connections(time.monotonic() + 30)
+    assert time.monotonic() - start < 2
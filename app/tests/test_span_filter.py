@@ -0,0 +1,61 @@
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import Event, TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import SpanKind
+
+from common import span_filter
+
+
+def traced(service_name, aggregate_after=2):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    rules = span_filter.FilterRules(aggregate_after=aggregate_after)
+    provider.add_span_processor(span_filter.SpanFilter(SimpleSpanProcessor(exporter), rules))
+    return provider.get_tracer("test"), exporter
+
+
+def test_local_children_are_aggregated():
+    tracer, exporter = traced("test-filter-local")
+    with tracer.start_as_current_span("handler"):
+        for _ in range(5):
+            with tracer.start_as_current_span("item"):
+                with tracer.start_as_current_span("step"):
+                    pass
+    spans = exporter.get_finished_spans()
+    assert sorted(s.name for s in spans) == ["handler", "item", "item", "step", "step"]
+    handler = next(s for s in spans if s.name == "handler")
+    assert handler.attributes["span.aggregated.item.count"] == 3
+
+
+def test_children_with_outgoing_calls_are_exported():
+    tracer, exporter = traced("test-filter-calls")
+    with tracer.start_as_current_span("handler"):
+        for _ in range(5):
+            with tracer.start_as_current_span("call-history"):
+                with tracer.start_as_current_span("GET", kind=SpanKind.CLIENT):
+                    pass
+    spans = exporter.get_finished_spans()
+    ids = {s.context.span_id for s in spans}
+    clients = [s for s in spans if s.kind == SpanKind.CLIENT]
+    assert len(clients) == 5
+    assert all(s.parent.span_id in ids for s in clients)
+    handler = next(s for s in spans if s.name == "handler")
+    assert "span.aggregated.call-history.count" not in handler.attributes
+
+
+def test_events_are_capped_in_order():
+    rules = span_filter.FilterRules(max_events=3)
+    exception = {"exception.type": "ValueError", "exception.message": "bad"}
+    events = [
+        Event("retry", {}),
+        Event("retry", {}),
+        Event("retry", {}),
+        Event("exception", exception),
+        Event("exception", exception),
+    ]
+    assert [e.name for e in rules.events(events)] == ["retry", "retry", "retry"]
+    events = [Event("exception", exception), Event("retry", {}), Event("exception", exception)]
+    kept = rules.events(events)
+    assert [e.name for e in kept] == ["exception", "retry"]
+    assert kept[0].attributes["exception.count"] == 2
@@ -0,0 +1,46 @@
+import threading
+import time
+
+import pytest
+import requests
+from flask import Flask
+
+from common.transport import LocalTransport
+
+
+def slow_transport():
+    app = Flask("test-transport")
+    finished = threading.Event()
+
+    @app.route("/slow", methods=["GET"])
+    def slow():
+        time.sleep(0.3)
+        finished.set()
+        return "slow"
+
+    transport = LocalTransport({"slow:5000": app})
+    session = requests.Session()
+    session.mount("http://", transport)
+    return session, finished
+
+
+def test_timeout_is_enforced():
+    session, finished = slow_transport()
+    start = time.perf_counter()
+    with pytest.raises(requests.Timeout):
+        session.get("http://slow:5000/slow", timeout=0.05)
+    assert time.perf_counter() - start < 0.25
+    # The callee still runs to completion, as a server would
+    assert finished.wait(1)
+
+
+def test_read_part_of_a_timeout_pair_applies():
+    session, _ = slow_transport()
+    with pytest.raises(requests.ReadTimeout):
+        session.get("http://slow:5000/slow", timeout=(5, 0.05))
+
+
+def test_call_within_its_timeout_answers():
+    session, _ = slow_transport()
+    assert session.get("http://slow:5000/slow", timeout=2).text == "slow"
+    assert session.get("http://slow:5000/slow").text == "slow"
@@ -0,0 +1,443 @@
+"""
+Gateway latency per location and per upstream server from NGINX access logs.
+
+Reads logs in the `timed` log_format from nginx/nginx.conf (the `main`
+fields followed by $request_time and the $upstream_* timings) in one
+streaming pass: plain or .gz files, stdin ("-"), or --follow to tail a live
+log across rotations. Each request's $request_time is added to a sketch for
+its location (the inventory prefix its path falls under), and each upstream
+attempt's $upstream_response_time to one for the server that answered it, so
+retries to another replica are counted against the replica that was slow.
+
+The sketches are log-bucketed (DDSketch): every quantile is within 1% of
+the true value, their size depends on the latency range and not on the
+number of lines, and two of them merge exactly. So --jobs splits large
+uncompressed files into byte ranges read by separate processes, and --save
+and --merge combine runs, e.g. one per gateway or per day. Lines are split
+on quotes rather than matched with a regex, and each distinct timing string
+is converted once.
+
+Results print as tables, or as Prometheus summaries with --prometheus FILE
+(for the node exporter textfile collector) or --serve PORT (scraped by the
+`nginx-access-log` job in otel/prometheus/prometheus.yaml).
+
+    python nginx/tools/access_log_analyzer.py access.log [access.log.1.gz ...] [--jobs 8]
+    python nginx/tools/access_log_analyzer.py access.log --save day1.json --prometheus gateway.prom
+    python nginx/tools/access_log_analyzer.py --merge day1.json day2.json
+    python nginx/tools/access_log_analyzer.py --follow /var/log/nginx/access.log --serve 9114
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+
+from gen_conf import load_inventory
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+# Fields of a `timed` line split on '"'
+FIELDS = 19
+STATUS_CLASSES = {str(n).encode(): f"{n}xx" for n in range(1, 6)}
+SPLIT_BELOW = 64 * 1024 * 1024
+PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Sketch:
+    """Quantile sketch with a bounded relative error, mergeable."""
+
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = defaultdict(int)
+        # NGINX times have millisecond resolution, so 0.000 is common
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def key(self, value):
+        return math.ceil(math.log(value) / self.log_gamma) if value > 0 else None
+
+    def add(self, value, key=None):
+        if value > 0:
+            self.bins[key if key is not None else self.key(value)] += 1
+        else:
+            self.zeros += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for key, n in other.bins.items():
+            self.bins[key] += n
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                # Middle of the bucket (gamma^(k-1), gamma^k], within `accuracy` of any value in it
+                return min(2 * self.gamma ** key / (self.gamma + 1), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {"accuracy": self.accuracy, "bins": self.bins, "zeros": self.zeros,
+                "count": self.count, "sum": self.sum, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["accuracy"])
+        sketch.bins.update({int(k): n for k, n in data["bins"].items()})
+        sketch.zeros, sketch.count, sketch.sum, sketch.max = data["zeros"], data["count"], data["sum"], data["max"]
+        return sketch
+
+
+def split_values(field):
+    # "$upstream_*" lists one value per attempt, ", " between servers of one
+    # upstream and " : " across an internal redirect to another one
+    return field.replace(b" : ", b", ").split(b", ")
+
+
+class Aggregator:
+    def __init__(self, locations):
+        # [(prefix, upstream name)], longest prefix first
+        self.locations = sorted(locations, key=lambda item: -len(item[0]))
+        self.requests = defaultdict(Sketch)
+        self.upstreams = defaultdict(Sketch)
+        self.statuses = Counter()
+        self.lines = 0
+        self.malformed = 0
+        # Raw field -> parsed value, so each distinct string is parsed once
+        self._times = {}
+        self._locations = {}
+        self._upstreams = {}
+        self._keys = Sketch()
+
+    def timing(self, text):
+        cached = self._times.get(text)
+        if cached is None:
+            try:
+                value = float(text)
+            except ValueError:
+                value = None  # "-": no response from this attempt
+            cached = self._times[text] = (value, self._keys.key(value) if value else None)
+            if len(self._times) > 100_000:
+                self._times.clear()
+        return cached
+
+    def location(self, target):
+        path = target.split(b"?", 1)[0]
+        found = self._locations.get(path)
+        if found is None:
+            text = path.decode("utf-8", "replace")
+            found = next((prefix for prefix, _ in self.locations if text.startswith(prefix)), "other")
+            if len(self._locations) < 100_000:
+                self._locations[path] = found
+        return found
+
+    def upstream(self, tail, address):
+        # Sketch for (uh=$proxy_host from the end of the line, one $upstream_addr)
+        sketch = self._upstreams.get((tail, address))
+        if sketch is None:
+            name = tail.split(b"uh=", 1)[-1].split(None, 1)
+            sketch = self.upstreams[(name[0].decode() if name else "-", address.decode())]
+            if len(self._upstreams) < 100_000:
+                self._upstreams[(tail, address)] = sketch
+        return sketch
+
+    def feed(self, lines):
+        statuses = self.statuses
+        for line in lines:
+            self.lines += 1
+            parts = line.split(b'"')
+            if len(parts) != FIELDS:
+                self.malformed += 1
+                continue
+            request = parts[1].split(b" ", 2)
+            status = STATUS_CLASSES.get(parts[2][1:2])   # ' 200 123 '
+            value, key = self.timing(parts[8][4:-5].strip())   # ' rt=0.012 uct='
+            if len(request) < 2 or status is None or value is None:
+                self.malformed += 1
+                continue
+            location = self.location(request[1])
+            self.requests[location].add(value, key)
+            statuses[(location, status)] += 1
+
+            addresses, times = parts[15], parts[13]
+            if b" " not in addresses:
+                # One attempt, the common case
+                value, key = self.timing(times)
+                if value is not None and addresses != b"-":
+                    self.upstream(parts[18], addresses).add(value, key)
+                continue
+            for address, elapsed in zip(split_values(addresses), split_values(times)):
+                value, key = self.timing(elapsed)
+                if value is not None and address != b"-":
+                    self.upstream(parts[18], address).add(value, key)
+
+    def merge(self, other):
+        for location, sketch in other.requests.items():
+            self.requests[location].merge(sketch)
+        for upstream, sketch in other.upstreams.items():
+            self.upstreams[upstream].merge(sketch)
+        self.statuses.update(other.statuses)
+        self.lines += other.lines
+        self.malformed += other.malformed
+
+    def to_dict(self):
+        return {
+            "requests": {location: s.to_dict() for location, s in self.requests.items()},
+            "upstreams": [[name, server, s.to_dict()] for (name, server), s in self.upstreams.items()],
+            "statuses": [[location, cls, n] for (location, cls), n in self.statuses.items()],
+            "lines": self.lines,
+            "malformed": self.malformed,
+        }
+
+    @classmethod
+    def from_dict(cls, data, locations=()):
+        agg = cls(locations)
+        for location, sketch in data["requests"].items():
+            agg.requests[location] = Sketch.from_dict(sketch)
+        for name, server, sketch in data["upstreams"]:
+            agg.upstreams[(name, server)] = Sketch.from_dict(sketch)
+        for location, cls_, n in data["statuses"]:
+            agg.statuses[(location, cls_)] = n
+        agg.lines, agg.malformed = data["lines"], data["malformed"]
+        return agg
+
+
+def inventory_locations(path=None):
+    teams = load_inventory(path) if path else load_inventory()
+    return [(service["prefix"], name) for services in teams.values() for name, service in services.items()]
+
+
+def open_binary(path):
+    if path == "-":
+        return sys.stdin.buffer
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb", buffering=1024 * 1024)
+
+
+def byte_ranges(path, jobs):
+    # Ranges of roughly equal size; each reader skips to the line after its start
+    size = os.path.getsize(path)
+    if jobs <= 1 or size < SPLIT_BELOW or path.endswith(".gz"):
+        return [(path, 0, None)]
+    step = size // jobs
+    return [(path, i * step, None if i == jobs - 1 else (i + 1) * step) for i in range(jobs)]
+
+
+def read_range(path, start, end):
+    # Lines that start within [start, end)
+    with open_binary(path) as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                return
+            yield line
+
+
+def analyze_range(job):
+    path, start, end, locations = job
+    agg = Aggregator(locations)
+    if start == 0 and end is None:
+        with open_binary(path) as f:
+            agg.feed(f)
+    else:
+        agg.feed(read_range(path, start, end))
+    return agg.to_dict()
+
+
+def analyze(paths, locations, jobs=1):
+    ranges = [(path, start, end, locations) for p in paths for path, start, end in byte_ranges(p, jobs)]
+    total = Aggregator(locations)
+    if jobs > 1 and len(ranges) > 1:
+        with Pool(jobs) as pool:
+            for part in pool.imap_unordered(analyze_range, ranges):
+                total.merge(Aggregator.from_dict(part, locations))
+    else:
+        for job in ranges:
+            total.merge(Aggregator.from_dict(analyze_range(job), locations))
+    return total
+
+
+def follow(path, from_start=False, poll=0.5):
+    # tail -F: keep reading across rotation (new inode) and truncation
+    f = open(path, "rb")
+    if not from_start:
+        f.seek(0, os.SEEK_END)
+    pending = b""
+    while True:
+        line = f.readline()
+        if line:
+            if line.endswith(b"\n"):
+                yield pending + line
+                pending = b""
+            else:
+                pending += line
+            continue
+        yield None  # idle: a chance to publish
+        time.sleep(poll)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if stat.st_ino != os.fstat(f.fileno()).st_ino or stat.st_size < f.tell():
+            f.close()
+            f = open(path, "rb")
+            pending = b""
+
+
+def render_prometheus(agg):
+    lines = []
+
+    def summary(name, help, series):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} summary")
+        for labels, sketch in series:
+            for q in QUANTILES:
+                lines.append(f'{name}{{{labels},quantile="{q}"}} {sketch.quantile(q):.6g}')
+            lines.append(f"{name}_sum{{{labels}}} {sketch.sum:.6g}")
+            lines.append(f"{name}_count{{{labels}}} {sketch.count}")
+
+    summary("nginx_request_duration_seconds", "$request_time per location, from the access log",
+            [(f'location="{location}"', s) for location, s in sorted(agg.requests.items())])
+    summary("nginx_upstream_response_duration_seconds", "$upstream_response_time per upstream server, from the access log",
+            [(f'upstream="{name}",server="{server}"', s) for (name, server), s in sorted(agg.upstreams.items())])
+    lines.append("# HELP nginx_access_log_requests Requests per location and status class")
+    lines.append("# TYPE nginx_access_log_requests counter")
+    for (location, cls), n in sorted(agg.statuses.items()):
+        lines.append(f'nginx_access_log_requests_total{{location="{location}",status="{cls}"}} {n}')
+    lines.append("# HELP nginx_access_log_lines Access log lines read")
+    lines.append("# TYPE nginx_access_log_lines counter")
+    lines.append(f'nginx_access_log_lines_total{{result="parsed"}} {agg.lines - agg.malformed}')
+    lines.append(f'nginx_access_log_lines_total{{result="malformed"}} {agg.malformed}')
+    return "\n".join(lines) + "\n"
+
+
+def write_atomically(path, text):
+    # The textfile collector must never read a half-written file
+    with open(path + ".tmp", "w") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+def serve(port, render):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200 if self.path == "/metrics" else 404)
+            self.send_header("Content-Type", PROMETHEUS)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def print_report(agg):
+    print(f"{agg.lines} lines, {agg.malformed} not in the timed format")
+    errors = Counter()
+    for (location, cls), n in agg.statuses.items():
+        if cls == "5xx":
+            errors[location] += n
+    print(f"\n{'location':<36} {'requests':>9} {'5xx':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for location, s in sorted(agg.requests.items(), key=lambda item: -item[1].count):
+        print(f"{location:<36} {s.count:>9} {errors[location] / s.count:>7.2%} {s.quantile(0.5) * 1000:>8.1f} "
+              f"{s.quantile(0.9) * 1000:>8.1f} {s.quantile(0.99) * 1000:>8.1f} {s.max * 1000:>8.1f}")
+    print(f"\n{'upstream':<28} {'server':<22} {'attempts':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for (name, server), s in sorted(agg.upstreams.items()):
+        print(f"{name:<28} {server:<22} {s.count:>9} {s.quantile(0.5) * 1000:>8.1f} "
+              f"{s.quantile(0.9) * 1000:>8.1f} {s.quantile(0.99) * 1000:>8.1f} {s.max * 1000:>8.1f}")
+
+
+def run_follow(args, locations):
+    agg = Aggregator(locations)
+    lock = threading.Lock()
+
+    def render():
+        with lock:
+            return render_prometheus(agg)
+
+    if args.serve:
+        serve(args.serve, render)
+    published = time.monotonic()
+    batch = []
+    for line in follow(args.follow, from_start=args.from_start):
+        if line is not None:
+            batch.append(line)
+            if len(batch) < 1000:
+                continue
+        with lock:
+            agg.feed(batch)
+        batch = []
+        if args.prometheus and time.monotonic() - published >= args.interval:
+            write_atomically(args.prometheus, render())
+            published = time.monotonic()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("logs", nargs="*", help="access logs (.gz, or - for stdin)")
+    parser.add_argument("--follow", help="tail this log and keep publishing")
+    parser.add_argument("--from-start", action="store_true", help="with --follow, read the existing lines first")
+    parser.add_argument("--merge", nargs="+", default=[], help="add sketches saved with --save")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="processes for large plain files")
+    parser.add_argument("--inventory", help="inventory for the location prefixes (default nginx/inventory.yaml)")
+    parser.add_argument("--save", help="write the sketches as JSON")
+    parser.add_argument("--prometheus", help="write Prometheus text to this file")
+    parser.add_argument("--serve", type=int, help="serve Prometheus text at :PORT/metrics")
+    parser.add_argument("--interval", type=float, default=15, help="seconds between --prometheus writes when following")
+    args = parser.parse_args()
+    locations = inventory_locations(args.inventory)
+
+    if args.follow:
+        return run_follow(args, locations)
+    if not args.logs and not args.merge:
+        parser.error("give access logs, --merge or --follow")
+
+    start = time.perf_counter()
+    agg = analyze(args.logs, locations, args.jobs) if args.logs else Aggregator(locations)
+    elapsed = time.perf_counter() - start
+    for path in args.merge:
+        with open(path) as f:
+            agg.merge(Aggregator.from_dict(json.load(f), locations))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(agg.to_dict(), f)
+    if args.prometheus:
+        write_atomically(args.prometheus, render_prometheus(agg))
+    print_report(agg)
+    if args.logs:
+        print(f"\nread in {elapsed:.1f}s ({agg.lines / elapsed if elapsed else 0:,.0f} lines/s)")
+
+
+if __name__ == "__main__":
+    main()
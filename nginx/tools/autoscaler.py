@@ -0,0 +1,334 @@
+"""
+Scale upstream replicas from NGINX Plus API statistics.
+
+Every --interval seconds the controller reads each upstream that has an
+`autoscale` block in nginx/inventory.yaml and looks at its peers' active
+connections, 5xx rate and response time. Load is measured against
+`target_active` connections per replica, and the trend of active
+connections is projected `lead` seconds ahead. That way a replica is added
+while load is still climbing, before the current ones saturate (for
+payments-processor, 64 Gunicorn threads and its concurrency limit).
+
+    scale out  projected utilisation > scale_out_at, or 5xx rate > max_error_rate,
+               or response time > max_response_ms; after out_cooldown since the
+               last change, up to max_step replicas at a time
+    scale in   utilisation and projection both < scale_in_at for in_after
+               polls in a row and in_cooldown since the last change; one at a time
+
+New replicas come from a backend and are added to the upstream through the
+API once the backend reports them ready. Replicas are removed newest first.
+They are drained first and deleted once idle, or after drain_timeout. The
+replicas listed in the inventory are never removed.
+
+Backends:
+  command    runs --start-cmd / --stop-cmd, formatted with {upstream},
+             {host}, {index} and {port}, e.g.
+             --start-cmd "docker run -d --rm --name {host}-{index} -p {port}:5000 app-{host}"
+             and treats a replica as ready once http://<app-host>:{port}/ready
+             answers 200 (app/common/readiness.py: warmed up)
+  simulated  pretends to start replicas, each ready after --boot-seconds
+
+    python nginx/tools/autoscaler.py --api http://<nginx>:9000 --app-host <app server> --backend command ...
+    python nginx/tools/autoscaler.py --simulate     # stand-in API and a load ramp, in virtual time
+"""
+import argparse
+import math
+import shlex
+import subprocess
+import sys
+import time
+
+import requests
+
+from gen_conf import load_inventory, replica_ports
+from plus_api import Cluster, PlusAPI, StandInServer
+
+POLICY = {
+    "min": 1,
+    "max": 4,
+    "target_active": 32,
+    "scale_out_at": 0.7,
+    "scale_in_at": 0.3,
+    "max_error_rate": 0.02,
+    "max_response_ms": None,
+    "lead": 30,
+    "max_step": 2,
+    "out_cooldown": 15,
+    "in_cooldown": 120,
+    "in_after": 3,
+    "drain_timeout": 60,
+}
+
+
+class CommandBackend:
+    def __init__(self, start_cmd, stop_cmd, app_host):
+        self.start_cmd = start_cmd
+        self.stop_cmd = stop_cmd
+        self.app_host = app_host
+
+    def _run(self, template, **fields):
+        subprocess.run(shlex.split(template.format(**fields)), check=True, capture_output=True)
+
+    def start(self, upstream, index, port, now):
+        self._run(self.start_cmd, upstream=upstream, host=f"app-{upstream}", index=index, port=port)
+        return f"{self.app_host}:{port}"
+
+    def ready(self, address, now):
+        try:
+            return requests.get(f"http://{address}/ready", timeout=1).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def stop(self, upstream, index, port):
+        if self.stop_cmd:
+            self._run(self.stop_cmd, upstream=upstream, host=f"app-{upstream}", index=index, port=port)
+
+
+class SimulatedBackend:
+    def __init__(self, app_host, boot_seconds=20):
+        self.app_host = app_host
+        self.boot_seconds = boot_seconds
+        self.ready_at = {}
+
+    def start(self, upstream, index, port, now):
+        address = f"{self.app_host}:{port}"
+        self.ready_at[address] = now + self.boot_seconds
+        return address
+
+    def ready(self, address, now):
+        return now >= self.ready_at.get(address, 0)
+
+    def stop(self, upstream, index, port):
+        self.ready_at.pop(f"{self.app_host}:{port}", None)
+
+
+class UpstreamState:
+    def __init__(self, name, service, policy):
+        self.name = name
+        self.service = service
+        self.policy = policy
+        self.static = set(replica_ports(service))
+        self.starting = {}        # address -> (index, port)
+        self.draining = {}        # peer id -> (index, port, since)
+        self.last = None          # (now, requests, 5xx, active)
+        self.slope = 0.0          # EWMA of d(active)/dt
+        self.low_polls = 0
+        self.last_change = -math.inf
+
+
+def _port(server):
+    return int(server.rsplit(":", 1)[1])
+
+
+class Autoscaler:
+    def __init__(self, api, backend, inventory, clock=time.monotonic, log=print):
+        self.api = api
+        self.backend = backend
+        self.clock = clock
+        self.log = log
+        self.upstreams = {}
+        for services in inventory.values():
+            for name, service in services.items():
+                if service.get("autoscale"):
+                    policy = {**POLICY, **service["autoscale"]}
+                    self.upstreams[name] = UpstreamState(name, service, policy)
+
+    def observe(self, state, peers, now):
+        serving = [p for p in peers if p["state"] not in ("draining", "down")]
+        active = sum(p["active"] for p in serving)
+        requests_total = sum(p["requests"] for p in peers)
+        errors = sum(p["responses"]["5xx"] for p in peers)
+        weighted = sum(p["response_time"] * p["active"] for p in serving)
+        response_ms = weighted / active if active else 0
+        error_rate = 0.0
+        if state.last is not None:
+            then, last_requests, last_errors, last_active = state.last
+            dt = now - then
+            if dt > 0:
+                state.slope = 0.5 * state.slope + 0.5 * (active - last_active) / dt
+            served = requests_total - last_requests
+            error_rate = (errors - last_errors) / served if served > 0 else 0.0
+        state.last = (now, requests_total, errors, active)
+        return {"active": active, "error_rate": error_rate, "response_ms": response_ms, "serving": len(serving)}
+
+    def desired(self, state, replicas, load):
+        policy = state.policy
+        capacity = replicas * policy["target_active"]
+        projected = max(load["active"], load["active"] + state.slope * policy["lead"])
+        utilisation = load["active"] / capacity if capacity else math.inf
+        projected_utilisation = projected / capacity if capacity else math.inf
+        hot = (
+            projected_utilisation > policy["scale_out_at"]
+            or load["error_rate"] > policy["max_error_rate"]
+            or (policy["max_response_ms"] and load["response_ms"] > policy["max_response_ms"])
+        )
+        if hot:
+            state.low_polls = 0
+            needed = math.ceil(projected / (policy["target_active"] * policy["scale_out_at"]))
+            return max(replicas + 1, min(needed, replicas + policy["max_step"])), "out"
+        if utilisation < policy["scale_in_at"] and projected_utilisation < policy["scale_in_at"]:
+            state.low_polls += 1
+            if state.low_polls >= policy["in_after"]:
+                return replicas - 1, "in"
+        else:
+            state.low_polls = 0
+        return replicas, None
+
+    def step(self):
+        now = self.clock()
+        for state in self.upstreams.values():
+            try:
+                self.step_upstream(state, now)
+            except requests.RequestException as e:
+                self.log(f"{state.name}: NGINX Plus API error: {e}")
+
+    def step_upstream(self, state, now):
+        policy = state.policy
+        peers = self.api.upstream(state.name)["peers"]
+        changed = False
+
+        # Replicas that finished booting join the upstream
+        for address, (index, port) in list(state.starting.items()):
+            if self.backend.ready(address, now):
+                self.api.add_server(state.name, address, max_fails=state.service["max_fails"],
+                                    fail_timeout=state.service["fail_timeout"])
+                del state.starting[address]
+                changed = True
+                self.log(f"{state.name}: added {address}")
+
+        # Drained replicas are removed once idle
+        for peer in peers:
+            drain = state.draining.get(peer["id"])
+            if drain and (peer["active"] == 0 or now - drain[2] > policy["drain_timeout"]):
+                self.api.remove_server(state.name, peer["id"])
+                self.backend.stop(state.name, drain[0], drain[1])
+                del state.draining[peer["id"]]
+                changed = True
+                self.log(f"{state.name}: removed {peer['server']}")
+        if changed:
+            peers = self.api.upstream(state.name)["peers"]
+
+        load = self.observe(state, peers, now)
+        replicas = load["serving"] + len(state.starting)
+        target, direction = self.desired(state, replicas, load)
+        target = max(policy["min"], min(policy["max"], target))
+        cooldown = policy["out_cooldown"] if direction == "out" else policy["in_cooldown"]
+        if target == replicas or now - state.last_change < cooldown:
+            return load, replicas
+        state.last_change = now
+        state.low_polls = 0
+        if target > replicas:
+            self.scale_out(state, peers, target - replicas, now)
+        else:
+            self.scale_in(state, peers, replicas - target, now)
+        return load, target
+
+    def scale_out(self, state, peers, count, now):
+        base, step = state.service["port"], state.service["replica_port_step"]
+        used = {_port(p["server"]) for p in peers} | {port for _, port in state.starting.values()}
+        for _ in range(count):
+            index = next(i for i in range(1, 1000) if base + (i - 1) * step not in used)
+            port = base + (index - 1) * step
+            used.add(port)
+            address = self.backend.start(state.name, index, port, now)
+            state.starting[address] = (index, port)
+            self.log(f"{state.name}: starting replica {index} at {address}")
+
+    def scale_in(self, state, peers, count, now):
+        removable = sorted(
+            (p for p in peers
+             if p["state"] != "draining" and _port(p["server"]) not in state.static),
+            key=lambda p: p["id"], reverse=True,
+        )
+        for peer in removable[:count]:
+            port = _port(peer["server"])
+            index = (port - state.service["port"]) // state.service["replica_port_step"] + 1
+            self.api.drain_server(state.name, peer["id"])
+            state.draining[peer["id"]] = (index, port, now)
+            self.log(f"{state.name}: draining {peer['server']}")
+
+    def run(self, interval):
+        while True:
+            self.step()
+            time.sleep(interval)
+
+
+def ramp(low, high, rise, hold, fall):
+    # Offered concurrency: low, up to high over `rise` seconds, held, back down
+    def load(t):
+        if t < rise:
+            return low + (high - low) * t / rise
+        if t < rise + hold:
+            return high
+        return max(low, high - (high - low) * (t - rise - hold) / fall)
+    return load
+
+
+def simulate(args, inventory):
+    cluster = Cluster(capacity=args.capacity)
+    clock = [0.0]
+    for services in inventory.values():
+        for name, service in services.items():
+            servers = [f"{args.app_host}:{port}" for port in replica_ports(service)]
+            load = ramp(10, args.peak, 300, 120, 300) if service.get("autoscale") else None
+            cluster.add_upstream(name, servers, load)
+    server = StandInServer(cluster).start()
+    backend = SimulatedBackend(args.app_host, args.boot_seconds)
+    events = []
+    scaler = Autoscaler(PlusAPI(server.url), backend, inventory, clock=lambda: clock[0], log=events.append)
+    if not scaler.upstreams:
+        sys.exit("no upstream in the inventory has an autoscale block")
+
+    # Seconds in which the replicas were offered more than they hold, with
+    # the controller and with only the inventory's replicas
+    saturated = {name: 0.0 for name in scaler.upstreams}
+    unscaled = {name: 0.0 for name in scaler.upstreams}
+    print(f"{'t':>5} {'upstream':<20} {'offered':>7} {'active':>7} {'replicas':>8} {'5xx':>6} {'rt ms':>6}  events")
+    for _ in range(int(args.duration / args.interval)):
+        cluster.advance(args.interval)
+        clock[0] = cluster.now
+        for name, state in scaler.upstreams.items():
+            if cluster.saturated(name):
+                saturated[name] += args.interval
+            if cluster.load[name](clock[0]) / len(state.static) > args.capacity:
+                unscaled[name] += args.interval
+            events.clear()
+            load, replicas = scaler.step_upstream(state, clock[0])
+            print(f"{clock[0]:>5.0f} {name:<20} {cluster.load[name](clock[0]):>7.0f} {load['active']:>7.0f} "
+                  f"{replicas:>8} {load['error_rate']:>6.1%} {load['response_ms']:>6.0f}  {'; '.join(events)}")
+    server.shutdown()
+    for name, seconds in saturated.items():
+        print(f"{name}: saturated for {seconds:.0f}s of {args.duration:.0f}s "
+              f"({unscaled[name]:.0f}s with {len(scaler.upstreams[name].static)} fixed replicas)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--api", default="http://localhost:9000", help="NGINX Plus API base URL")
+    parser.add_argument("--app-host", default="localhost", help="address replicas are reachable at from NGINX")
+    parser.add_argument("--interval", type=float, default=5.0)
+    parser.add_argument("--backend", choices=("command", "simulated"), default="command")
+    parser.add_argument("--start-cmd")
+    parser.add_argument("--stop-cmd")
+    parser.add_argument("--simulate", action="store_true", help="run against the stand-in API in virtual time")
+    parser.add_argument("--duration", type=float, default=900.0, help="simulated seconds")
+    parser.add_argument("--peak", type=float, default=200.0, help="simulated peak concurrency")
+    parser.add_argument("--capacity", type=int, default=64, help="simulated concurrency one replica can hold")
+    parser.add_argument("--boot-seconds", type=float, default=20.0, help="simulated replica start-up time")
+    args = parser.parse_args()
+
+    inventory = load_inventory()
+    if args.simulate:
+        simulate(args, inventory)
+        return
+    if args.backend == "command":
+        if not args.start_cmd:
+            parser.error("--backend command needs --start-cmd")
+        backend = CommandBackend(args.start_cmd, args.stop_cmd, args.app_host)
+    else:
+        backend = SimulatedBackend(args.app_host, args.boot_seconds)
+    Autoscaler(PlusAPI(args.api), backend, inventory).run(args.interval)
+
+
+if __name__ == "__main__":
+    main()
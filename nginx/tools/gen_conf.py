@@ -0,0 +1,251 @@
+"""
+Generate the NGINX upstream and location blocks from nginx/inventory.yaml.
+
+Every service gets an upstream with one server per replica, the inventory's
+load-balancing method and a keepalive pool, and a location that proxies to
+it over HTTP/1.1 with an empty Connection header (without both, NGINX opens
+a new upstream connection per request) and runs an active health check
+(NGINX Plus) against /ready by default, so a replica that is still warming
+up gets no traffic. Replicas after the first listen on port + (N - 1) *
+replica_port_step and are added to app/docker-compose.replicas.yaml as
+<host>-N, e.g. app-payment-currency-2.
+
+Routes listed under a service's `uploads` (route: client_max_body_size)
+get their own location that accepts bodies up to that size, instead of
+NGINX's 1m default, and streams them to the service unbuffered. Routes
+listed under `pinned` keep state on the replica that served them (e.g.
+settlement jobs), so they get their own location and an upstream that sends
+all of them to one server by consistent hashing on the route; they move to
+another replica only when that one is down. A service's `volumes` (name:
+path) and `environment` are given to each generated replica, with the
+volume named <name>-N.
+
+    python nginx/tools/gen_conf.py            # rewrite the generated files
+    python nginx/tools/gen_conf.py --check    # validate, and fail if they are stale
+"""
+import argparse
+import os
+import re
+import sys
+
+import yaml
+
+NGINX_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INVENTORY = os.path.join(NGINX_DIR, "inventory.yaml")
+UPSTREAM_CONF = os.path.join(NGINX_DIR, "conf.d", "app", "upstream.conf.template")
+LOCATION_CONF = os.path.join(NGINX_DIR, "conf.d", "app", "location.conf")
+REPLICAS_COMPOSE = os.path.join(NGINX_DIR, "..", "app", "docker-compose.replicas.yaml")
+
+LB_METHODS = {
+    "round_robin": None,
+    "least_conn": "least_conn;",
+    "ip_hash": "ip_hash;",
+    "random": "random two least_conn;",
+    "least_time": "least_time header;",
+}
+# Response checks a health_check can `match`: app_ready for services with
+# /ready (common/readiness.py), app_alive for any answer at all
+MATCHES = {
+    "app_alive": "status 200-499;",
+    "app_ready": "status 200;",
+}
+HEADER = "# Generated by nginx/tools/gen_conf.py from nginx/inventory.yaml. Do not edit.\n"
+NAME = re.compile(r"^[a-z0-9][a-z0-9-]*$")
+SIZE = re.compile(r"^[0-9]+[kKmMgG]?$")
+
+
+def load_inventory(path=INVENTORY):
+    with open(path) as f:
+        inventory = yaml.safe_load(f)
+    defaults = inventory.get("defaults") or {}
+    teams = {}
+    for team, services in (inventory.get("teams") or {}).items():
+        teams[team] = {}
+        for name, spec in (services or {}).items():
+            service = {**defaults, **spec}
+            service["health_check"] = {**defaults.get("health_check", {}), **(spec.get("health_check") or {})}
+            teams[team][name] = service
+    return teams
+
+
+def replica_ports(service):
+    return [service["port"] + i * service["replica_port_step"] for i in range(service["replicas"])]
+
+
+def validate(teams):
+    # Problems that would make NGINX or docker compose refuse the output,
+    # or route requests somewhere unexpected
+    errors = []
+    prefixes, ports = {}, {}
+    for team, services in teams.items():
+        if not services:
+            errors.append(f"team {team} has no services")
+        for name, service in services.items():
+            if not NAME.match(name):
+                errors.append(f"{name}: upstream names are lowercase letters, digits and dashes")
+            missing = [field for field in ("path", "prefix", "port") if field not in service]
+            if missing:
+                errors.append(f"{name}: missing {', '.join(missing)}")
+                continue
+            prefix = service["prefix"]
+            if not (prefix.startswith("/api/") and prefix.endswith("/")):
+                errors.append(f"{name}: prefix {prefix} must start with /api/ and end with /")
+            if prefix in prefixes:
+                errors.append(f"{name}: prefix {prefix} already used by {prefixes[prefix]}")
+            prefixes[prefix] = name
+            if service["lb"] not in LB_METHODS:
+                errors.append(f"{name}: lb must be one of {', '.join(LB_METHODS)}")
+            if service["replicas"] < 1:
+                errors.append(f"{name}: replicas must be at least 1")
+            if service["health_check"].get("match") not in (None, *MATCHES):
+                errors.append(f"{name}: health_check match must be one of {', '.join(MATCHES)}")
+            if service["keepalive"] < 1:
+                errors.append(f"{name}: keepalive must be at least 1, or every request opens a connection")
+            for route, size in (service.get("uploads") or {}).items():
+                if not NAME.match(route):
+                    errors.append(f"{name}: upload route {route} is one path segment, e.g. settlements")
+                if not SIZE.match(str(size)):
+                    errors.append(f"{name}: upload size {size} must be a number with an optional k, m or g")
+            for route in service.get("pinned") or ():
+                if not NAME.match(route):
+                    errors.append(f"{name}: pinned route {route} is one path segment, e.g. settlements")
+            for volume in service.get("volumes") or {}:
+                if not NAME.match(volume):
+                    errors.append(f"{name}: volume names are lowercase letters, digits and dashes")
+            for port in replica_ports(service):
+                if port in ports:
+                    errors.append(f"{name}: port {port} already used by {ports[port]}")
+                ports[port] = name
+    return errors
+
+
+def upstream_block(upstream, service, balance):
+    lines = [f"upstream {upstream} {{", f"    zone {upstream} 256k;"]
+    if balance:
+        lines.append(f"    {balance}")
+    for port in replica_ports(service):
+        lines.append(f"    server {service['server']}:{port} "
+                     f"max_fails={service['max_fails']} fail_timeout={service['fail_timeout']};")
+    # keepalive has to follow the balancing method
+    lines.append(f"    keepalive {service['keepalive']};")
+    lines.append(f"    keepalive_requests {service['keepalive_requests']};")
+    lines.append(f"    keepalive_timeout {service['keepalive_timeout']};")
+    return lines + ["}", ""]
+
+
+def route_upstream(name, service, route):
+    return f"{name}-{route}" if route in (service.get("pinned") or ()) else name
+
+
+def upstream_conf(teams):
+    lines = [HEADER]
+    for match, condition in MATCHES.items():
+        lines += [f"match {match} {{", f"    {condition}", "}", ""]
+    for team, services in teams.items():
+        lines.append(f"# {team} Team")
+        for name, service in services.items():
+            lines += upstream_block(name, service, LB_METHODS[service["lb"]])
+            for route in service.get("pinned") or ():
+                lines += upstream_block(route_upstream(name, service, route), service, f"hash {route} consistent;")
+        lines.append("")
+    return "\n".join(lines).rstrip("\n") + "\n"
+
+
+def location_conf(teams):
+    lines = [HEADER]
+    for team, services in teams.items():
+        lines.append(f"# {team} Team")
+        for name, service in services.items():
+            # `mandatory: true` and the like are bare flags
+            check = " ".join(k if v is True else f"{k}={v}" for k, v in service["health_check"].items())
+            lines.append(f"location {service['prefix']} {{")
+            lines.append("    include /etc/nginx/conf.d/common/otel-span-attr.conf;")
+            lines.append("    include /etc/nginx/conf.d/common/gateway-headers.conf;")
+            lines.append("    include /etc/nginx/conf.d/common/upstream-keepalive.conf;")
+            lines.append(f"    proxy_pass http://{name}/;")
+            lines.append(f"    health_check {check};")
+            lines.append("}")
+            lines.append("")
+            uploads = service.get("uploads") or {}
+            for route in dict.fromkeys([*uploads, *(service.get("pinned") or ())]):
+                upstream = route_upstream(name, service, route)
+                lines.append(f"location {service['prefix']}{route} {{")
+                lines.append("    include /etc/nginx/conf.d/common/otel-span-attr.conf;")
+                lines.append("    include /etc/nginx/conf.d/common/gateway-headers.conf;")
+                lines.append("    include /etc/nginx/conf.d/common/upstream-keepalive.conf;")
+                if route in uploads:
+                    lines.append(f"    client_max_body_size {uploads[route]};")
+                    lines.append("    proxy_request_buffering off;")
+                lines.append(f"    proxy_pass http://{upstream}/{route};")
+                if upstream != name:
+                    lines.append(f"    health_check {check};")
+                lines.append("}")
+                lines.append("")
+        lines.append("")
+    return "\n".join(lines).rstrip("\n") + "\n"
+
+
+def replicas_compose(teams):
+    services, volumes = {}, {}
+    for team, members in teams.items():
+        for name, service in members.items():
+            host = f"app-{name}"
+            for n, port in enumerate(replica_ports(service)[1:], start=2):
+                replica = services[f"{host}-{n}"] = {
+                    "build": {"context": ".", "dockerfile": "Dockerfile",
+                              "args": {"SERVICE_PATH": service["path"]}},
+                    "ports": [f"{port}:5000"],
+                    "environment": ["OTEL_EXPORTER_OTLP_ENDPOINT=${OTEL_EXPORTER_OTLP_ENDPOINT}",
+                                    *(service.get("environment") or ())],
+                    "networks": ["otel-net"],
+                    "extra_hosts": ["nginx-gateway:${NGINX_GATEWAY_IP}"],
+                }
+                if service.get("volumes"):
+                    # Its own copy: replicas must not share e.g. a settlement job directory
+                    replica["volumes"] = [f"{volume}-{n}:{path}" for volume, path in service["volumes"].items()]
+                    volumes.update({f"{volume}-{n}": None for volume in service["volumes"]})
+    compose = {"services": services, **({"volumes": volumes} if volumes else {})}
+    body = yaml.safe_dump(compose, sort_keys=False, default_flow_style=False)
+    return HEADER + "# docker compose -f docker-compose.yaml -f docker-compose.replicas.yaml up\n\n" + body
+
+
+def outputs(teams):
+    return {
+        UPSTREAM_CONF: upstream_conf(teams),
+        LOCATION_CONF: location_conf(teams),
+        REPLICAS_COMPOSE: replicas_compose(teams),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--inventory", default=INVENTORY)
+    parser.add_argument("--check", action="store_true",
+                        help="validate the inventory and exit 1 if a generated file differs from it")
+    args = parser.parse_args()
+
+    teams = load_inventory(args.inventory)
+    errors = validate(teams)
+    for error in errors:
+        print(f"error: {error}", file=sys.stderr)
+    if errors:
+        sys.exit(1)
+
+    stale = []
+    for path, content in outputs(teams).items():
+        current = open(path).read() if os.path.exists(path) else None
+        if current == content:
+            continue
+        if args.check:
+            stale.append(os.path.relpath(path))
+        else:
+            with open(path, "w") as f:
+                f.write(content)
+            print(f"wrote {os.path.relpath(path)}")
+    if stale:
+        print(f"out of date, run {os.path.relpath(__file__)}: {', '.join(stale)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
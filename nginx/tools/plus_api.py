@@ -0,0 +1,205 @@
+"""
+NGINX Plus API client for upstream statistics and dynamic servers, and a
+stand-in API server for running the autoscaler without NGINX Plus.
+
+The client covers the part of the API the autoscaler needs: upstream peer
+statistics and adding, draining and removing servers in an upstream (which
+needs a `zone` in the upstream and `api write=on`, see
+conf.d/nginx-metrics.conf).
+
+StandInServer answers the same endpoints from a simulated Cluster. Its load
+model spreads the concurrent requests offered to an upstream evenly over the
+peers that are up; a peer holds at most `capacity` of them and the rest are
+counted as 5xx, and its response time grows as 1 / (1 - utilisation). Time
+only moves when Cluster.advance() is called, so a simulation can run hours
+of traffic in seconds.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+API_VERSION = 9
+
+
+class PlusAPI:
+    def __init__(self, base_url, version=API_VERSION, timeout=5):
+        self.base = f"{base_url.rstrip('/')}/api/{version}/http/upstreams"
+        self.session = requests.Session()
+        self.timeout = timeout
+
+    def _call(self, method, path="", **kwargs):
+        resp = self.session.request(method, self.base + path, timeout=self.timeout, **kwargs)
+        resp.raise_for_status()
+        return resp.json() if resp.content else None
+
+    def upstream(self, name):
+        # {"peers": [{"id", "server", "state", "active", "requests",
+        #             "responses": {"5xx", "total", ...}, "response_time", ...}], ...}
+        return self._call("GET", f"/{name}")
+
+    def servers(self, name):
+        return self._call("GET", f"/{name}/servers")
+
+    def add_server(self, name, server, **params):
+        return self._call("POST", f"/{name}/servers", json={"server": server, **params})
+
+    def drain_server(self, name, server_id):
+        return self._call("PATCH", f"/{name}/servers/{server_id}", json={"drain": True})
+
+    def remove_server(self, name, server_id):
+        return self._call("DELETE", f"/{name}/servers/{server_id}")
+
+
+class Peer:
+    def __init__(self, peer_id, server):
+        self.id = peer_id
+        self.server = server
+        self.state = "up"
+        self.active = 0.0
+        self.requests = 0.0
+        self.responses = {"2xx": 0.0, "5xx": 0.0}
+        self.response_time = 0
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "server": self.server,
+            "state": self.state,
+            "active": round(self.active),
+            "requests": int(self.requests),
+            "responses": {
+                "2xx": int(self.responses["2xx"]),
+                "5xx": int(self.responses["5xx"]),
+                "total": int(self.responses["2xx"] + self.responses["5xx"]),
+            },
+            "response_time": self.response_time,
+        }
+
+    def config(self):
+        return {"id": self.id, "server": self.server, "drain": self.state == "draining"}
+
+
+class Cluster:
+    def __init__(self, capacity=64, base_ms=20.0):
+        self.capacity = capacity
+        self.base_ms = base_ms
+        self.upstreams = {}
+        # upstream name -> function of time returning offered concurrency
+        self.load = {}
+        self.now = 0.0
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+    def add_upstream(self, name, servers, load=None):
+        with self.lock:
+            self.upstreams[name] = []
+            for server in servers:
+                self._add(name, server)
+            if load is not None:
+                self.load[name] = load
+
+    def _add(self, name, server):
+        peer = Peer(self.next_id, server)
+        self.next_id += 1
+        self.upstreams[name].append(peer)
+        return peer
+
+    def advance(self, dt):
+        with self.lock:
+            self.now += dt
+            for name, peers in self.upstreams.items():
+                offered = self.load.get(name, lambda t: 0)(self.now)
+                up = [p for p in peers if p.state == "up"]
+                share = offered / len(up) if up else 0
+                for peer in peers:
+                    if peer.state == "draining":
+                        # Finishes what it has and takes nothing new
+                        peer.active *= 0.5 ** dt
+                        peer.active = 0.0 if peer.active < 0.5 else peer.active
+                        continue
+                    peer.active = min(share, self.capacity)
+                    utilisation = min(peer.active / self.capacity, 0.95)
+                    seconds = self.base_ms / (1 - utilisation) / 1000
+                    served = peer.active / seconds * dt
+                    rejected = max(0.0, share - self.capacity) / seconds * dt
+                    peer.requests += served + rejected
+                    peer.responses["2xx"] += served
+                    peer.responses["5xx"] += rejected
+                    peer.response_time = round(seconds * 1000)
+
+    def saturated(self, name):
+        # Peers that are being offered more than they can hold
+        with self.lock:
+            offered = self.load.get(name, lambda t: 0)(self.now)
+            up = [p for p in self.upstreams[name] if p.state == "up"]
+            return bool(up) and offered / len(up) > self.capacity
+
+    def handle(self, method, parts, body):
+        # (status, payload) for /api/<version>/http/upstreams/...
+        with self.lock:
+            if not parts:
+                return 200, {name: {"peers": [p.stats() for p in peers]} for name, peers in self.upstreams.items()}
+            peers = self.upstreams.get(parts[0])
+            if peers is None:
+                return 404, {"error": {"status": 404, "text": "upstream not found"}}
+            if len(parts) == 1 and method == "GET":
+                return 200, {"peers": [p.stats() for p in peers], "zone": parts[0]}
+            if len(parts) == 2 and parts[1] == "servers":
+                if method == "GET":
+                    return 200, [p.config() for p in peers]
+                if method == "POST":
+                    return 201, self._add(parts[0], body["server"]).config()
+            if len(parts) == 3 and parts[1] == "servers":
+                peer = next((p for p in peers if str(p.id) == parts[2]), None)
+                if peer is None:
+                    return 404, {"error": {"status": 404, "text": "server not found"}}
+                if method == "PATCH":
+                    if body.get("drain"):
+                        peer.state = "draining"
+                    return 200, peer.config()
+                if method == "DELETE":
+                    peers.remove(peer)
+                    return 200, [p.config() for p in peers]
+            return 405, {"error": {"status": 405, "text": "method not supported"}}
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, cluster, address=("127.0.0.1", 0)):
+        self.cluster = cluster
+        super().__init__(address, StandInHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def _respond(self):
+        parts = self.path.strip("/").split("/")
+        # api/<version>/http/upstreams/...
+        if parts[:1] != ["api"] or parts[2:4] != ["http", "upstreams"]:
+            status, payload = 404, {"error": {"status": 404, "text": "not found"}}
+        else:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+            status, payload = self.server.cluster.handle(self.command, parts[4:], body)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _respond
+
+    def log_message(self, format, *args):
+        pass
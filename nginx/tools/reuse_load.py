@@ -0,0 +1,122 @@
+"""
+Load the gateway and report how often NGINX reused upstream connections.
+
+Sends --requests calls spread over every route in the Locust ENDPOINTS table
+through the gateway, from --concurrency threads. Each service counts, per
+request, whether it arrived on a new connection or on one it had already
+served (http_server_connection_requests_total). The counters of every replica
+in nginx/inventory.yaml are read before and after the run, and the reuse
+rate of each upstream server is reported. Without keepalive pools it is
+close to 0%; with them it approaches 1 - connections opened / requests.
+Service-to-service calls made by the shared client are counted too.
+
+    python nginx/tools/reuse_load.py --gateway http://localhost:8080 --app-host localhost [-n 2000]
+"""
+import argparse
+import ast
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from gen_conf import NGINX_DIR, load_inventory, replica_ports
+
+LOCUSTFILE = os.path.join(NGINX_DIR, "..", "otel", "locust", "locustfile.py")
+SAMPLE = re.compile(r'^http_server_connection_requests_total\{service="[^"]*",connection="(new|reused)"\} (\S+)$')
+
+
+def load_endpoints(path=LOCUSTFILE):
+    # Read ENDPOINTS without importing the locustfile (and Locust with it)
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "ENDPOINTS" for t in node.targets):
+            endpoints = ast.literal_eval(node.value)
+            return [url for team in endpoints.values() for url in team.values()]
+    raise ValueError(f"ENDPOINTS not found in {path}")
+
+
+def connection_counts(app_host, port):
+    # {"new": n, "reused": n} for one replica, None if it does not answer
+    try:
+        text = requests.get(f"http://{app_host}:{port}/metrics", timeout=5).text
+    except requests.RequestException:
+        return None
+    counts = {"new": 0.0, "reused": 0.0}
+    for line in text.splitlines():
+        match = SAMPLE.match(line)
+        if match:
+            counts[match.group(1)] += float(match.group(2))
+    return counts
+
+
+def snapshot(teams, app_host):
+    return {
+        (name, port): connection_counts(app_host, port)
+        for services in teams.values()
+        for name, service in services.items()
+        for port in replica_ports(service)
+    }
+
+
+def drive(gateway, paths, total, concurrency):
+    methods = {}
+    lock = threading.Lock()
+    sent = [0]
+
+    def call(i):
+        path = paths[i % len(paths)]
+        with requests.Session() as session:
+            session.headers["X-Forwarded-For"] = "8.8.8.8"
+            resp = session.request(methods.get(path, "GET"), gateway + path, timeout=30)
+            if resp.status_code == 405:
+                methods[path] = "POST"
+                resp = session.request("POST", gateway + path, timeout=30)
+        with lock:
+            sent[0] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, range(total)))
+    return sent[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--gateway", default="http://localhost:8080")
+    parser.add_argument("--app-host", default="localhost", help="where the service ports are published")
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    teams = load_inventory()
+    before = snapshot(teams, args.app_host)
+    start = time.perf_counter()
+    sent = drive(args.gateway.rstrip("/"), load_endpoints(), args.requests, args.concurrency)
+    elapsed = time.perf_counter() - start
+    after = snapshot(teams, args.app_host)
+
+    print(f"{sent} gateway requests in {elapsed:.1f}s")
+    print(f"{'upstream':<28} {'port':>5} {'requests':>9} {'new conns':>10} {'reuse':>7}")
+    totals = {"new": 0.0, "reused": 0.0}
+    for (name, port), end in after.items():
+        begin = before.get((name, port))
+        if end is None or begin is None:
+            print(f"{name:<28} {port:>5} {'unreachable':>9}")
+            continue
+        new = end["new"] - begin["new"]
+        reused = end["reused"] - begin["reused"]
+        totals["new"] += new
+        totals["reused"] += reused
+        served = new + reused
+        print(f"{name:<28} {port:>5} {served:>9.0f} {new:>10.0f} "
+              f"{reused / served if served else 0:>7.1%}")
+    served = totals["new"] + totals["reused"]
+    print(f"{'all':<28} {'':>5} {served:>9.0f} {totals['new']:>10.0f} "
+          f"{totals['reused'] / served if served else 0:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import autoscaler
+from gen_conf import replica_ports
+from plus_api import Cluster, PlusAPI, StandInServer
+
+STATIC = "app:5004"
+
+
+class Harness:
+    # One autoscaled upstream on the stand-in API, stepped in virtual time
+    def __init__(self, load, replicas=1, boot_seconds=10, **policy):
+        service = {"port": 5004, "replica_port_step": 100, "replicas": replicas,
+                   "max_fails": 3, "fail_timeout": "10s", "autoscale": {"max": 8, **policy}}
+        self.cluster = Cluster(capacity=64)
+        self.cluster.add_upstream("svc", [f"app:{port}" for port in replica_ports(service)], load)
+        self.server = StandInServer(self.cluster).start()
+        self.backend = autoscaler.SimulatedBackend("app", boot_seconds)
+        self.events = []
+        self.scaler = autoscaler.Autoscaler(PlusAPI(self.server.url), self.backend, {"Team": {"svc": service}},
+                                            clock=lambda: self.cluster.now, log=self.events.append)
+        self.state = self.scaler.upstreams["svc"]
+        # (t, replicas the controller is aiming for, peers after the step, peer was saturated before it)
+        self.history = [(0.0, replicas, [], False)]
+
+    def run(self, seconds, interval=5):
+        for _ in range(int(seconds / interval)):
+            self.cluster.advance(interval)
+            saturated = self.cluster.saturated("svc")
+            _, replicas = self.scaler.step_upstream(self.state, self.cluster.now)
+            peers = [dict(server=p.server, state=p.state) for p in self.cluster.upstreams["svc"]]
+            self.history.append((self.cluster.now, replicas, peers, saturated))
+        return self
+
+    def changes(self):
+        return [(t, replicas) for (t, replicas, _, _), (_, before, _, _)
+                in zip(self.history[1:], self.history) if replicas != before]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def harness():
+    made = []
+
+    def make(*args, **kwargs):
+        made.append(Harness(*args, **kwargs))
+        return made[-1]
+    yield make
+    for h in made:
+        h.close()
+
+
+def test_scales_out_on_a_ramp_before_saturating(harness):
+    # 10 -> 200 concurrent requests over 300s: one 64-slot replica saturates at ~85s
+    h = harness(autoscaler.ramp(10, 200, 300, 120, 300)).run(420)
+    first_out = h.changes()[0][0]
+    assert first_out < 60
+    assert not any(saturated for _, _, _, saturated in h.history)
+    assert len(h.cluster.upstreams["svc"]) >= 4
+
+
+def test_no_flapping_on_steady_load(harness):
+    h = harness(lambda t: 60).run(600)
+    changes = h.changes()
+    assert [replicas for _, replicas in changes] == sorted(replicas for _, replicas in changes)
+    for (t, _), (later, _) in zip(changes, changes[1:]):
+        assert later - t >= h.state.policy["out_cooldown"]
+    assert all(replicas == changes[-1][1] for t, replicas, _, _ in h.history if t > changes[-1][0])
+
+
+def test_scale_in_waits_for_in_after_low_polls(harness):
+    h = harness(lambda t: 150 if t <= 100 else 5, in_cooldown=0).run(100)
+    high = h.history[-1][1]
+    h.run(5 * (h.state.policy["in_after"] - 1))
+    assert h.history[-1][1] == high
+    h.run(5)
+    assert h.history[-1][1] == high - 1
+
+
+def test_scale_in_drains_then_removes_only_dynamic_peers(harness):
+    h = harness(lambda t: 150 if t <= 100 else 0, in_cooldown=10, drain_timeout=15).run(100)
+    dynamic = {p["server"] for p in h.history[-1][2]} - {STATIC}
+    assert dynamic
+    h.run(600)
+    assert [p["server"] for p in h.history[-1][2]] == [STATIC]
+    for server in dynamic:
+        states = [next((p["state"] for p in peers if p["server"] == server), None) for _, _, peers, _ in h.history]
+        gone = states.index(None, states.index("up"))
+        assert states[gone - 1] == "draining"
+    assert any("draining app:5" in event for event in h.events)
+
+
+def test_replicas_stay_within_min_and_max(harness):
+    h = harness(lambda t: 2000, max=3).run(300)
+    assert max(replicas for _, replicas, _, _ in h.history) == 3
+    assert len(h.cluster.upstreams["svc"]) == 3
+
+    h = harness(lambda t: 0, min=2).run(60)
+    assert h.history[-1][1] == 2
+    assert len(h.cluster.upstreams["svc"]) == 2
+    assert min(replicas for _, replicas, _, _ in h.history[1:]) == 2
+
+
+class ReadyHandler(BaseHTTPRequestHandler):
+    status = {}
+
+    def do_GET(self):
+        self.send_response(self.status.get(self.path, 404))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_command_backend_waits_for_ready():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ReadyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    backend = autoscaler.CommandBackend("true", None, "127.0.0.1")
+    address = f"127.0.0.1:{server.server_address[1]}"
+    try:
+        ReadyHandler.status = {"/": 200, "/ready": 503}
+        assert not backend.ready(address, 0)
+        ReadyHandler.status = {"/": 200, "/ready": 200}
+        assert backend.ready(address, 0)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert not backend.ready(address, 0)
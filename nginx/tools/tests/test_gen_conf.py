@@ -0,0 +1,111 @@
+import os
+
+import pytest
+import yaml
+
+import gen_conf
+
+DEFAULTS = {
+    "server": "$APP_SERVER_IP", "replicas": 1, "replica_port_step": 100, "lb": "least_conn",
+    "keepalive": 16, "keepalive_requests": 1000, "keepalive_timeout": "60s", "max_fails": 3,
+    "fail_timeout": "10s", "health_check": {"uri": "/ready", "match": "app_ready", "mandatory": True},
+}
+
+
+def inventory(tmp_path, **services):
+    # {name: spec} in one team, with the same defaults as nginx/inventory.yaml
+    specs = {
+        name: {"path": f"team/{name}", "prefix": f"/api/{name}/", "port": 5001 + i, **spec}
+        for i, (name, spec) in enumerate(services.items())
+    }
+    path = tmp_path / "inventory.yaml"
+    path.write_text(yaml.safe_dump({"defaults": DEFAULTS, "teams": {"Team": specs}}, sort_keys=False))
+    return gen_conf.load_inventory(str(path))
+
+
+def block(conf, header):
+    # The lines of the `header {` block in generated NGINX config
+    lines = conf.split("\n")
+    start = lines.index(header + " {")
+    return [line.strip() for line in lines[start + 1:lines.index("}", start)]]
+
+
+@pytest.mark.parametrize("services, error", [
+    ({"a": {"prefix": "/api/x/"}, "b": {"prefix": "/api/x/"}}, "b: prefix /api/x/ already used by a"),
+    ({"a": {"port": 5001, "replicas": 2}, "b": {"port": 5101}}, "b: port 5101 already used by a"),
+    ({"a": {"lb": "fastest"}}, "a: lb must be one of"),
+    ({"a": {"keepalive": 0}}, "a: keepalive must be at least 1"),
+    ({"a": {"uploads": {"settlements": "1 gig"}}}, "a: upload size 1 gig must be a number"),
+    ({"a": {"uploads": {"bulk/settlements": "1g"}}}, "a: upload route bulk/settlements is one path segment"),
+    ({"a": {"pinned": ["jobs/1"]}}, "a: pinned route jobs/1 is one path segment"),
+])
+def test_validate_errors(tmp_path, services, error):
+    errors = gen_conf.validate(inventory(tmp_path, **services))
+    assert any(e.startswith(error) for e in errors), errors
+
+
+def test_valid_inventory_has_no_errors(tmp_path):
+    teams = inventory(tmp_path, a={"replicas": 3}, b={"uploads": {"settlements": "1g"}, "pinned": ["settlements"]})
+    assert gen_conf.validate(teams) == []
+
+
+def test_upstream_has_a_server_per_replica_and_keepalive_after_the_method(tmp_path):
+    conf = gen_conf.upstream_conf(inventory(tmp_path, a={"replicas": 3, "lb": "least_time"}))
+    lines = block(conf, "upstream a")
+    servers = [line for line in lines if line.startswith("server ")]
+    assert [line.split()[1] for line in servers] == ["$APP_SERVER_IP:5001", "$APP_SERVER_IP:5101",
+                                                    "$APP_SERVER_IP:5201"]
+    assert lines.index("least_time header;") < lines.index("keepalive 16;")
+    assert lines.index(servers[-1]) < lines.index("keepalive 16;")
+
+
+def test_round_robin_has_no_method_line(tmp_path):
+    lines = block(gen_conf.upstream_conf(inventory(tmp_path, a={"lb": "round_robin"})), "upstream a")
+    assert lines[0] == "zone a 256k;"
+    assert lines[1].startswith("server ")
+
+
+def test_location_proxies_with_health_check(tmp_path):
+    lines = block(gen_conf.location_conf(inventory(tmp_path, a={})), "location /api/a/")
+    assert "proxy_pass http://a/;" in lines
+    assert "include /etc/nginx/conf.d/common/upstream-keepalive.conf;" in lines
+    assert "health_check uri=/ready match=app_ready mandatory;" in lines
+
+
+def test_upload_location_raises_the_body_limit(tmp_path):
+    conf = gen_conf.location_conf(inventory(tmp_path, a={"uploads": {"settlements": "1g"}}))
+    lines = block(conf, "location /api/a/settlements")
+    assert "client_max_body_size 1g;" in lines
+    assert "proxy_request_buffering off;" in lines
+    assert "proxy_pass http://a/settlements;" in lines
+    assert not any(line.startswith("health_check") for line in lines)
+
+
+def test_pinned_route_gets_a_hashed_upstream(tmp_path):
+    teams = inventory(tmp_path, a={"replicas": 2, "uploads": {"settlements": "1g"}, "pinned": ["settlements"]})
+    upstream = block(gen_conf.upstream_conf(teams), "upstream a-settlements")
+    assert "hash settlements consistent;" in upstream
+    assert sum(line.startswith("server ") for line in upstream) == 2
+    assert upstream.index("hash settlements consistent;") < upstream.index("keepalive 16;")
+    location = block(gen_conf.location_conf(teams), "location /api/a/settlements")
+    assert "client_max_body_size 1g;" in location
+    assert "proxy_pass http://a-settlements/settlements;" in location
+    assert "health_check uri=/ready match=app_ready mandatory;" in location
+
+
+def test_replicas_get_environment_and_their_own_volume(tmp_path):
+    teams = inventory(tmp_path, a={"replicas": 3, "volumes": {"jobs": "/var/lib/jobs"}, "environment": ["X=1"]})
+    compose = yaml.safe_load(gen_conf.replicas_compose(teams))
+    assert list(compose["services"]) == ["app-a-2", "app-a-3"]
+    assert compose["services"]["app-a-3"]["ports"] == ["5201:5000"]
+    assert compose["services"]["app-a-3"]["volumes"] == ["jobs-3:/var/lib/jobs"]
+    assert "X=1" in compose["services"]["app-a-2"]["environment"]
+    assert list(compose["volumes"]) == ["jobs-2", "jobs-3"]
+
+
+def test_committed_files_match_the_inventory():
+    teams = gen_conf.load_inventory()
+    assert gen_conf.validate(teams) == []
+    for path, content in gen_conf.outputs(teams).items():
+        with open(path) as f:
+            assert f.read() == content, f"{os.path.relpath(path)} is stale, run nginx/tools/gen_conf.py"
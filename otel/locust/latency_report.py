@@ -0,0 +1,205 @@
+"""
+Per-endpoint latency recording for Locust runs.
+
+Latencies are kept in HDR-style (log-linear) histograms so percentiles stay
+accurate to ~1% from microseconds up to minutes while using a few KB per
+endpoint. Histograms are plain dicts of bucket -> count, so worker results can
+be merged on the master and written to JSON for comparison between builds.
+
+Compare two exported runs without Locust:
+    python latency_report.py compare results.json baseline.json
+"""
+import csv
+import json
+import os
+import sys
+import threading
+import time
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    # 2 significant digits -> 256 linear sub-buckets per power of two
+    SUB_BUCKET_BITS = 8
+    HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+    def __init__(self, counts=None):
+        self.counts = counts or {}
+        self.total = sum(self.counts.values())
+
+    def record(self, value_us):
+        value = max(0, int(value_us))
+        shift = max(0, value.bit_length() - self.SUB_BUCKET_BITS)
+        index = shift * self.HALF + (value >> shift)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+
+    @classmethod
+    def bucket_value(cls, index):
+        # Midpoint of the value range covered by a bucket
+        shift = max(0, index // cls.HALF - 1)
+        low = (index - shift * cls.HALF) << shift
+        return low + ((1 << shift) - 1) / 2
+
+    def percentile(self, pct):
+        if not self.total:
+            return 0.0
+        target = max(1, round(self.total * pct / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return self.bucket_value(index)
+        return self.bucket_value(max(self.counts))
+
+    def mean(self):
+        if not self.total:
+            return 0.0
+        return sum(self.bucket_value(i) * c for i, c in self.counts.items()) / self.total
+
+    def to_json(self):
+        return {str(i): c for i, c in self.counts.items()}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls({int(i): c for i, c in data.items()})
+
+
+class LatencyRecorder:
+    """Histograms and error counts keyed by (method, name, country)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.errors = {}
+
+    def record(self, method, name, country, response_time_ms, failed):
+        key = (method, name, country)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = LatencyHistogram()
+            hist.record(response_time_ms * 1000)
+            if failed:
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def drain(self):
+        # Serialise and reset, used by workers for each report to the master
+        with self.lock:
+            data = [
+                [list(key), hist.to_json(), self.errors.get(key, 0)]
+                for key, hist in self.histograms.items()
+            ]
+            self.histograms = {}
+            self.errors = {}
+        return data
+
+    def merge(self, data):
+        with self.lock:
+            for key, counts, errors in data:
+                key = tuple(key)
+                hist = self.histograms.get(key)
+                if hist is None:
+                    hist = self.histograms[key] = LatencyHistogram()
+                hist.merge(LatencyHistogram.from_json(counts))
+                if errors:
+                    self.errors[key] = self.errors.get(key, 0) + errors
+
+    def rows(self):
+        # One row per (method, name, country) plus an "all" row per endpoint
+        with self.lock:
+            groups = {}
+            for (method, name, country), hist in self.histograms.items():
+                for key in ((method, name, country), (method, name, "all")):
+                    merged, errors = groups.get(key, (LatencyHistogram(), 0))
+                    merged.merge(hist)
+                    groups[key] = (merged, errors + self.errors.get((method, name, country), 0))
+
+        rows = []
+        for (method, name, country), (hist, errors) in sorted(groups.items()):
+            row = {
+                "method": method,
+                "name": name,
+                "country": country,
+                "count": hist.total,
+                "errors": errors,
+                "error_rate": errors / hist.total if hist.total else 0.0,
+                "mean_ms": hist.mean() / 1000,
+            }
+            for pct in PERCENTILES:
+                row[f"p{pct:g}_ms"] = hist.percentile(pct) / 1000
+            row["histogram"] = hist.to_json()
+            rows.append(row)
+        return rows
+
+
+def export(recorder, results_dir):
+    os.makedirs(results_dir, exist_ok=True)
+    rows = recorder.rows()
+    report = {"created": time.time(), "endpoints": rows}
+    json_path = os.path.join(results_dir, "latency.json")
+    with open(json_path, "w") as f:
+        json.dump(report, f)
+
+    with open(os.path.join(results_dir, "latency.csv"), "w", newline="") as f:
+        fields = [k for k in rows[0] if k != "histogram"] if rows else []
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    return report
+
+
+def slo_config():
+    return {
+        "p50_ratio": float(os.getenv("SLO_P50_RATIO", "1.2")),
+        "p99_ratio": float(os.getenv("SLO_P99_RATIO", "1.3")),
+        "max_error_rate": float(os.getenv("SLO_MAX_ERROR_RATE", "0.01")),
+        "min_samples": int(os.getenv("SLO_MIN_SAMPLES", "50")),
+    }
+
+
+def compare(report, baseline, slo):
+    """Return a list of human-readable SLO violations (empty when passing)."""
+    previous = {
+        (row["method"], row["name"]): row
+        for row in baseline.get("endpoints", [])
+        if row["country"] == "all"
+    }
+    violations = []
+    for row in report["endpoints"]:
+        if row["country"] != "all" or row["count"] < slo["min_samples"]:
+            continue
+        endpoint = f"{row['method']} {row['name']}"
+        if row["error_rate"] > slo["max_error_rate"]:
+            violations.append(
+                f"{endpoint}: error rate {row['error_rate']:.2%} > {slo['max_error_rate']:.2%}"
+            )
+        base = previous.get((row["method"], row["name"]))
+        if base is None or base["count"] < slo["min_samples"]:
+            continue
+        for field, ratio in (("p50_ms", slo["p50_ratio"]), ("p99_ms", slo["p99_ratio"])):
+            if base[field] > 0 and row[field] > base[field] * ratio:
+                violations.append(
+                    f"{endpoint}: {field[:-3]} {row[field]:.1f}ms > "
+                    f"{ratio:g} x baseline {base[field]:.1f}ms"
+                )
+    return violations
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "compare":
+        sys.exit("usage: latency_report.py compare <results.json> <baseline.json>")
+    with open(sys.argv[2]) as f:
+        current = json.load(f)
+    with open(sys.argv[3]) as f:
+        base = json.load(f)
+    problems = compare(current, base, slo_config())
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
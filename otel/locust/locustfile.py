@@ -1,19 +1,31 @@
+import os
+import logging
+import json
 import time
 import random
-from locust import HttpUser, task, between
-
-IPS = [
-    "8.8.8.8",            # US
-    "99.79.66.59",        # Canada
-    "51.145.123.29",      # UK
-    "46.4.105.19",        # Germany
-    "51.91.106.1",        # France
-    "58.94.157.121",      # Japan
-    "103.224.182.242",    # Australia
-    "186.192.90.5",       # Brazil
-    "122.160.17.83",      # India
-    "196.21.247.1"        # South Africa
-]
+import uuid
+
+import gevent
+from locust import HttpUser, LoadTestShape, events, task, between, constant, constant_throughput
+from locust.exception import StopUser
+from locust.runners import LocalRunner, MasterRunner, WorkerRunner
+from locust.util.timespan import parse_timespan
+
+from latency_report import LatencyRecorder, compare, export, slo_config
+from replay import ReplaySchedule
+
+IPS = {
+    "8.8.8.8": "US",
+    "99.79.66.59": "Canada",
+    "51.145.123.29": "UK",
+    "46.4.105.19": "Germany",
+    "51.91.106.1": "France",
+    "58.94.157.121": "Japan",
+    "103.224.182.242": "Australia",
+    "186.192.90.5": "Brazil",
+    "122.160.17.83": "India",
+    "196.21.247.1": "South Africa",
+}
 
 ENDPOINTS = {
     "payments": {
@@ -59,8 +71,62 @@ ENDPOINTS = {
     },
 }
 
+# Load profile, set by start-locust.sh for headless runs
+SHAPE = os.getenv("LOCUST_SHAPE", "constant")
+TARGET_RPS = float(os.getenv("LOCUST_TARGET_RPS", "0"))
+TARGET_USERS = int(os.getenv("LOCUST_USERS", "15"))
+RUN_TIME = os.getenv("LOCUST_DURATION", "")
+
+# Replay mode: re-issue a recorded access log or OTLP export instead of the
+# random endpoint mix below
+REPLAY_FILE = os.getenv("LOCUST_REPLAY_FILE")
+REPLAY_SPEEDUP = float(os.getenv("LOCUST_REPLAY_SPEEDUP", "1"))
+REPLAY_SHARDS = int(os.getenv("LOCUST_REPLAY_SHARDS", "1"))
+
+# Per-endpoint, per-country latency histograms exported when the run ends
+RESULTS_DIR = os.getenv("RESULTS_DIR", "/tmp/locust-results")
+LATENCY_BASELINE = os.getenv("LATENCY_BASELINE")
+latency = LatencyRecorder()
+
 def get_random_ip():
-    return random.choice(IPS)
+    return random.choice(list(IPS))
+
+def send(client, method, url, ip=None):
+    ip = ip or get_random_ip()
+    headers = {"X-Forwarded-For": ip}
+    if method.lower() != "get":
+        # Lets the services replay the result if this write is retried
+        headers["Idempotency-Key"] = uuid.uuid4().hex
+    context = {"country": IPS.get(ip, "other")}
+    client.request(method.upper(), url, headers=headers, context=context)
+
+
+@events.request.add_listener
+def record_latency(request_type, name, response_time, exception, context, **kwargs):
+    latency.record(request_type, name, context.get("country", "unknown"), response_time, exception is not None)
+
+@events.report_to_master.add_listener
+def send_latency(client_id, data):
+    data["latency"] = latency.drain()
+
+@events.worker_report.add_listener
+def merge_latency(client_id, data):
+    latency.merge(data.get("latency", []))
+
+@events.quitting.add_listener
+def check_latency_slos(environment, **kwargs):
+    if isinstance(environment.runner, WorkerRunner):
+        return
+    report = export(latency, RESULTS_DIR)
+    if not LATENCY_BASELINE or not os.path.exists(LATENCY_BASELINE):
+        return
+    with open(LATENCY_BASELINE) as f:
+        baseline = json.load(f)
+    violations = compare(report, baseline, slo_config())
+    for violation in violations:
+        print(f"SLO regression: {violation}")
+    if violations:
+        environment.process_exit_code = 1
 
 
 class PaymentsUser(HttpUser):
@@ -82,11 +148,7 @@ class PaymentsUser(HttpUser):
             ("post", "/api/payments/processor/refund-payment"),
         ]
         method, url = random.choice(endpoints)
-        headers = {"X-Forwarded-For": get_random_ip()}
-        if method == "get":
-            self.client.get(url, headers=headers)
-        elif method == "post":
-            self.client.post(url, headers=headers)
+        send(self.client, method, url)
 
 class AccountingUser(HttpUser):
     wait_time = between(10, 25)
@@ -105,11 +167,7 @@ class AccountingUser(HttpUser):
             ("get", "/api/accounting/history/export-transactions"),
         ]
         method, url = random.choice(endpoints)
-        headers = {"X-Forwarded-For": get_random_ip()}
-        if method == "get":
-            self.client.get(url, headers=headers)
-        elif method == "post":
-            self.client.post(url, headers=headers)
+        send(self.client, method, url)
 
 class RiskUser(HttpUser):
     wait_time = between(5, 15)
@@ -128,11 +186,7 @@ class RiskUser(HttpUser):
             ("get", "/api/risk/manager/review-flags"),
         ]
         method, url = random.choice(endpoints)
-        headers = {"X-Forwarded-For": get_random_ip()}
-        if method == "get":
-            self.client.get(url, headers=headers)
-        elif method == "post":
-            self.client.post(url, headers=headers)
+        send(self.client, method, url)
 
 class CustomerUser(HttpUser):
     wait_time = between(10, 15)
@@ -150,8 +204,104 @@ class CustomerUser(HttpUser):
             ("get", "/api/customer/profile-manager/search-profiles"),
         ]
         method, url = random.choice(endpoints)
-        headers = {"X-Forwarded-For": get_random_ip()}
-        if method == "get":
-            self.client.get(url, headers=headers)
-        elif method == "post":
-            self.client.post(url, headers=headers)
+        send(self.client, method, url)
+
+
+# Fixed-rate mode: every user issues TARGET_RPS / TARGET_USERS requests per
+# second instead of idling for the think times above, so the total request
+# rate follows the user count (and therefore the shape).
+if TARGET_RPS > 0:
+    for _user_class in (PaymentsUser, AccountingUser, RiskUser, CustomerUser):
+        _user_class.wait_time = constant_throughput(TARGET_RPS / TARGET_USERS)
+    del _user_class
+
+
+# Each shape maps run progress (0.0 - 1.0) to a fraction of TARGET_USERS
+SHAPES = {
+    "ramp": lambda p: min(1.0, p / 0.2),
+    "step": lambda p: min(1.0, (int(p * 5) + 1) / 5),
+    "spike": lambda p: 1.0 if 0.45 <= p < 0.55 else 0.3,
+}
+if SHAPE != "constant" and SHAPE not in SHAPES:
+    raise SystemExit(f"Unknown LOCUST_SHAPE {SHAPE!r}: use constant, {', '.join(SHAPES)}")
+
+if SHAPE in SHAPES and RUN_TIME:
+    class TargetShape(LoadTestShape):
+        duration = parse_timespan(RUN_TIME)
+        profile = staticmethod(SHAPES[SHAPE])
+
+        def tick(self):
+            run_time = self.get_run_time()
+            if run_time >= self.duration:
+                return None
+            users = max(1, round(TARGET_USERS * self.profile(run_time / self.duration)))
+            # Spawn fast enough to reach any step within a couple of seconds
+            return users, max(10, TARGET_USERS / 2)
+
+
+if REPLAY_FILE:
+    replay_schedule = None
+    replay_shards_done = set()
+
+    # Only replay traffic is generated in this mode
+    for _user_class in (PaymentsUser, AccountingUser, RiskUser, CustomerUser):
+        _user_class.abstract = True
+    del _user_class
+
+    @events.init.add_listener
+    def register_replay_done(environment, **kwargs):
+        if isinstance(environment.runner, MasterRunner):
+            def on_replay_done(environment, msg, **kwargs):
+                replay_shards_done.add(msg.data)
+                if len(replay_shards_done) >= REPLAY_SHARDS:
+                    # Stop first so workers send their final stats
+                    environment.runner.stop()
+                    gevent.spawn_later(2, environment.runner.quit)
+            environment.runner.register_message("replay-done", on_replay_done)
+
+    @events.test_start.add_listener
+    def open_replay(environment, **kwargs):
+        global replay_schedule
+        if isinstance(environment.runner, MasterRunner):
+            return
+        shard = getattr(environment.runner, "worker_index", 0)
+        shards = REPLAY_SHARDS if isinstance(environment.runner, WorkerRunner) else 1
+        replay_schedule = ReplaySchedule(REPLAY_FILE, REPLAY_SPEEDUP, shard, shards)
+
+    class ReplayUser(HttpUser):
+        # Every user pulls the next due request; concurrency is the user count
+        wait_time = constant(0)
+
+        @task
+        def replay(self):
+            item = replay_schedule.next() if replay_schedule else None
+            if item is None:
+                self.finish_replay()
+                raise StopUser()
+            due, record = item
+            replay_schedule.wait(due)
+            send(self.client, record.method.lower(), record.path, record.client_ip)
+
+        def finish_replay(self):
+            runner = self.environment.runner
+            if getattr(runner, "replay_reported", False):
+                return
+            runner.replay_reported = True
+            gevent.spawn(self.report_replay_done, runner)
+
+        @staticmethod
+        def report_replay_done(runner):
+            # Let the other users finish their in-flight requests first
+            for _ in range(60):
+                if not any(not g.dead for g in runner.user_greenlets):
+                    break
+                gevent.sleep(0.5)
+            if replay_schedule.late:
+                logging.warning(
+                    "%d replayed requests were issued more than 1s late; add users to keep up",
+                    replay_schedule.late,
+                )
+            if isinstance(runner, WorkerRunner):
+                runner.send_message("replay-done", runner.worker_index)
+            elif isinstance(runner, LocalRunner):
+                runner.quit()
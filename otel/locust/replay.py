@@ -0,0 +1,183 @@
+"""
+Recorded traffic sources for Locust replay mode.
+
+Two sources are understood, both read as a stream (plain or .gz) so the
+input never has to fit in memory:
+
+  * NGINX access logs in the `main` or `timed` log_format from nginx/nginx.conf
+  * OTLP JSON trace exports (one ExportTraceServiceRequest per line, as
+    written by the collector's file exporter); only `nginx-plus` spans are used
+
+Each source yields Record(timestamp, method, path, client_ip) in timestamp
+order. Print a summary of a recording with:
+    python replay.py access.log
+"""
+import gzip
+import heapq
+import json
+import re
+import sys
+import time
+from collections import Counter, namedtuple
+from datetime import datetime
+
+import gevent
+
+Record = namedtuple("Record", "timestamp method path client_ip")
+
+MAIN_LOG = re.compile(
+    r'(?P<remote_addr>\S+) - \S+ \[(?P<time_local>[^\]]+)\] '
+    r'"(?P<method>[A-Z]+) (?P<path>\S+)[^"]*" \d{3} \S+ "[^"]*" "[^"]*" '
+    r'"(?P<forwarded_for>[^"]*)"'
+)
+
+# OTLP spans are only roughly ordered across export batches
+REORDER_WINDOW = 10_000
+
+
+def open_stream(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def parse_access_log(lines, prefix="/api/"):
+    last_time, last_ts = None, 0.0
+    for line in lines:
+        match = MAIN_LOG.match(line)
+        if not match or not match["path"].startswith(prefix):
+            continue
+        # The same second repeats for every line logged in it
+        if match["time_local"] != last_time:
+            last_time = match["time_local"]
+            last_ts = datetime.strptime(last_time, "%d/%b/%Y:%H:%M:%S %z").timestamp()
+        client_ip = match["forwarded_for"].split(",")[0].strip()
+        if client_ip in ("", "-"):
+            client_ip = match["remote_addr"]
+        yield Record(last_ts, match["method"], match["path"], client_ip)
+
+
+def spread_within_second(records):
+    # $time_local only has second resolution: space the requests logged in
+    # one second evenly across it instead of firing them as a single burst
+    batch = []
+    for record in records:
+        if batch and record.timestamp != batch[0].timestamp:
+            yield from _spread(batch)
+            batch = []
+        batch.append(record)
+    yield from _spread(batch)
+
+
+def _spread(batch):
+    step = 1.0 / len(batch) if batch else 0
+    for i, record in enumerate(batch):
+        yield record._replace(timestamp=record.timestamp + i * step)
+
+
+def parse_otlp_json(lines, service="nginx-plus", prefix="/api/"):
+    for line in lines:
+        if not line.strip():
+            continue
+        export = json.loads(line)
+        for resource_spans in export.get("resourceSpans", []):
+            resource = _attributes(resource_spans.get("resource", {}).get("attributes", []))
+            for scope_spans in resource_spans.get("scopeSpans", []):
+                for span in scope_spans.get("spans", []):
+                    attrs = _attributes(span.get("attributes", []))
+                    if attrs.get("service.name", resource.get("service.name")) != service:
+                        continue
+                    method, _, path = span.get("name", "").partition(" ")
+                    method = attrs.get("http.method", method)
+                    path = attrs.get("http.target", path)
+                    if not path.startswith(prefix):
+                        continue
+                    client_ip = attrs.get("http.client_ip") or attrs.get("net.peer.ip", "")
+                    yield Record(
+                        int(span["startTimeUnixNano"]) / 1e9, method, path,
+                        client_ip.split(",")[0].strip(),
+                    )
+
+
+def _attributes(items):
+    attrs = {}
+    for item in items:
+        value = item.get("value", {})
+        attrs[item["key"]] = next(iter(value.values()), None) if value else None
+    return attrs
+
+
+def reorder(records, window=REORDER_WINDOW):
+    heap = []
+    for seq, record in enumerate(records):
+        heapq.heappush(heap, (record.timestamp, seq, record))
+        if len(heap) > window:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def read_records(path):
+    lines = open_stream(path)
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith((".json", ".jsonl")):
+        return reorder(parse_otlp_json(lines))
+    return spread_within_second(parse_access_log(lines))
+
+
+class ReplaySchedule:
+    """
+    Hands out recorded requests to replay users at their original offset
+    from the first record, divided by `speedup`. With `shards` > 1 only every
+    shards-th record is kept, so each Locust worker replays its own slice.
+    """
+
+    def __init__(self, path, speedup=1.0, shard=0, shards=1):
+        self.records = read_records(path)
+        self.speedup = speedup
+        self.shard = shard
+        self.shards = shards
+        self.seq = -1
+        self.first = None
+        self.started = None
+        self.exhausted = False
+        self.late = 0
+
+    def next(self):
+        """Return (due_wall_time, record), or None when the recording ends."""
+        for record in self.records:
+            self.seq += 1
+            # Every shard measures offsets from the same first record
+            if self.first is None:
+                self.first = record.timestamp
+                self.started = time.time()
+            if self.seq % self.shards != self.shard:
+                continue
+            offset = (record.timestamp - self.first) / self.speedup
+            return self.started + offset, record
+        self.exhausted = True
+        return None
+
+    def wait(self, due):
+        delay = due - time.time()
+        if delay > 0:
+            gevent.sleep(delay)
+        elif delay < -1.0:
+            # Not enough free users to issue the request on time
+            self.late += 1
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: replay.py <access.log|traces.json>[.gz]")
+    count, first, last = 0, None, None
+    mix = Counter()
+    for rec in read_records(sys.argv[1]):
+        count += 1
+        first = rec.timestamp if first is None else first
+        last = rec.timestamp
+        mix[f"{rec.method} {rec.path}"] += 1
+    span = (last - first) if count else 0
+    print(f"{count} requests over {span:.1f}s ({count / span if span else 0:.1f} req/s)")
+    for endpoint, n in mix.most_common(20):
+        print(f"{n:>10}  {endpoint}")
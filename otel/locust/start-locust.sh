@@ -1,10 +1,126 @@
 #!/bin/bash
-locust -f /mnt/locust/locustfile.py &
-LOCUST_PID=$!
-sleep 10
-for i in {1..5}; do
-  python3 -c "import requests; requests.post('http://localhost:8089/swarm', data={'user_count': 15, 'spawn_rate': 10})" && break
-  echo "Attempt $i: Failed to start swarm, retrying in 5 seconds..."
-  sleep 5
+# Distributed Locust launcher: one master plus N worker processes, so the
+# generator is not limited to a single Python core.
+#
+# Usage:
+#   start-locust.sh                      # web UI on :8089, auto-swarm (default)
+#   start-locust.sh --headless --rps 10000 --duration 10m [--shape ramp]
+#
+# Options:
+#   --headless          run without the web UI and exit when the run finishes
+#   --shape NAME        constant (default), ramp, step or spike
+#   --rps N             target requests/s across all workers (0 = think times)
+#   --duration T        run time, e.g. 90s, 10m, 1h30m (required with --headless)
+#   --users N           simulated users (default: rps / 10, or 15)
+#   --workers N         worker processes (default: number of cores)
+#   --results-dir DIR   where CSV/HTML/log output is written
+#   --replay FILE       replay an NGINX access log or OTLP JSON export instead
+#                       of the random endpoint mix (stops when the file ends)
+#   --speedup N         replay N times faster than recorded (default 1)
+#
+# Exit codes: the master's exit code (1 if any request failed), or 3 if the
+# generator itself hit the CPU threshold on any process, in which case the
+# measured latencies cannot be trusted.
+
+LOCUSTFILE=${LOCUSTFILE:-/mnt/locust/locustfile.py}
+HEADLESS=0
+SHAPE=constant
+RPS=0
+DURATION=""
+USERS=""
+WORKERS=$(nproc)
+RESULTS_DIR=${RESULTS_DIR:-/tmp/locust-results}
+REPLAY=""
+SPEEDUP=1
+
+while [ $# -gt 0 ]; do
+  case "$1" in
+    --headless) HEADLESS=1 ;;
+    --shape) SHAPE=$2; shift ;;
+    --rps) RPS=$2; shift ;;
+    --duration) DURATION=$2; shift ;;
+    --users) USERS=$2; shift ;;
+    --workers) WORKERS=$2; shift ;;
+    --results-dir) RESULTS_DIR=$2; shift ;;
+    --replay) REPLAY=$2; shift ;;
+    --speedup) SPEEDUP=$2; shift ;;
+    *) echo "Unknown option: $1" >&2; exit 2 ;;
+  esac
+  shift
 done
-wait $LOCUST_PID
+
+case "$SHAPE" in
+  constant|ramp|step|spike) ;;
+  *) echo "Unknown shape: $SHAPE (constant, ramp, step or spike)" >&2; exit 2 ;;
+esac
+
+if [ "$HEADLESS" = 1 ] && [ -z "$DURATION" ] && [ -z "$REPLAY" ]; then
+  echo "--duration is required with --headless unless replaying" >&2
+  exit 2
+fi
+
+if [ -z "$USERS" ]; then
+  if [ "${RPS%.*}" -gt 0 ]; then
+    USERS=$(( (${RPS%.*} + 9) / 10 ))
+  else
+    USERS=15
+  fi
+fi
+
+mkdir -p "$RESULTS_DIR"
+rm -f "$RESULTS_DIR"/*.log
+ulimit -n 65536 2>/dev/null
+
+export LOCUST_SHAPE=$SHAPE LOCUST_TARGET_RPS=$RPS LOCUST_USERS=$USERS LOCUST_DURATION=$DURATION RESULTS_DIR
+if [ -n "$REPLAY" ]; then
+  export LOCUST_REPLAY_FILE=$REPLAY LOCUST_REPLAY_SPEEDUP=$SPEEDUP LOCUST_REPLAY_SHARDS=$WORKERS
+fi
+
+for i in $(seq 1 "$WORKERS"); do
+  locust -f "$LOCUSTFILE" --worker --master-host 127.0.0.1 \
+    --logfile "$RESULTS_DIR/worker-$i.log" &
+done
+
+if [ "$HEADLESS" = 1 ]; then
+  MASTER_ARGS=(--headless --expect-workers "$WORKERS" --expect-workers-max-wait 60
+               --csv "$RESULTS_DIR/run" --html "$RESULTS_DIR/report.html")
+  # A shape class drives users and run time itself
+  if [ "$SHAPE" = constant ]; then
+    MASTER_ARGS+=(-u "$USERS" -r "$(( USERS / 2 > 10 ? USERS / 2 : 10 ))")
+    [ -n "$DURATION" ] && MASTER_ARGS+=(-t "$DURATION")
+  fi
+  locust -f "$LOCUSTFILE" --master "${MASTER_ARGS[@]}" \
+    --logfile "$RESULTS_DIR/master.log"
+  STATUS=$?
+else
+  locust -f "$LOCUSTFILE" --master --logfile "$RESULTS_DIR/master.log" &
+  LOCUST_PID=$!
+  sleep 10
+  for i in {1..5}; do
+    python3 -c "import requests; requests.post('http://localhost:8089/swarm', data={'user_count': $USERS, 'spawn_rate': 10})" && break
+    echo "Attempt $i: Failed to start swarm, retrying in 5 seconds..."
+    sleep 5
+  done
+  wait $LOCUST_PID
+  STATUS=$?
+fi
+
+# Workers stop on their own when the master quits
+wait
+
+if [ -f "$RESULTS_DIR/run_stats.csv" ]; then
+  python3 - "$RESULTS_DIR/run_stats.csv" <<'EOF'
+import csv, sys
+for row in csv.DictReader(open(sys.argv[1])):
+    if row["Name"] == "Aggregated":
+        print(f"requests={row['Request Count']} failures={row['Failure Count']} "
+              f"rps={float(row['Requests/s']):.1f} p50={row['50%']}ms "
+              f"p99={row['99%']}ms p99.9={row['99.9%']}ms")
+EOF
+fi
+
+if grep -q -e "CPU usage above" -e "exceeded cpu threshold" "$RESULTS_DIR"/*.log; then
+  echo "Load generator was CPU-bound; add workers or machines before trusting these results" >&2
+  exit 3
+fi
+exit $STATUS
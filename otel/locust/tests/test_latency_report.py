@@ -0,0 +1,59 @@
+import json
+import random
+
+import pytest
+
+from latency_report import LatencyHistogram
+
+
+def recorded(values):
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    return histogram
+
+
+def test_small_values_are_exact():
+    for value in range(2 * LatencyHistogram.HALF):
+        assert recorded([value]).percentile(100) == value
+
+
+@pytest.mark.parametrize("value", [256, 257, 511, 512, 1000, 12345, 999_999, 60_000_000, 2**40 + 12345])
+def test_bucket_holds_its_value_within_one_percent(value):
+    histogram = recorded([value])
+    (index,) = histogram.counts
+    shift = max(0, value.bit_length() - LatencyHistogram.SUB_BUCKET_BITS)
+    # The bucket covers [low, low + 2**shift) and reports its midpoint
+    low = value >> shift << shift
+    assert low <= value < low + (1 << shift)
+    assert LatencyHistogram.bucket_value(index) == low + ((1 << shift) - 1) / 2
+    assert abs(histogram.percentile(50) - value) / value < 0.01
+
+
+def test_buckets_are_ordered_like_their_values():
+    values = sorted(random.Random(7).sample(range(10_000_000), 5000))
+    indexes = [next(iter(recorded([value]).counts)) for value in values]
+    assert indexes == sorted(indexes)
+    # Every index maps back into the range of the values that produce it
+    for value, index in zip(values, indexes):
+        assert abs(LatencyHistogram.bucket_value(index) - value) <= value / 2 ** (LatencyHistogram.SUB_BUCKET_BITS - 1)
+
+
+def test_percentiles_and_mean():
+    histogram = recorded(range(1, 101))
+    assert histogram.percentile(50) == 50
+    assert histogram.percentile(99) == 99
+    assert histogram.percentile(100) == 100
+    assert histogram.mean() == pytest.approx(50.5)
+    assert LatencyHistogram().percentile(99) == 0.0
+    assert recorded([-5]).percentile(50) == 0
+
+
+def test_merge_and_json_round_trip():
+    first, second = recorded([10, 20, 3000]), recorded([20, 5_000_000])
+    first.merge(second)
+    assert first.total == 5
+    restored = LatencyHistogram.from_json(json.loads(json.dumps(first.to_json())))
+    assert restored.counts == first.counts
+    assert restored.total == 5
+    assert restored.percentile(40) == 20
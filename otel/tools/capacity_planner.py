@@ -0,0 +1,496 @@
+"""
+Queueing-model capacity planner built from traces or Tempo span metrics.
+
+Builds a profile of the running system from either:
+  * exported traces (see otlp_stream.py): per (service, route) arrival
+    rate, self time (span duration minus the time spent waiting on calls
+    to other services) with its variance and p99, and the real call edges
+    between routes, counted per request. Retries therefore show up as
+    visit multiplicity (settle-payment in the chaos processor retries
+    process-gateway up to 3 times), which is also reported per attempt group
+  * Tempo span metrics in Prometheus (--prometheus): per-route rates and
+    latencies from traces_spanmetrics_*, and per-service call edges from
+    traces_service_graph_request_total. Self time is estimated by
+    subtracting downstream latency, and service times are assumed
+    exponential
+
+Each service is a queue with replicas * --workers-per-replica servers. The
+default is the Gunicorn thread count the services run with (--threads in
+app/Dockerfile, 64): a replica serves that many requests at once, and most
+self time is spent waiting (route latencies, injected delays) rather than
+holding the GIL. A CPU-bound service saturates its core before its threads;
+plan it with --workers-per-replica 1. Waiting time comes from Erlang C (M/M/c), scaled by
+(ca^2 + cs^2) / 2 for G/G/c (Allen-Cunneen), with an exponential tail for
+p99. For a target RPS the load is scaled along the call edges. The planner
+then predicts each service's utilisation and wait, and each NGINX endpoint's
+p50/p99 as the measured latency plus the change in queueing delay along its
+call tree. It also reports the replicas each service needs to stay under
+--max-utilisation (and --p99-ms).
+
+--validate compares the predictions with a Locust latency.json taken at the
+target RPS.
+
+    python capacity_planner.py traces.jsonl.gz --target-rps 500 [--replicas payments-processor=2]
+    python capacity_planner.py --prometheus http://localhost:9090 --range 15m --target-rps 500
+    python capacity_planner.py low-load.jsonl.gz --target-rps 800 --validate /tmp/locust-results/latency.json
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+from collections import defaultdict
+
+from otlp_stream import iter_spans
+from trace_analyzer import ATTEMPT, LogHistogram, TraceAssembler
+
+SPAN_KIND_SERVER = 2
+GATEWAY = "nginx-plus"
+DOCKERFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "app", "Dockerfile")
+
+
+def is_server(span):
+    # Gateway spans count whatever their kind: the collector's
+    # transform/nginx-span-kind exports them as CLIENT spans
+    return span.kind == SPAN_KIND_SERVER or span.service == GATEWAY
+
+
+class NodeStats:
+    # One (service, route): arrivals, self time and end-to-end duration
+    def __init__(self):
+        self.count = 0
+        self.self_sum = 0.0
+        self.self_sq = 0.0
+        self.self_hist = LogHistogram()
+        self.duration_sum = 0.0
+        self.duration_hist = LogHistogram()
+
+    def add(self, self_ms, duration_ms):
+        self.count += 1
+        self.self_sum += self_ms
+        self.self_sq += self_ms * self_ms
+        self.self_hist.add(self_ms)
+        self.duration_sum += duration_ms
+        self.duration_hist.add(duration_ms)
+
+    def summary(self):
+        mean = self.self_sum / self.count
+        variance = max(0.0, self.self_sq / self.count - mean * mean)
+        return {
+            "count": self.count,
+            "self_ms": mean,
+            "self_scv": variance / (mean * mean) if mean else 1.0,
+            "self_p99_ms": self.self_hist.percentile(99),
+            "mean_ms": self.duration_sum / self.count,
+            "p50_ms": self.duration_hist.percentile(50),
+            "p99_ms": self.duration_hist.percentile(99),
+        }
+
+
+class TraceProfiler:
+    def __init__(self):
+        self.nodes = defaultdict(NodeStats)
+        self.edges = defaultdict(lambda: defaultdict(int))
+        self.entries = defaultdict(NodeStats)
+        self.entry_edges = defaultdict(lambda: defaultdict(int))
+        self.retries = defaultdict(lambda: [0, 0])
+        self.first = math.inf
+        self.last = 0
+
+    def add_trace(self, spans):
+        by_id = {s.span_id: s for s in spans}
+        for span in spans:
+            self.first = min(self.first, span.start)
+            self.last = max(self.last, span.end)
+
+        def server_parent(span):
+            # Nearest enclosing server span, and the span the call left from
+            caller, parent = span, by_id.get(span.parent_id)
+            while parent is not None and not is_server(parent):
+                caller, parent = parent, by_id.get(parent.parent_id)
+            return parent, caller
+
+        calls = defaultdict(list)
+        servers = [s for s in spans if is_server(s)]
+        for span in servers:
+            parent, caller = server_parent(span)
+            if parent is not None and span.service != GATEWAY:
+                calls[parent.span_id].append((span, caller))
+
+        children_of = defaultdict(list)
+        for span in spans:
+            if span.parent_id in by_id:
+                children_of[span.parent_id].append(span)
+
+        for span in servers:
+            duration_ms = (span.end - span.start) / 1e6
+            if span.service == GATEWAY:
+                entry = span.name
+                self.entries[entry].add(0.0, duration_ms)
+                for child, _ in calls[span.span_id]:
+                    self.entry_edges[entry][(child.service, child.name)] += 1
+                continue
+            node = (span.service, span.name)
+            waits = sorted((caller.start, caller.end) for _, caller in calls[span.span_id])
+            covered, cursor = 0, span.start
+            for start, end in waits:
+                start, end = max(start, cursor), min(end, span.end)
+                if end > start:
+                    covered += end - start
+                    cursor = end
+            self.nodes[node].add(max(0, span.end - span.start - covered) / 1e6, duration_ms)
+            for child, _ in calls[span.span_id]:
+                self.edges[node][(child.service, child.name)] += 1
+
+        for span in spans:
+            groups = defaultdict(int)
+            for child in children_of[span.span_id]:
+                match = ATTEMPT.match(child.name)
+                if match:
+                    groups[(child.service, match.group(1))] += 1
+            for key, attempts in groups.items():
+                self.retries[key][0] += 1
+                self.retries[key][1] += attempts
+
+    def profile(self):
+        window = max(1e-9, (self.last - self.first) / 1e9)
+        return {
+            "window_s": window,
+            "nodes": {node: stats.summary() for node, stats in self.nodes.items()},
+            "edges": {
+                node: {child: count / self.nodes[node].count for child, count in children.items()}
+                for node, children in self.edges.items()
+            },
+            "entries": {
+                entry: {**stats.summary(), "calls": {
+                    child: count / stats.count for child, count in self.entry_edges[entry].items()
+                }}
+                for entry, stats in self.entries.items()
+            },
+            "retries": {
+                f"{service} {name}": attempts / calls
+                for (service, name), (calls, attempts) in self.retries.items()
+            },
+        }
+
+
+def profile_from_traces(paths, max_open_traces, idle_spans):
+    profiler = TraceProfiler()
+    assembler = TraceAssembler(max_open_traces, idle_spans)
+    for span in iter_spans(paths):
+        for spans in assembler.add(span):
+            profiler.add_trace(spans)
+    for spans in assembler.flush():
+        profiler.add_trace(spans)
+    return profiler.profile()
+
+
+def profile_from_prometheus(url, window):
+    import requests
+
+    def query(expr):
+        resp = requests.get(f"{url.rstrip('/')}/api/v1/query", params={"query": expr}, timeout=30)
+        resp.raise_for_status()
+        return [(r["metric"], float(r["value"][1])) for r in resp.json()["data"]["result"]]
+
+    def per_route(expr):
+        # {(service, span name): value} over server spans and the gateway's
+        # spans, which the collector exports as CLIENT (see is_server)
+        found = {}
+        for selector in ('span_kind="SPAN_KIND_SERVER"', f'service="{GATEWAY}"'):
+            found.update({(m["service"], m["span_name"]): v for m, v in query(expr(selector))})
+        return found
+
+    seconds = _seconds(window)
+    by = "by (service, span_name)"
+    rates = {node: v for node, v in per_route(lambda sel: (
+        f"sum {by} (rate(traces_spanmetrics_calls_total{{{sel}}}[{window}]))")).items() if v > 0}
+    means = {node: v * 1000 for node, v in per_route(lambda sel: (
+        f"sum {by} (rate(traces_spanmetrics_latency_sum{{{sel}}}[{window}])) / "
+        f"sum {by} (rate(traces_spanmetrics_latency_count{{{sel}}}[{window}]))")).items() if not math.isnan(v)}
+    quantiles = {}
+    for pct in (50, 99):
+        quantiles[pct] = {node: v * 1000 for node, v in per_route(lambda sel: (
+            f"histogram_quantile({pct / 100}, sum by (le, service, span_name) "
+            f"(rate(traces_spanmetrics_latency_bucket{{{sel}}}[{window}])))")).items() if not math.isnan(v)}
+    graph = {(m["client"], m["server"]): v for m, v in query(
+        f"sum by (client, server) (rate(traces_service_graph_request_total[{window}]))") if v > 0}
+
+    service_rate = defaultdict(float)
+    for (service, _), rate in rates.items():
+        service_rate[service] += rate
+
+    def calls_from(service):
+        # Per-request calls into each route of each callee, split by the
+        # callee's route mix (the service graph has no routes)
+        calls = {}
+        for (client, callee), rate in graph.items():
+            if client != service or not service_rate[service] or callee == service:
+                continue
+            for (callee_service, name), route_rate in rates.items():
+                if callee_service == callee:
+                    calls[(callee, name)] = rate / service_rate[service] * route_rate / service_rate[callee]
+        return calls
+
+    nodes, edges, entries = {}, {}, {}
+    for node, rate in rates.items():
+        service, name = node
+        summary = {
+            "count": rate * seconds,
+            "mean_ms": means.get(node, 0.0),
+            "p50_ms": quantiles[50].get(node, 0.0),
+            "p99_ms": quantiles[99].get(node, 0.0),
+            "self_scv": 1.0,
+        }
+        if service == GATEWAY:
+            summary["calls"] = {child: v * rate / service_rate[service]
+                                for child, v in calls_from(service).items()}
+            entries[name] = summary
+        else:
+            nodes[node] = summary
+            edges[node] = calls_from(service)
+    # Self time: own latency minus the time spent in callees
+    for node, summary in nodes.items():
+        downstream = sum(v * nodes[child]["mean_ms"] for child, v in edges[node].items() if child in nodes)
+        summary["self_ms"] = max(0.05 * summary["mean_ms"], summary["mean_ms"] - downstream)
+        summary["self_p99_ms"] = summary["self_ms"] * math.log(100)
+    return {"window_s": seconds, "nodes": nodes, "edges": edges, "entries": entries, "retries": {}}
+
+
+def _seconds(window):
+    units = {"s": 1, "m": 60, "h": 3600}
+    return float(window[:-1]) * units[window[-1]] if window[-1] in units else float(window)
+
+
+def erlang_c(servers, offered):
+    # Probability that an arrival waits, for `servers` servers and `offered`
+    # Erlangs of load (offered < servers). From Erlang B by its recurrence,
+    # which stays finite where offered**k / k! overflows (~700 Erlangs)
+    blocking = 1.0
+    for k in range(1, servers + 1):
+        blocking = offered * blocking / (k + offered * blocking)
+    return blocking / (1 - offered / servers * (1 - blocking))
+
+
+def queue(rate, service_ms, scv, servers, ca2=1.0):
+    # Mean and p99 wait (ms) of a G/G/c queue; None once it cannot keep up
+    offered = rate * service_ms / 1000
+    utilisation = offered / servers
+    if utilisation >= 1:
+        return {"utilisation": utilisation, "wait_ms": None, "wait_p99_ms": None}
+    if offered == 0:
+        return {"utilisation": 0.0, "wait_ms": 0.0, "wait_p99_ms": 0.0}
+    waits = erlang_c(servers, offered)
+    variability = (ca2 + scv) / 2
+    drain = (servers - offered) / service_ms        # per ms
+    wait = waits / drain * variability
+    p99 = math.log(waits / 0.01) / drain * variability if waits > 0.01 else 0.0
+    return {"utilisation": utilisation, "wait_ms": wait, "wait_p99_ms": p99}
+
+
+def services_of(profile):
+    services = defaultdict(lambda: {"count": 0.0, "work": 0.0, "work_sq": 0.0, "self_p99_ms": 0.0})
+    for (service, _), node in profile["nodes"].items():
+        s = services[service]
+        s["count"] += node["count"]
+        s["work"] += node["count"] * node["self_ms"]
+        s["work_sq"] += node["count"] * node["self_ms"] ** 2 * (1 + node["self_scv"])
+        s["self_p99_ms"] = max(s["self_p99_ms"], node["self_p99_ms"])
+    for s in services.values():
+        s["service_ms"] = s["work"] / s["count"]
+        second = s["work_sq"] / s["count"]
+        s["scv"] = max(0.0, second / s["service_ms"] ** 2 - 1) if s["service_ms"] else 1.0
+    return services
+
+
+def predict(profile, scale, replicas, workers, ca2, model):
+    services = services_of(profile)
+    window = profile["window_s"]
+    result = {}
+    for name, s in services.items():
+        scv = 1.0 if model == "mmc" else s["scv"]
+        servers = replicas.get(name, 1) * workers
+        rate = s["count"] / window
+        now = queue(rate, s["service_ms"], scv, servers, ca2)
+        then = queue(rate * scale, s["service_ms"], scv, servers, ca2)
+        result[name] = {
+            "rps": rate * scale,
+            "service_ms": s["service_ms"],
+            "scv": scv,
+            "self_p99_ms": s["self_p99_ms"],
+            "replicas": replicas.get(name, 1),
+            "current": now,
+            "target": then,
+        }
+    return result
+
+
+def delays(profile, services):
+    # Extra mean and p99 time per visit of each route: change in waiting
+    # at its own service plus, per visit, the change in its callees
+    mean, tail = {}, {}
+
+    def visit(node, stack=()):
+        if node in mean:
+            return mean[node], tail[node]
+        if node in stack or node not in profile["nodes"]:
+            return 0.0, 0.0
+        s = services[node[0]]
+        if s["target"]["wait_ms"] is None:
+            own, own_p99 = math.inf, math.inf
+        else:
+            own = s["target"]["wait_ms"] - (s["current"]["wait_ms"] or 0.0)
+            own_p99 = s["target"]["wait_p99_ms"] - (s["current"]["wait_p99_ms"] or 0.0)
+        below = sum(v * visit(child, stack + (node,))[0] for child, v in profile["edges"].get(node, {}).items())
+        mean[node], tail[node] = own + below, own_p99 + below
+        return mean[node], tail[node]
+
+    for node in profile["nodes"]:
+        visit(node)
+    return mean, tail
+
+
+def size(service, rate, max_utilisation, p99_ms, workers, ca2):
+    # Fewest replicas that keep utilisation and the local p99 in bounds
+    for n in range(1, 1000):
+        q = queue(rate, service["service_ms"], service["scv"], n * workers, ca2)
+        if q["wait_ms"] is None or q["utilisation"] > max_utilisation:
+            continue
+        if p99_ms and q["wait_p99_ms"] + service["self_p99_ms"] > p99_ms:
+            continue
+        return n
+    return None
+
+
+def plan(profile, target_rps, replicas, workers, ca2, model, max_utilisation, p99_ms):
+    current_rps = sum(e["count"] for e in profile["entries"].values()) / profile["window_s"]
+    if not current_rps:
+        # No gateway spans: scale by the busiest service's arrivals
+        current_rps = max(n["count"] for n in profile["nodes"].values()) / profile["window_s"]
+    scale = target_rps / current_rps if target_rps else 1.0
+    services = predict(profile, scale, replicas, workers, ca2, model)
+    for s in services.values():
+        s["needed"] = size(s, s["rps"], max_utilisation, p99_ms, workers, ca2)
+    mean, tail = delays(profile, services)
+    endpoints = {}
+    for entry, e in profile["entries"].items():
+        extra = sum(v * mean.get(child, 0.0) for child, v in e["calls"].items())
+        extra_p99 = max([tail.get(child, 0.0) for child in e["calls"]] + [0.0])
+        endpoints[entry] = {
+            "rps": e["count"] / profile["window_s"] * scale,
+            "measured_p50_ms": e["p50_ms"],
+            "measured_p99_ms": e["p99_ms"],
+            "p50_ms": e["p50_ms"] + extra,
+            "p99_ms": e["p99_ms"] + max(extra, extra_p99),
+        }
+    return {"current_rps": current_rps, "target_rps": current_rps * scale,
+            "services": services, "endpoints": endpoints, "retries": profile["retries"]}
+
+
+def validate(report, latency_path):
+    # Predicted against observed percentiles for each endpoint of a Locust run
+    with open(latency_path) as f:
+        rows = [r for r in json.load(f)["endpoints"] if r["country"] == "all"]
+    checks = []
+    for entry, predicted in report["endpoints"].items():
+        uri = entry.split(" ", 1)[-1]
+        row = next((r for r in rows if r["name"] == uri or r["name"].endswith(uri)), None)
+        if row is None:
+            continue
+        checks.append({
+            "endpoint": entry,
+            "predicted_p50_ms": predicted["p50_ms"], "observed_p50_ms": row["p50_ms"],
+            "predicted_p99_ms": predicted["p99_ms"], "observed_p99_ms": row["p99_ms"],
+        })
+    return checks
+
+
+def _fmt(value, spec):
+    return "inf" if value is None or math.isinf(value) else format(value, spec)
+
+
+def print_report(report, checks):
+    print(f"current {report['current_rps']:.1f} rps -> target {report['target_rps']:.1f} rps")
+    print(f"\n{'service':<30} {'rps':>8} {'S ms':>7} {'cs2':>5} {'replicas':>8} "
+          f"{'util':>6} {'wait ms':>8} {'wait p99':>8} {'needed':>6}")
+    for name, s in sorted(report["services"].items()):
+        t = s["target"]
+        print(f"{name:<30} {s['rps']:>8.1f} {s['service_ms']:>7.2f} {s['scv']:>5.2f} {s['replicas']:>8} "
+              f"{t['utilisation']:>6.1%} {_fmt(t['wait_ms'], '8.2f'):>8} {_fmt(t['wait_p99_ms'], '8.2f'):>8} "
+              f"{s['needed'] if s['needed'] else '-':>6}")
+    print(f"\n{'endpoint':<60} {'rps':>7} {'p50 now':>8} {'p50':>8} {'p99 now':>8} {'p99':>8}")
+    for name, e in sorted(report["endpoints"].items()):
+        print(f"{name:<60} {e['rps']:>7.1f} {e['measured_p50_ms']:>8.1f} {_fmt(e['p50_ms'], '8.1f'):>8} "
+              f"{e['measured_p99_ms']:>8.1f} {_fmt(e['p99_ms'], '8.1f'):>8}")
+    if report["retries"]:
+        print("\nretry multiplicity (attempts per call):")
+        for name, attempts in sorted(report["retries"].items()):
+            print(f"  {attempts:5.2f}  {name}")
+    if checks:
+        print(f"\n{'validation':<60} {'p50 pred':>8} {'p50 obs':>8} {'p99 pred':>8} {'p99 obs':>8}")
+        for c in checks:
+            print(f"{c['endpoint']:<60} {_fmt(c['predicted_p50_ms'], '8.1f'):>8} {c['observed_p50_ms']:>8.1f} "
+                  f"{_fmt(c['predicted_p99_ms'], '8.1f'):>8} {c['observed_p99_ms']:>8.1f}")
+
+
+def parse_replicas(value):
+    replicas = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, count = item.partition("=")
+        replicas[name] = int(count)
+    return replicas
+
+
+def gunicorn_threads(path=DOCKERFILE, default=64):
+    # Requests one replica serves at once, as the services' image starts Gunicorn
+    try:
+        with open(path) as f:
+            found = re.search(r'"--threads",\s*"(\d+)"', f.read())
+    except OSError:
+        return default
+    return int(found.group(1)) if found else default
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--prometheus", help="read Tempo span metrics from this Prometheus instead")
+    parser.add_argument("--range", default="15m", help="Prometheus rate window")
+    parser.add_argument("--target-rps", type=float, help="gateway requests per second to plan for")
+    parser.add_argument("--replicas", default="", help="current replicas, e.g. payments-processor=2 (default 1)")
+    parser.add_argument("--workers-per-replica", type=int, default=gunicorn_threads(),
+                        help="requests a replica serves at once (default: Gunicorn's threads, %(default)s)")
+    parser.add_argument("--model", choices=("ggc", "mmc"), default="ggc")
+    parser.add_argument("--ca2", type=float, default=1.0, help="squared coefficient of variation of arrivals")
+    parser.add_argument("--max-utilisation", type=float, default=0.7)
+    parser.add_argument("--p99-ms", type=float, help="also keep each service's own p99 under this")
+    parser.add_argument("--max-open-traces", type=int, default=50_000)
+    parser.add_argument("--idle-spans", type=int, default=200_000)
+    parser.add_argument("--validate", help="Locust latency.json recorded at the target RPS")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    if args.prometheus:
+        profile = profile_from_prometheus(args.prometheus, args.range)
+    elif args.files:
+        profile = profile_from_traces(args.files, args.max_open_traces, args.idle_spans)
+    else:
+        parser.error("give trace files or --prometheus")
+    if not profile["nodes"]:
+        sys.exit("no service spans found")
+
+    report = plan(profile, args.target_rps, parse_replicas(args.replicas), args.workers_per_replica,
+                  args.ca2, args.model, args.max_utilisation, args.p99_ms)
+    checks = validate(report, args.validate) if args.validate else []
+    if args.validate and not checks:
+        sys.exit(f"--validate: no endpoint in {args.validate} matches a predicted one "
+                 f"({len(report['endpoints'])} predicted)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({**report, "validation": checks}, f, indent=2, default=str)
+    print_report(report, checks)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
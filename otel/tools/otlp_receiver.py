@@ -0,0 +1,485 @@
+"""
+Local OTLP/HTTP receiver that aggregates spans in memory.
+
+Accepts the protobuf exports the services send to OTEL_EXPORTER_OTLP_ENDPOINT
+(POST /v1/traces, optionally gzipped) without the collector, Tempo or
+Grafana, e.g. for telemetry benchmarks on one machine:
+
+    python otlp_receiver.py --port 4318
+    OTEL_EXPORTER_OTLP_ENDPOINT=http://localhost:4318/v1/traces python app.py
+
+Each export is parsed in one call into the protobuf runtime's C
+implementation, then folded into:
+
+  * rolling RED aggregates per service and per (service, span name): span
+    count, errors and a duration histogram (~1% relative error, see
+    trace_analyzer.LogHistogram) in --slot-seconds slots covering the last
+    --window seconds. At most --max-series names per slot; the rest are
+    counted under "(other)", and how many names that was under
+    other_series in /api/stats.
+  * a ring of the --max-traces most recently started traces, at most
+    --max-spans-per-trace spans each, with --trace-sample keeping a fixed
+    fraction of trace IDs whole.
+
+Memory is bounded by those limits, not by the ingest rate. /v1/metrics and
+/v1/logs are accepted and only counted. Query over HTTP (JSON):
+
+    GET /api/stats                        ingest counters and decode time
+    GET /api/services?window=60           RED per service
+    GET /api/spans?service=&window=60     RED and p50/p90/p99 per span name
+    GET /api/traces?service=&min_ms=&errors=1&limit=20
+    GET /api/traces/<trace id>            the spans of one trace
+
+--bench measures ingest on this machine instead: synthetic exports shaped
+like the services' (--bench-spans spans each) are decoded and aggregated
+in-process, then posted over HTTP by --bench-clients keep-alive clients.
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import ExportTraceServiceRequest
+
+from trace_analyzer import LogHistogram
+
+STATUS_ERROR = 2
+OTHER = "(other)"
+PROTOBUF = "application/x-protobuf"
+
+
+class Series:
+    # RED for one (service, span name) in one slot; the histogram counts the spans
+    __slots__ = ("errors", "duration")
+
+    def __init__(self):
+        self.errors = 0
+        self.duration = LogHistogram()
+
+    @property
+    def count(self):
+        return self.duration.count
+
+    def merge(self, other):
+        self.errors += other.errors
+        self.duration.merge(other.duration)
+
+
+class Receiver:
+    def __init__(self, window=300, slot_seconds=10, max_series=5000, max_traces=1000,
+                 max_spans_per_trace=128, trace_sample=1.0):
+        self.slot_seconds = slot_seconds
+        self.slots = deque(maxlen=max(1, window // slot_seconds))
+        self.max_series = max_series
+        self.max_traces = max_traces
+        self.max_spans_per_trace = max_spans_per_trace
+        # Trace IDs are random, so their last byte picks a fixed fraction
+        self.sample_below = int(trace_sample * 256)
+        self.traces = OrderedDict()
+        # Series in the current slot, and the (service, span name)s it had
+        # no room for, each mapped to its service's OTHER series
+        self.series = 0
+        self.overflow = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "bytes": 0, "spans": 0, "rejected": 0, "other_series": 0,
+                      "evicted_traces": 0, "truncated_spans": 0, "decode_seconds": 0.0,
+                      "aggregate_seconds": 0.0, "signals": {}}
+        self.started = time.time()
+
+    def slot(self, now):
+        # The {service: {span name: Series}} of the current slot
+        slot_id = int(now // self.slot_seconds)
+        if not self.slots or self.slots[-1][0] != slot_id:
+            self.slots.append((slot_id, {}))
+            self.series = 0
+            self.overflow = {}
+        return self.slots[-1][1]
+
+    def add_series(self, service, names, name):
+        # Called with the lock held
+        if self.series >= self.max_series:
+            entry = self.overflow.get((service, name))
+            if entry is not None:
+                return entry
+            self.stats["other_series"] += 1
+            entry = names.get(OTHER)
+            if entry is None:
+                self.series += 1
+                entry = names[OTHER] = Series()
+            if len(self.overflow) < self.max_series:
+                self.overflow[(service, name)] = entry
+            return entry
+        self.series += 1
+        entry = names[name] = Series()
+        return entry
+
+    def ingest(self, body):
+        # Decode one ExportTraceServiceRequest and aggregate it; returns spans.
+        # Every field read creates a Python object, so each span's fields are
+        # read once into locals, and only kept spans read more than RED needs
+        start = time.perf_counter()
+        export = ExportTraceServiceRequest()
+        export.ParseFromString(body)
+        decoded = time.perf_counter()
+        count = 0
+        log, gamma, sample_below = math.log, LogHistogram.GAMMA, self.sample_below
+        with self.lock:
+            slot = self.slot(time.time())
+            for resource_spans in export.resource_spans:
+                service = "unknown"
+                for attr in resource_spans.resource.attributes:
+                    if attr.key == "service.name":
+                        service = attr.value.string_value
+                names = slot.get(service)
+                if names is None:
+                    names = slot[service] = {}
+                for scope_spans in resource_spans.scope_spans:
+                    spans = scope_spans.spans
+                    count += len(spans)
+                    for span in spans:
+                        name = span.name
+                        entry = names.get(name) or self.add_series(service, names, name)
+                        duration_ns = span.end_time_unix_nano - span.start_time_unix_nano
+                        error = span.status.code == STATUS_ERROR
+                        if error:
+                            entry.errors += 1
+                        # LogHistogram.add, inlined
+                        histogram = entry.duration
+                        histogram.buckets[int(log(max(duration_ns / 1e6, 1e-6)) / gamma)] += 1
+                        histogram.count += 1
+                        trace_id = span.trace_id
+                        if trace_id and trace_id[-1] < sample_below:
+                            self.keep(trace_id, span, name, service, duration_ns, error)
+            self.stats["requests"] += 1
+            self.stats["bytes"] += len(body)
+            self.stats["spans"] += count
+            self.stats["decode_seconds"] += decoded - start
+            self.stats["aggregate_seconds"] += time.perf_counter() - decoded
+        return count
+
+    def keep(self, trace_id, span, name, service, duration_ns, error):
+        # Called with the lock held
+        spans = self.traces.get(trace_id)
+        if spans is None:
+            if len(self.traces) >= self.max_traces:
+                self.traces.popitem(last=False)
+                self.stats["evicted_traces"] += 1
+            spans = self.traces[trace_id] = []
+        if len(spans) >= self.max_spans_per_trace:
+            self.stats["truncated_spans"] += 1
+            return
+        spans.append((span.span_id, span.parent_span_id, name, service, span.kind,
+                      span.start_time_unix_nano, duration_ns, error))
+
+    def count_signal(self, path, size):
+        with self.lock:
+            self.stats["signals"][path] = self.stats["signals"].get(path, 0) + 1
+            self.stats["bytes"] += size
+
+    def merged(self, window):
+        # {(service, name): Series} over the slots of the last `window` seconds
+        oldest = int((time.time() - window) // self.slot_seconds)
+        totals = {}
+        with self.lock:
+            for slot_id, slot in self.slots:
+                if slot_id <= oldest:
+                    continue
+                for service, names in slot.items():
+                    for name, entry in names.items():
+                        total = totals.get((service, name))
+                        if total is None:
+                            total = totals[(service, name)] = Series()
+                        total.merge(entry)
+        return totals
+
+    def span_report(self, window, service=None):
+        rows = []
+        for (name_service, name), entry in self.merged(window).items():
+            if service and name_service != service:
+                continue
+            rows.append({"service": name_service, "name": name, **red(entry, window)})
+        return sorted(rows, key=lambda row: -row["count"])
+
+    def service_report(self, window):
+        services = {}
+        for (service, _), entry in self.merged(window).items():
+            services.setdefault(service, Series()).merge(entry)
+        return sorted(({"service": service, **red(entry, window)} for service, entry in services.items()),
+                      key=lambda row: -row["count"])
+
+    def trace_list(self, service=None, min_ms=0, errors=False, limit=20):
+        with self.lock:
+            recent = list(self.traces.items())
+        found = []
+        for trace_id, spans in reversed(recent):
+            summary = trace_summary(trace_id, spans)
+            if service and service not in summary["services"]:
+                continue
+            if summary["duration_ms"] < min_ms or (errors and not summary["errors"]):
+                continue
+            found.append(summary)
+            if len(found) >= limit:
+                break
+        return found
+
+    def trace(self, trace_hex):
+        try:
+            trace_id = bytes.fromhex(trace_hex)
+        except ValueError:
+            return None
+        with self.lock:
+            spans = list(self.traces.get(trace_id, ()))
+        if not spans:
+            return None
+        return {
+            **trace_summary(trace_id, spans),
+            "spans": [{
+                "span_id": span_id.hex(), "parent_id": parent_id.hex(), "name": name, "service": service,
+                "kind": kind, "start_unix_nano": start, "duration_ms": duration / 1e6, "error": error,
+            } for span_id, parent_id, name, service, kind, start, duration, error in sorted(spans, key=lambda s: s[5])],
+        }
+
+    def stats_report(self):
+        with self.lock:
+            stats = dict(self.stats, signals=dict(self.stats["signals"]))
+            stats["traces"] = len(self.traces)
+            stats["series"] = sum(len(names) for _, slot in self.slots for names in slot.values())
+        elapsed = time.time() - self.started
+        stats["uptime_seconds"] = elapsed
+        stats["spans_per_second"] = stats["spans"] / elapsed if elapsed else 0.0
+        return stats
+
+
+def red(entry, window):
+    return {
+        "count": entry.count,
+        "rate": entry.count / window,
+        "errors": entry.errors,
+        "error_rate": entry.errors / entry.count if entry.count else 0.0,
+        "p50_ms": entry.duration.percentile(50),
+        "p90_ms": entry.duration.percentile(90),
+        "p99_ms": entry.duration.percentile(99),
+    }
+
+
+def trace_summary(trace_id, spans):
+    # The root is the span without a parent among the kept spans, else the earliest
+    ids = {span[0] for span in spans}
+    roots = [span for span in spans if span[1] not in ids] or spans
+    root = min(roots, key=lambda span: span[5])
+    end = max(span[5] + span[6] for span in spans)
+    return {
+        "trace_id": trace_id.hex(),
+        "root": f"{root[3]} {root[2]}",
+        "start_unix_nano": root[5],
+        "duration_ms": (end - root[5]) / 1e6,
+        "spans": len(spans),
+        "services": sorted({span[3] for span in spans}),
+        "errors": sum(span[7] for span in spans),
+    }
+
+
+def make_handler(receiver):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, as the exporters' HTTP sessions expect
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status, body=b"", content_type=PROTOBUF):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def reply_json(self, value, status=200):
+            self.reply(status, json.dumps(value, indent=2).encode(), "application/json")
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.headers.get("Content-Encoding") == "gzip":
+                try:
+                    body = gzip.decompress(body)
+                except (OSError, EOFError, zlib.error) as e:
+                    with receiver.lock:
+                        receiver.stats["rejected"] += 1
+                    return self.reply(400, f"cannot decompress body: {e}\n".encode(), "text/plain")
+            path = urlsplit(self.path).path
+            if path in ("/v1/metrics", "/v1/logs"):
+                receiver.count_signal(path, len(body))
+                return self.reply(200)
+            if path != "/v1/traces":
+                return self.reply(404)
+            if not self.headers.get("Content-Type", PROTOBUF).startswith(PROTOBUF):
+                with receiver.lock:
+                    receiver.stats["rejected"] += 1
+                return self.reply(415, b"only application/x-protobuf is supported\n", "text/plain")
+            try:
+                receiver.ingest(body)
+            except Exception as e:
+                with receiver.lock:
+                    receiver.stats["rejected"] += 1
+                return self.reply(400, f"cannot decode export: {e}\n".encode(), "text/plain")
+            # An empty ExportTraceServiceResponse
+            self.reply(200)
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+            window = float(query.get("window", 60))
+            if parts.path == "/api/stats":
+                return self.reply_json(receiver.stats_report())
+            if parts.path == "/api/services":
+                return self.reply_json(receiver.service_report(window))
+            if parts.path == "/api/spans":
+                return self.reply_json(receiver.span_report(window, query.get("service")))
+            if parts.path == "/api/traces":
+                return self.reply_json(receiver.trace_list(
+                    query.get("service"), float(query.get("min_ms", 0)), query.get("errors") == "1",
+                    int(query.get("limit", 20)),
+                ))
+            if parts.path.startswith("/api/traces/"):
+                found = receiver.trace(parts.path.rsplit("/", 1)[1])
+                return self.reply_json(found) if found else self.reply_json({"error": "trace not kept"}, 404)
+            self.reply(404)
+
+    return Handler
+
+
+def serve(receiver, host, port):
+    server = ThreadingHTTPServer((host, port), make_handler(receiver))
+    server.daemon_threads = True
+    return server
+
+
+def synthetic_export(spans, seed=0):
+    # One export shaped like a service's batch: server, internal and client
+    # spans from a handful of traces, with the attributes the SDK sets
+    import random
+
+    from opentelemetry.proto.common.v1.common_pb2 import KeyValue
+    from opentelemetry.proto.trace.v1.trace_pb2 import Status
+
+    rng = random.Random(seed)
+    export = ExportTraceServiceRequest()
+    resource_spans = export.resource_spans.add()
+    resource_spans.resource.attributes.extend([
+        KeyValue(key="service.name", value={"string_value": "payments-processor"}),
+        KeyValue(key="team", value={"string_value": "payments"}),
+    ])
+    scope_spans = resource_spans.scope_spans.add()
+    scope_spans.scope.name = "opentelemetry.instrumentation.flask"
+    now = time.time_ns()
+    names = ["GET /process-gateway", "payments-processor:process-gateway", "call-record-payment-history",
+             "GET", "call-convert-currency", "POST /settle-payment"]
+    for i in range(spans):
+        span = scope_spans.spans.add()
+        span.trace_id = rng.randbytes(16) if i % 6 == 0 else scope_spans.spans[i - 1].trace_id
+        span.span_id = rng.randbytes(8)
+        span.parent_span_id = scope_spans.spans[i - 1].span_id if i % 6 else b""
+        span.name = names[i % len(names)]
+        span.kind = (2, 1, 1, 3, 1, 2)[i % 6]
+        span.start_time_unix_nano = now + i * 1000
+        span.end_time_unix_nano = span.start_time_unix_nano + int(rng.lognormvariate(15, 1))
+        span.attributes.extend([
+            KeyValue(key="http.method", value={"string_value": "GET"}),
+            KeyValue(key="http.target", value={"string_value": "/process-gateway"}),
+            KeyValue(key="http.status_code", value={"int_value": 200}),
+        ])
+        if rng.random() < 0.02:
+            span.status.CopyFrom(Status(code=STATUS_ERROR))
+    return export.SerializeToString()
+
+
+def rss_mib():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def bench(args):
+    import requests
+
+    bodies = [synthetic_export(args.bench_spans, seed) for seed in range(64)]
+    receiver = Receiver(args.window, args.slot_seconds, args.max_series, args.max_traces,
+                        args.max_spans_per_trace, args.trace_sample)
+    start = time.perf_counter()
+    for i in range(args.bench_exports):
+        receiver.ingest(bodies[i % len(bodies)])
+    elapsed = time.perf_counter() - start
+    stats = receiver.stats_report()
+    print(f"in-process: {stats['spans'] / elapsed:,.0f} spans/s "
+          f"({stats['bytes'] / elapsed / 2**20:.1f} MiB/s of protobuf; "
+          f"decode {stats['decode_seconds'] / elapsed:.0%}, aggregate {stats['aggregate_seconds'] / elapsed:.0%}), "
+          f"{stats['traces']} traces kept, RSS {rss_mib():.1f} MiB")
+
+    receiver = Receiver(args.window, args.slot_seconds, args.max_series, args.max_traces,
+                        args.max_spans_per_trace, args.trace_sample)
+    server = serve(receiver, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/traces"
+    per_client = args.bench_exports // args.bench_clients
+
+    def client():
+        with requests.Session() as session:
+            for i in range(per_client):
+                session.post(url, data=bodies[i % len(bodies)], headers={"Content-Type": PROTOBUF}).raise_for_status()
+
+    threads = [threading.Thread(target=client) for _ in range(args.bench_clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    spans = receiver.stats_report()["spans"]
+    print(f"over HTTP ({args.bench_clients} clients, same process): {spans / elapsed:,.0f} spans/s, "
+          f"{per_client * args.bench_clients / elapsed:,.0f} exports/s")
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--window", type=int, default=300, help="seconds of aggregates kept")
+    parser.add_argument("--slot-seconds", type=int, default=10)
+    parser.add_argument("--max-series", type=int, default=5000, help="(service, span name) pairs per slot")
+    parser.add_argument("--max-traces", type=int, default=1000)
+    parser.add_argument("--max-spans-per-trace", type=int, default=128)
+    parser.add_argument("--trace-sample", type=float, default=1.0, help="fraction of trace IDs kept in the ring")
+    parser.add_argument("--bench", action="store_true", help="measure ingest throughput and exit")
+    parser.add_argument("--bench-exports", type=int, default=2000)
+    parser.add_argument("--bench-spans", type=int, default=512, help="spans per synthetic export")
+    parser.add_argument("--bench-clients", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.bench:
+        return bench(args)
+    receiver = Receiver(args.window, args.slot_seconds, args.max_series, args.max_traces,
+                        args.max_spans_per_trace, args.trace_sample)
+    server = serve(receiver, args.host, args.port)
+    print(f"OTLP/HTTP receiver on {args.host}:{args.port} (pid {os.getpid()})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Streaming readers for exported OTLP trace data.
+
+Supported inputs (optionally gzipped):
+  * .json / .jsonl  one ExportTraceServiceRequest per line in OTLP/JSON, as
+                    written by the collector's file exporter (format: json)
+  * .pb / .binpb    length-delimited ExportTraceServiceRequest messages
+                    (4-byte big-endian size prefix, file exporter format: proto)
+
+Only one export batch is decoded at a time, so file size does not matter.
+"""
+import base64
+import gzip
+import json
+import struct
+from collections import namedtuple
+
+Span = namedtuple("Span", "trace_id span_id parent_id name service kind start end error")
+
+SPAN_KIND = {
+    "SPAN_KIND_UNSPECIFIED": 0, "SPAN_KIND_INTERNAL": 1, "SPAN_KIND_SERVER": 2,
+    "SPAN_KIND_CLIENT": 3, "SPAN_KIND_PRODUCER": 4, "SPAN_KIND_CONSUMER": 5,
+}
+STATUS_ERROR = 2
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _base_name(path):
+    return path[:-3] if path.endswith(".gz") else path
+
+
+def _span_service(span_attrs, resource_service):
+    # NGINX sets service.name as a span attribute as well as on the resource
+    return span_attrs.get("service.name") or resource_service or "unknown"
+
+
+def _json_id(value):
+    # OTLP/JSON uses hex ids; plain protobuf JSON mapping uses base64
+    if not value:
+        return ""
+    if len(value) in (16, 32) and all(c in "0123456789abcdefABCDEF" for c in value):
+        return value.lower()
+    return base64.b64decode(value).hex()
+
+
+def _json_attrs(items, keys=("service.name",)):
+    attrs = {}
+    for item in items:
+        if item.get("key") in keys:
+            attrs[item["key"]] = next(iter(item.get("value", {}).values()), None)
+    return attrs
+
+
+def iter_json_spans(path):
+    with _open(path, "rt") as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+            for resource_spans in json.loads(line).get("resourceSpans", []):
+                resource = _json_attrs(resource_spans.get("resource", {}).get("attributes", []))
+                for scope_spans in resource_spans.get("scopeSpans", []):
+                    for span in scope_spans.get("spans", []):
+                        attrs = _json_attrs(span.get("attributes", []))
+                        kind = span.get("kind", 0)
+                        yield Span(
+                            _json_id(span.get("traceId")),
+                            _json_id(span.get("spanId")),
+                            _json_id(span.get("parentSpanId")),
+                            span.get("name", ""),
+                            _span_service(attrs, resource.get("service.name")),
+                            SPAN_KIND.get(kind, kind) if isinstance(kind, str) else kind,
+                            int(span.get("startTimeUnixNano", 0)),
+                            int(span.get("endTimeUnixNano", 0)),
+                            span.get("status", {}).get("code") in (STATUS_ERROR, "STATUS_CODE_ERROR"),
+                        )
+
+
+def iter_proto_spans(path):
+    from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import ExportTraceServiceRequest
+
+    with _open(path, "rb") as f:
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return
+            (size,) = struct.unpack(">I", header)
+            export = ExportTraceServiceRequest()
+            export.ParseFromString(f.read(size))
+            for resource_spans in export.resource_spans:
+                resource_service = None
+                for attr in resource_spans.resource.attributes:
+                    if attr.key == "service.name":
+                        resource_service = attr.value.string_value
+                for scope_spans in resource_spans.scope_spans:
+                    for span in scope_spans.spans:
+                        service = resource_service
+                        for attr in span.attributes:
+                            if attr.key == "service.name":
+                                service = attr.value.string_value
+                        yield Span(
+                            span.trace_id.hex(), span.span_id.hex(), span.parent_span_id.hex(),
+                            span.name, service or "unknown", span.kind,
+                            span.start_time_unix_nano, span.end_time_unix_nano,
+                            span.status.code == STATUS_ERROR,
+                        )
+
+
+def iter_spans(paths):
+    for path in paths:
+        if _base_name(path).endswith((".json", ".jsonl")):
+            yield from iter_json_spans(path)
+        else:
+            yield from iter_proto_spans(path)
@@ -0,0 +1,51 @@
+import gzip
+import threading
+
+import pytest
+import requests
+
+import otlp_receiver
+
+NAMES = 6  # span names in otlp_receiver.synthetic_export
+
+
+@pytest.fixture
+def server():
+    receiver = otlp_receiver.Receiver()
+    server = otlp_receiver.serve(receiver, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield receiver, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, body, **headers):
+    return requests.post(url + "/v1/traces", data=body,
+                         headers={"Content-Type": otlp_receiver.PROTOBUF, **headers}, timeout=5)
+
+
+def test_gzipped_export_is_ingested(server):
+    receiver, url = server
+    assert post(url, gzip.compress(otlp_receiver.synthetic_export(60)), **{"Content-Encoding": "gzip"}).status_code == 200
+    assert receiver.stats["spans"] == 60
+
+
+def test_bad_gzip_is_rejected(server):
+    receiver, url = server
+    resp = post(url, b"not gzip at all", **{"Content-Encoding": "gzip"})
+    assert resp.status_code == 400
+    assert receiver.stats["rejected"] == 1
+    resp = post(url, gzip.compress(otlp_receiver.synthetic_export(60))[:-10], **{"Content-Encoding": "gzip"})
+    assert resp.status_code == 400
+
+
+def test_overflow_counts_series_not_spans():
+    receiver = otlp_receiver.Receiver(max_series=NAMES - 2)
+    for seed in range(5):
+        receiver.ingest(otlp_receiver.synthetic_export(60, seed))
+    rows = {row["name"]: row["count"] for row in receiver.span_report(300)}
+    # Four names, then (other) takes the slot's last series and every span of the other two
+    assert len(rows) == NAMES - 1
+    assert rows[otlp_receiver.OTHER] == 2 * 5 * 60 // NAMES
+    assert receiver.stats["other_series"] == 2
+    assert sum(rows.values()) == 5 * 60
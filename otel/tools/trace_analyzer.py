@@ -0,0 +1,272 @@
+"""
+Offline critical-path and fan-out analysis over exported traces.
+
+Reads OTLP JSON or protobuf exports (see otlp_stream.py), rebuilds each
+trace from the nginx-plus and service spans, and aggregates per root
+endpoint (the NGINX span name, e.g. "GET /api/payments/orchestrator/initiate-transfer"):
+
+  * critical path: how much of the end-to-end latency each span name is
+    responsible for, i.e. time on the longest blocking chain
+  * self time per span name, excluding time covered by its children
+  * downstream call amplification: server spans per root request, by service
+  * retry multiplicity: attempts per logical call for retried calls
+    (e.g. call-process-gateway-attempt-N in payments-processor)
+
+Spans are grouped in a bounded set of open traces. A trace is finished once
+no span has arrived for it within the last --idle-spans spans, or when it is
+the oldest of --max-open-traces, so memory stays flat for any input size.
+
+    python trace_analyzer.py traces.jsonl.gz [more files...] [--json report.json]
+"""
+import argparse
+import json
+import math
+import re
+import sys
+from collections import OrderedDict, defaultdict
+
+from otlp_stream import iter_spans
+
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+ATTEMPT = re.compile(r"^(.*)-attempt-(\d+)$")
+
+
+class LogHistogram:
+    # ~1% relative error buckets; mergeable and a few hundred entries at most
+    GAMMA = math.log(1.02)
+
+    def __init__(self):
+        self.buckets = defaultdict(int)
+        self.count = 0
+
+    def add(self, value):
+        self.buckets[int(math.log(max(value, 1e-6)) / self.GAMMA)] += 1
+        self.count += 1
+
+    def merge(self, other):
+        for key, count in other.buckets.items():
+            self.buckets[key] += count
+        self.count += other.count
+
+    def percentile(self, pct):
+        if not self.count:
+            return 0.0
+        target = self.count * pct / 100
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen >= target:
+                return math.exp((key + 0.5) * self.GAMMA)
+        return 0.0
+
+
+class TraceAssembler:
+    def __init__(self, max_open_traces, idle_spans):
+        self.max_open = max_open_traces
+        self.idle_spans = idle_spans
+        self.open = OrderedDict()
+        self.seq = 0
+
+    def add(self, span):
+        """Add a span; yields the traces that are considered complete."""
+        self.seq += 1
+        entry = self.open.pop(span.trace_id, None)
+        if entry is None:
+            entry = [0, []]
+        entry[0] = self.seq
+        entry[1].append(span)
+        self.open[span.trace_id] = entry
+
+        # Oldest activity is at the front of the OrderedDict
+        while self.open:
+            trace_id, (last_seen, spans) = next(iter(self.open.items()))
+            if len(self.open) > self.max_open or self.seq - last_seen > self.idle_spans:
+                del self.open[trace_id]
+                yield spans
+            else:
+                break
+
+    def flush(self):
+        while self.open:
+            yield self.open.popitem(last=False)[1][1]
+
+
+def span_key(span):
+    return f"{span.service} {span.name}"
+
+
+def find_root(spans, by_id):
+    orphans = [s for s in spans if not s.parent_id or s.parent_id not in by_id]
+    return min(orphans, key=lambda s: (s.start, -s.end)) if orphans else None
+
+
+def self_times(span, children):
+    # Span duration minus the union of its children's intervals
+    covered, cursor = 0, span.start
+    for child in sorted(children, key=lambda c: c.start):
+        start, end = max(child.start, cursor), min(child.end, span.end)
+        if end > start:
+            covered += end - start
+            cursor = end
+    return max(0, span.end - span.start - covered)
+
+
+def critical_path(span, children_of, end_limit, out):
+    # Walk back from the span's end, always descending into the child that
+    # finished last before the cursor; uncovered gaps belong to the span itself
+    cursor = min(span.end, end_limit)
+    pending = sorted(children_of.get(span.span_id, ()), key=lambda c: c.end, reverse=True)
+    for child in pending:
+        if child.start >= cursor:
+            continue
+        child_end = min(child.end, cursor)
+        out[span_key(span)] += cursor - child_end
+        critical_path(child, children_of, child_end, out)
+        cursor = max(child.start, span.start)
+        if cursor <= span.start:
+            break
+    out[span_key(span)] += max(0, cursor - span.start)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.traces = 0
+        self.latency = LogHistogram()
+        self.critical = defaultdict(int)
+        self.self_time = defaultdict(int)
+        self.server_calls = defaultdict(int)
+        self.downstream = 0
+        self.errors = 0
+        # base call name -> [logical calls, attempts, retried calls]
+        self.retries = defaultdict(lambda: [0, 0, 0])
+
+    def add(self, root, spans, children_of):
+        self.traces += 1
+        self.latency.add((root.end - root.start) / 1e6)
+        self.errors += any(s.error for s in spans)
+
+        path = defaultdict(int)
+        critical_path(root, children_of, root.end, path)
+        for key, ns in path.items():
+            self.critical[key] += ns
+
+        by_id = {s.span_id: s for s in spans}
+        for span in spans:
+            self.self_time[span_key(span)] += self_times(span, children_of.get(span.span_id, ()))
+            parent = by_id.get(span.parent_id)
+            # A service call is a server span, or whatever a client span led to
+            is_call = span.kind == SPAN_KIND_SERVER or (parent and parent.kind == SPAN_KIND_CLIENT)
+            if is_call and span is not root:
+                self.server_calls[span.service] += 1
+                self.downstream += 1
+
+        for parent_id, children in children_of.items():
+            groups = defaultdict(int)
+            for child in children:
+                match = ATTEMPT.match(child.name)
+                if match:
+                    groups[(child.service, match.group(1))] += 1
+                elif child.kind == SPAN_KIND_CLIENT:
+                    groups[(child.service, child.name)] += 1
+            for (service, name), attempts in groups.items():
+                stats = self.retries[f"{service} {name}"]
+                stats[0] += 1
+                stats[1] += attempts
+                stats[2] += attempts > 1
+
+    def report(self, top):
+        total_ns = sum(self.critical.values()) or 1
+        return {
+            "traces": self.traces,
+            "errors": self.errors,
+            "p50_ms": self.latency.percentile(50),
+            "p99_ms": self.latency.percentile(99),
+            "downstream_calls_per_request": self.downstream / self.traces,
+            "critical_path": [
+                {"span": key, "share": ns / total_ns, "ms_per_request": ns / 1e6 / self.traces}
+                for key, ns in sorted(self.critical.items(), key=lambda kv: -kv[1])[:top]
+            ],
+            "self_time": [
+                {"span": key, "ms_per_request": ns / 1e6 / self.traces}
+                for key, ns in sorted(self.self_time.items(), key=lambda kv: -kv[1])[:top]
+            ],
+            "amplification": {
+                service: calls / self.traces
+                for service, calls in sorted(self.server_calls.items(), key=lambda kv: -kv[1])
+            },
+            "retries": {
+                name: {"attempts_per_call": attempts / calls, "retried_fraction": retried / calls}
+                for name, (calls, attempts, retried) in sorted(self.retries.items())
+                if retried
+            },
+        }
+
+
+def analyze(paths, max_open_traces, idle_spans):
+    assembler = TraceAssembler(max_open_traces, idle_spans)
+    endpoints = defaultdict(EndpointStats)
+    span_count = 0
+
+    def finish(spans):
+        by_id = {s.span_id: s for s in spans}
+        root = find_root(spans, by_id)
+        if root is None:
+            return
+        children_of = defaultdict(list)
+        for span in spans:
+            if span.parent_id in by_id:
+                children_of[span.parent_id].append(span)
+        endpoints[root.name].add(root, spans, children_of)
+
+    for span in iter_spans(paths):
+        span_count += 1
+        for spans in assembler.add(span):
+            finish(spans)
+    for spans in assembler.flush():
+        finish(spans)
+    return span_count, endpoints
+
+
+def print_report(span_count, reports):
+    print(f"{span_count} spans, {sum(r['traces'] for r in reports.values())} traces")
+    for endpoint, r in sorted(reports.items(), key=lambda kv: -kv[1]["traces"]):
+        print(f"\n{endpoint}  traces={r['traces']} errors={r['errors']} "
+              f"p50={r['p50_ms']:.1f}ms p99={r['p99_ms']:.1f}ms "
+              f"downstream calls/request={r['downstream_calls_per_request']:.1f}")
+        print("  critical path:")
+        for item in r["critical_path"]:
+            print(f"    {item['share']:6.1%} {item['ms_per_request']:9.2f}ms  {item['span']}")
+        print("  self time:")
+        for item in r["self_time"]:
+            print(f"           {item['ms_per_request']:9.2f}ms  {item['span']}")
+        print("  amplification (server spans per request):")
+        for service, calls in r["amplification"].items():
+            print(f"    {calls:6.2f}  {service}")
+        if r["retries"]:
+            print("  retries:")
+            for name, stats in r["retries"].items():
+                print(f"    {stats['attempts_per_call']:.2f} attempts/call, "
+                      f"{stats['retried_fraction']:.1%} retried  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--max-open-traces", type=int, default=50_000)
+    parser.add_argument("--idle-spans", type=int, default=200_000,
+                        help="finish a trace after this many spans without new spans for it")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    span_count, endpoints = analyze(args.files, args.max_open_traces, args.idle_spans)
+    reports = {name: stats.report(args.top) for name, stats in endpoints.items()}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"spans": span_count, "endpoints": reports}, f, indent=2)
+    print_report(span_count, reports)
+
+
+if __name__ == "__main__":
+    sys.exit(main())